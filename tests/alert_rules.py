@@ -0,0 +1,416 @@
+import re
+
+import yaml
+
+import util
+
+from alerts import parse_duration
+
+
+# Offline evaluation of deploy/prometheus/prometheus-alert-rules.yaml against synthetic time series.
+# Implements the part of PromQL the rules use: selectors with label matchers, range selectors, increase(), delta()
+# and rate(), arithmetic, comparisons (with chaining and `bool`), and/or/unless, and the pending/firing life cycle
+# of alerting rules with their `for:` durations on a simulated clock.
+
+rules_file = "../deploy/prometheus/prometheus-alert-rules.yaml"
+# Prometheus defaults, samples older than lookback are stale, rules are evaluated every interval
+lookback = 300
+evaluation_interval = 30
+scrape_interval = 15
+
+
+class ParseError(Exception):
+    pass
+
+
+class EvaluationError(Exception):
+    pass
+
+
+class Series:
+    """Samples of one time series, values[i] is scraped at start + i * step, None is a missed scrape"""
+
+    def __init__(self, name, values, labels=None, start=0, step=scrape_interval):
+        self.labels = dict(labels or {}, __name__=name)
+        self.samples = [(start + i * step, float(v)) for i, v in enumerate(values) if v is not None]
+
+    def instant(self, t):
+        # latest sample not older than lookback
+        for ts, value in reversed(self.samples):
+            if ts <= t:
+                return value if ts > t - lookback else None
+        return None
+
+    def range(self, t, duration):
+        return [(ts, value) for ts, value in self.samples if t - duration < ts <= t]
+
+
+_token = re.compile(r"""
+    \s*(?:
+        (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+      | (?P<ident>[a-zA-Z_:][a-zA-Z0-9_:]*)
+      | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<op>==|!=|<=|>=|=~|!~|[-+*/%^<>=(){}\[\],])
+    )""", re.X)
+
+
+def tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        match = _token.match(expr, pos)
+        if match is None or match.end() == pos:
+            raise ParseError(f"unexpected {expr[pos:pos + 20]!r} at {pos} in {expr!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+class Parser:
+    comparisons = ("==", "!=", "<=", "<", ">=", ">")
+    functions = ("increase", "delta", "rate")
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = tokenize(expr)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, text = self.peek()
+        if kind is None or (value is not None and text != value):
+            raise ParseError(f"expected {value or 'more input'} at token {self.pos} of {self.expr!r}, got {text!r}")
+        self.pos += 1
+        return kind, text
+
+    def accept(self, *values):
+        kind, text = self.peek()
+        if kind in ("op", "ident") and text in values:
+            self.pos += 1
+            return text
+        return None
+
+    def parse(self):
+        node = self.binary(0)
+        if self.pos != len(self.tokens):
+            raise ParseError(f"unexpected {self.peek()[1]!r} at token {self.pos} of {self.expr!r}")
+        return node
+
+    # lowest precedence first, every level is left associative
+    levels = (("or",), ("and", "unless"), comparisons, ("+", "-"), ("*", "/", "%"))
+
+    def binary(self, level):
+        if level == len(self.levels):
+            return self.unary()
+        node = self.binary(level + 1)
+        while True:
+            op = self.accept(*self.levels[level])
+            if op is None:
+                return node
+            return_bool = op in self.comparisons and self.accept("bool") is not None
+            node = ("binary", op, node, self.binary(level + 1), return_bool)
+
+    def unary(self):
+        op = self.accept("-", "+")
+        if op is not None:
+            operand = self.unary()
+            return ("binary", "*", ("number", -1.0 if op == "-" else 1.0), operand, False)
+        node = self.primary()
+        if self.accept("^") is not None:
+            # right associative
+            node = ("binary", "^", node, self.unary(), False)
+        return node
+
+    def primary(self):
+        kind, text = self.peek()
+        if kind == "number":
+            self.take()
+            return ("number", float(text))
+        if text == "(":
+            self.take("(")
+            node = self.binary(0)
+            self.take(")")
+            return node
+        if kind == "ident" and self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1][1] == "(":
+            if text not in self.functions:
+                raise ParseError(f"unsupported function {text} in {self.expr!r}")
+            self.take()
+            self.take("(")
+            argument = self.binary(0)
+            self.take(")")
+            if argument[0] != "selector" or argument[3] is None:
+                raise ParseError(f"{text}() expects a range selector in {self.expr!r}")
+            return ("call", text, argument)
+        if kind == "ident" or text == "{":
+            return self.selector()
+        raise ParseError(f"unexpected {text!r} at token {self.pos} of {self.expr!r}")
+
+    def selector(self):
+        name = None
+        if self.peek()[0] == "ident":
+            name = self.take()[1]
+        matchers = []
+        if self.accept("{") is not None:
+            while self.accept("}") is None:
+                label = self.take()[1]
+                op = self.take()[1]
+                if op not in ("=", "!=", "=~", "!~"):
+                    raise ParseError(f"unexpected matcher {op!r} in {self.expr!r}")
+                kind, value = self.take()
+                if kind != "string":
+                    raise ParseError(f"label value of {label} should be quoted in {self.expr!r}")
+                matchers.append((label, op, re.sub(r"\\(.)", r"\1", value[1:-1])))
+                self.accept(",")
+        if name is not None:
+            matchers.append(("__name__", "=", name))
+        duration = None
+        if self.accept("[") is not None:
+            text = ""
+            while self.accept("]") is None:
+                text += self.take()[1]
+            duration = parse_duration(text)
+        return ("selector", name, matchers, duration)
+
+
+def parse(expr):
+    return Parser(expr).parse()
+
+
+def matches(labels, matchers):
+    for label, op, value in matchers:
+        current = labels.get(label, "")
+        if op == "=" and current != value or op == "!=" and current == value:
+            return False
+        if op == "=~" and re.fullmatch(value, current) is None or op == "!~" and re.fullmatch(value, current) is not None:
+            return False
+    return True
+
+
+def signature(labels):
+    return frozenset((k, v) for k, v in labels.items() if k != "__name__")
+
+
+def without_name(labels):
+    return {k: v for k, v in labels.items() if k != "__name__"}
+
+
+def extrapolated(samples, t, duration, counter):
+    # increase() and delta() of Prometheus: the change between the first and last sample in the window,
+    # with counter resets accounted for and extrapolated to the window boundaries
+    if len(samples) < 2:
+        return None
+    first_ts, first = samples[0]
+    last_ts, last = samples[-1]
+    change = last - first
+    if counter:
+        for (_, previous), (_, current) in zip(samples, samples[1:]):
+            if current < previous:
+                change += previous
+    to_start = first_ts - (t - duration)
+    to_end = t - last_ts
+    sampled = last_ts - first_ts
+    average = sampled / (len(samples) - 1)
+    if counter and change > 0 and first >= 0:
+        to_start = min(to_start, sampled * (first / change))
+    threshold = average * 1.1
+    interval = sampled
+    interval += to_start if to_start < threshold else average / 2
+    interval += to_end if to_end < threshold else average / 2
+    return change * interval / sampled
+
+
+comparisons = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<=": lambda a, b: a <= b,
+    "<": lambda a, b: a < b,
+    ">=": lambda a, b: a >= b,
+    ">": lambda a, b: a > b,
+}
+
+arithmetic = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b if b != 0 else (float("nan") if a == 0 else float("inf") * (1 if a > 0 else -1)),
+    "%": lambda a, b: a % b if b != 0 else float("nan"),
+    "^": lambda a, b: a ** b,
+}
+
+
+def evaluate(node, series, t):
+    # Returns a float for scalars, a list of (labels, value) for instant vectors
+    kind = node[0]
+    if kind == "number":
+        return node[1]
+    if kind == "selector":
+        _, _, matchers, duration = node
+        if duration is not None:
+            raise EvaluationError("range vectors are only supported as function arguments")
+        vector = []
+        for s in series:
+            if matches(s.labels, matchers):
+                value = s.instant(t)
+                if value is not None:
+                    vector.append((s.labels, value))
+        return vector
+    if kind == "call":
+        _, function, (_, _, matchers, duration) = node
+        vector = []
+        for s in series:
+            if not matches(s.labels, matchers):
+                continue
+            value = extrapolated(s.range(t, duration), t, duration, counter=function != "delta")
+            if value is not None:
+                vector.append((without_name(s.labels), value / duration if function == "rate" else value))
+        return vector
+    _, op, lhs, rhs, return_bool = node
+    return binary(op, evaluate(lhs, series, t), evaluate(rhs, series, t), return_bool)
+
+
+def binary(op, lhs, rhs, return_bool=False):
+    scalar_lhs, scalar_rhs = isinstance(lhs, float), isinstance(rhs, float)
+    if op in ("and", "or", "unless"):
+        if scalar_lhs or scalar_rhs:
+            raise EvaluationError(f"{op} is only defined between vectors")
+        rhs_signatures = {signature(labels) for labels, _ in rhs}
+        if op == "and":
+            return [(labels, value) for labels, value in lhs if signature(labels) in rhs_signatures]
+        if op == "unless":
+            return [(labels, value) for labels, value in lhs if signature(labels) not in rhs_signatures]
+        lhs_signatures = {signature(labels) for labels, _ in lhs}
+        return lhs + [(labels, value) for labels, value in rhs if signature(labels) not in lhs_signatures]
+
+    def apply(labels, a, b, value):
+        # one result element of a vector operation, None when a comparison filters it out
+        if op in arithmetic:
+            return without_name(labels), arithmetic[op](a, b)
+        if return_bool:
+            return without_name(labels), float(comparisons[op](a, b))
+        return (labels, value) if comparisons[op](a, b) else None
+
+    if scalar_lhs and scalar_rhs:
+        if op in comparisons and not return_bool:
+            raise EvaluationError("comparisons between scalars must use bool")
+        return arithmetic[op](lhs, rhs) if op in arithmetic else float(comparisons[op](lhs, rhs))
+    if scalar_rhs:
+        result = [apply(labels, value, rhs, value) for labels, value in lhs]
+    elif scalar_lhs:
+        result = [apply(labels, lhs, value, value) for labels, value in rhs]
+    else:
+        # one-to-one matching on all labels but the metric name
+        rhs_by_signature = {}
+        for labels, value in rhs:
+            if signature(labels) in rhs_by_signature:
+                raise EvaluationError(f"many-to-many matching for {dict(signature(labels))}")
+            rhs_by_signature[signature(labels)] = value
+        result = [
+            apply(labels, value, rhs_by_signature[signature(labels)], value)
+            for labels, value in lhs if signature(labels) in rhs_by_signature
+        ]
+    return [element for element in result if element is not None]
+
+
+class Rule:
+    def __init__(self, name, expr, duration=0, labels=None, annotations=None, group=""):
+        self.name = name
+        self.expr = expr
+        self.duration = duration
+        self.labels = labels or {}
+        self.annotations = annotations or {}
+        self.group = group
+        self.ast = parse(expr)
+
+    def __repr__(self):
+        return f"Rule({self.name!r}, {self.expr!r}, for={self.duration})"
+
+
+def load_rules(path=rules_file):
+    # Alerting rules of a PrometheusRule manifest, in file order. Names are not unique in the file.
+    with open(util.get_full_path(path)) as f:
+        manifest = yaml.safe_load(f)
+    rules = []
+    for group in manifest["spec"]["groups"]:
+        for rule in group["rules"]:
+            if "alert" not in rule:
+                continue
+            rules.append(Rule(
+                rule["alert"], str(rule["expr"]), parse_duration(rule["for"]) if "for" in rule else 0,
+                rule.get("labels"), rule.get("annotations"), group["name"],
+            ))
+    return rules
+
+
+class Timeline:
+    """Alert state transitions of a simulated run: {"time", "alert", "labels", "state"}, state is pending,
+    firing or inactive"""
+
+    def __init__(self):
+        self.events = []
+        self.evaluations = 0
+
+    def transitions(self, alert, labels=None):
+        return [
+            e for e in self.events
+            if e["alert"] == alert and all(e["labels"].get(k) == v for k, v in (labels or {}).items())
+        ]
+
+    def first(self, alert, state="firing", labels=None, after=None):
+        # time of the first transition into state, None when it never happened
+        for e in self.transitions(alert, labels):
+            if e["state"] == state and (after is None or e["time"] >= after):
+                return e["time"]
+        return None
+
+    def state(self, alert, t, labels=None):
+        # state at evaluation time t, every label combination of the alert together: firing wins over pending
+        states = {}
+        for e in self.transitions(alert, labels):
+            if e["time"] <= t:
+                states[frozenset(e["labels"].items())] = e["state"]
+        for state in ("firing", "pending"):
+            if state in states.values():
+                return state
+        return "inactive"
+
+    def fired(self):
+        return sorted({e["alert"] for e in self.events if e["state"] == "firing"})
+
+
+class Engine:
+    def __init__(self, rules=None, interval=evaluation_interval):
+        self.rules = load_rules() if rules is None else rules
+        self.interval = interval
+
+    def run(self, series, end, start=0):
+        # Evaluates every rule at start, start + interval, ... end against series, returns the Timeline
+        timeline = Timeline()
+        active = {}
+        t = start
+        while t <= end:
+            timeline.evaluations += 1
+            for index, rule in enumerate(self.rules):
+                result = evaluate(rule.ast, series, t)
+                if isinstance(result, float):
+                    raise EvaluationError(f"{rule.name}: expression returned a scalar")
+                current = set()
+                for labels, _ in result:
+                    labels = dict(without_name(labels), **rule.labels, alertname=rule.name)
+                    key = (index, frozenset(labels.items()))
+                    current.add(key)
+                    if key not in active:
+                        active[key] = {"active_at": t, "state": "pending"}
+                        timeline.events.append({"time": t, "alert": rule.name, "labels": labels, "state": "pending"})
+                    alert = active[key]
+                    if alert["state"] == "pending" and t - alert["active_at"] >= rule.duration:
+                        alert["state"] = "firing"
+                        timeline.events.append({"time": t, "alert": rule.name, "labels": labels, "state": "firing"})
+                for key in [k for k in active if k[0] == index and k not in current]:
+                    active.pop(key)
+                    timeline.events.append({"time": t, "alert": rule.name, "labels": dict(key[1]), "state": "inactive"})
+            t += self.interval
+        return timeline
@@ -0,0 +1,378 @@
+import atexit
+import datetime
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+import clickhouse_http
+import kubeapi
+import settings
+
+
+# Prometheus ALERTS for the waits of test_metrics_alerts.py.
+# One background poller fetches every ALERTS series once per tick over a pooled connection (a `kubectl port-forward`
+# to the Prometheus pod, or settings.prometheus_url) and evaluates the conditions of all waiters against that result,
+# so any number of concurrent waits costs one request per interval.
+
+
+class Unavailable(Exception):
+    pass
+
+
+def parse_duration(value):
+    # Prometheus durations like "30s", "1m" or "1h30m", in seconds
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+    parts = re.findall(r"(\d+)(ms|[smhdwy])", value)
+    if len(parts) == 0 or "".join(n + u for n, u in parts) != value:
+        raise ValueError(f"invalid duration {value}")
+    return sum(int(n) * units[u] for n, u in parts)
+
+
+def parse_timestamp(value):
+    # RFC 3339 times of the Prometheus API like "2020-09-01T10:00:00.123456789Z", in seconds since the epoch
+    match = re.match(r"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)$", value)
+    if match is None:
+        raise ValueError(f"invalid timestamp {value}")
+    seconds, fraction, zone = match.groups()
+    t = datetime.datetime.fromisoformat(seconds + ("+00:00" if zone == "Z" else zone)).timestamp()
+    return t + float("0." + fraction) if fraction else t
+
+
+class Timing:
+    """Fault injection, first pending and firing sample, recovery and last firing sample of one alert occurrence"""
+
+    def __init__(self, alert_name, labels, fault=None):
+        self.alert_name = alert_name
+        self.labels = dict(labels)
+        self.fault = fault
+        self.pending = None
+        self.firing = None
+        self.recovered = None
+        self.resolved = None
+
+    def observe(self, alerts, now):
+        # Live estimate from the polled ALERTS[range] windows: a state which began before the window of the poll
+        # that first saw it gets the window edge. fetch() replaces the estimate with the real transitions.
+        for labels, first, last in alerts.get(self.alert_name, []):
+            if not all(labels.get(k) == v for k, v in self.labels.items()):
+                continue
+            state = labels.get("alertstate")
+            if state in ("pending", "firing") and last >= (self.fault or 0):
+                first = max(first, self.fault or 0)
+                if getattr(self, state) is None or first < getattr(self, state):
+                    setattr(self, state, first)
+            if state == "firing" and self.firing is not None:
+                self.resolved = max(self.resolved or 0, last)
+
+    def fetch(self, poller, now=None):
+        # Every raw ALERTS sample since the fault, the first one of each state is the rule evaluation it began at
+        if self.fault is None:
+            return
+        now = now or time.time()
+        alerts = {self.alert_name: poller.samples(self.alert_name, self.labels, self.fault, now)}
+        self.pending = self.firing = self.resolved = None
+        self.observe(alerts, now)
+
+    def as_dict(self):
+        def since(start, t):
+            return None if start is None or t is None else round(t - start, 3)
+        return {
+            "alert": self.alert_name,
+            "labels": self.labels,
+            "fault": self.fault,
+            "pending": self.pending,
+            "firing": self.firing,
+            "recovered": self.recovered,
+            "resolved": self.resolved,
+            "fault_to_pending": since(self.fault, self.pending),
+            "fault_to_firing": since(self.fault, self.firing),
+            "pending_to_firing": since(self.pending, self.firing),
+            "recovered_to_resolved": since(self.recovered, self.resolved),
+        }
+
+
+class Timings:
+    """Timing of every alert occurrence of a run, found by alertname and the labels the test waits for"""
+
+    def __init__(self):
+        self.occurrences = []
+        self.lock = threading.Lock()
+
+    def latest(self, alert_name, labels=None):
+        # the most recent occurrence having every label asked for, a resolution wait may name fewer labels than
+        # the firing wait of the same occurrence, e.g. {hostname} after {hostname, chi}
+        labels = dict(labels or {})
+        with self.lock:
+            for timing in reversed(self.occurrences):
+                if timing.alert_name == alert_name and labels.items() <= timing.labels.items():
+                    return timing
+        return None
+
+    def fault(self, alert_name, labels=None, t=None):
+        # A fault is injected now, the next firing of the alert is timed from here
+        timing = Timing(alert_name, labels or {}, t or time.time())
+        with self.lock:
+            self.occurrences.append(timing)
+        return timing
+
+    def firing(self, alert_name, labels=None):
+        # Timing of a wait for firing: the one of a marked fault not fired yet, a new one from now otherwise
+        timing = self.latest(alert_name, labels)
+        if timing is None or timing.firing is not None:
+            timing = self.fault(alert_name, labels)
+        return timing
+
+    def resolving(self, alert_name, labels=None):
+        # Timing of a wait for resolution, the fault is removed now unless recover() was called before
+        timing = self.latest(alert_name, labels)
+        if timing is None:
+            timing = self.fault(alert_name, labels)
+        if timing.recovered is None:
+            timing.recovered = time.time()
+        return timing
+
+    def recover(self, alert_name, labels=None, t=None):
+        timing = self.latest(alert_name, labels) or self.fault(alert_name, labels)
+        timing.recovered = t or time.time()
+        return timing
+
+    def report(self):
+        with self.lock:
+            return [timing.as_dict() for timing in self.occurrences]
+
+
+timings = Timings()
+
+
+class Condition:
+    """Presence of an alert in alert_state with labels within the last time_range, like ALERTS{...}[time_range]"""
+
+    def __init__(self, alert_name, alert_state="firing", labels=None, time_range="10s", expected_state=True, timing=None):
+        self.alert_name = alert_name
+        self.labels = dict(labels or {}, alertname=alert_name, alertstate=alert_state)
+        self.time_range = time_range
+        self.range_seconds = parse_duration(time_range)
+        self.expected_state = expected_state
+        self.timing = timing
+        self.present = None
+        self.matched = threading.Event()
+
+    def __str__(self):
+        return f"{self.alert_name} {self.labels['alertstate']}={self.expected_state} {self.labels} in {self.time_range}"
+
+    def evaluate(self, alerts, now):
+        # alerts: alertname -> [(labels, first sample time, last sample time)]
+        self.present = any(
+            last >= now - self.range_seconds and all(labels.get(k) == v for k, v in self.labels.items())
+            for labels, _, last in alerts.get(self.alert_name, [])
+        )
+        if self.timing is not None:
+            self.timing.observe(alerts, now)
+        if self.present == self.expected_state:
+            self.matched.set()
+        return self.present
+
+    def wait(self, timeout):
+        return self.matched.wait(timeout)
+
+
+class Poller:
+    def __init__(self, pod="", ns=settings.prometheus_namespace, url=settings.prometheus_url,
+                 interval=settings.alert_poll_interval, kubectl_cmd=settings.kubectl_cmd):
+        self.pod = pod
+        self.ns = ns
+        self.url = url
+        self.interval = interval
+        self.kubectl_cmd = kubectl_cmd
+        self.forward = None
+        self._pool = None
+        self.conditions = []
+        self.lock = threading.Lock()
+        self.kick = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stats = {"requests": 0, "errors": 0, "evaluations": 0}
+        # the polling thread and the scenario share the pool and the counters
+        self.pool_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+
+    def pool(self):
+        with self.pool_lock:
+            if self.forward is not None and not self.forward.alive():
+                self.forward = None
+                self._pool.close()
+                self._pool = None
+            if self._pool is None:
+                url = self.url
+                if url == "":
+                    if self.pod == "":
+                        raise Unavailable("neither the Prometheus pod nor settings.prometheus_url is set")
+                    self.forward = clickhouse_http.PortForward(
+                        self.pod, self.ns, port=9090, kubectl_cmd=self.kubectl_cmd,
+                    )
+                    url = self.forward.start()
+                self._pool = kubeapi.ConnectionPool(url)
+            return self._pool
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def get(self, path):
+        # "data" of a Prometheus HTTP API response
+        self.count("requests")
+        try:
+            status, _, _, body = self.pool().request("GET", path, timeout=30)
+            out = json.loads(body)
+        except (OSError, ValueError, clickhouse_http.Unavailable) as e:
+            self.count("errors")
+            raise Unavailable(f"{type(e).__name__}: {e}")
+        if status != 200 or out.get("status") != "success":
+            self.count("errors")
+            raise Unavailable(f"wrong response from prometheus API {path}: {status} {body[:200]}")
+        return out["data"]
+
+    def fetch(self, time_range="10s"):
+        # Returns (evaluation time, alertname -> [(labels, first sample time, last sample time)])
+        # of one ALERTS[time_range] query
+        now = time.time()
+        data = self.get("/api/v1/query?" + urllib.parse.urlencode({"query": f"ALERTS[{time_range}]", "time": now}))
+        alerts = {}
+        for series in data["result"]:
+            labels = series["metric"]
+            times = [float(ts) for ts, _ in series["values"]]
+            alerts.setdefault(labels.get("alertname", ""), []).append((labels, min(times), max(times)))
+        return now, alerts
+
+    def scrapes(self, job=settings.prometheus_scrape_job):
+        # {scrape url: (last scrape time, scrape interval or None)} of the active targets of job,
+        # older Prometheus versions do not report the interval
+        data = self.get("/api/v1/targets?state=active")
+        targets = {}
+        for target in data["activeTargets"]:
+            if target["labels"].get("job") != job or target.get("lastScrape", "").startswith("0001-"):
+                continue
+            interval = target.get("scrapeInterval")
+            targets[target["scrapeUrl"]] = (
+                parse_timestamp(target["lastScrape"]), parse_duration(interval) if interval else None,
+            )
+        return targets
+
+    def wait_scrapes(self, scrapes=1, after=None, job=settings.prometheus_scrape_job, timeout=300):
+        # Blocks until every active target of job was scraped `scrapes` times since after, now by default,
+        # returns the last scrape times. Scrapes are counted by the distinct lastScrape values seen,
+        # so the targets are asked twice per scrape interval, every second when it is unknown.
+        after = time.time() if after is None else after
+        deadline = time.time() + timeout
+        seen = {}
+        while True:
+            try:
+                targets = self.scrapes(job)
+            except Unavailable as e:
+                print(f"alert poller: {e}")
+                targets = {}
+            for url, (last, _) in targets.items():
+                if last > after:
+                    seen.setdefault(url, set()).add(last)
+            if len(targets) > 0 and all(len(seen.get(url, ())) >= scrapes for url in targets):
+                return {url: last for url, (last, _) in targets.items()}
+            if time.time() >= deadline:
+                raise Unavailable(f"no {scrapes} scrapes of {job} targets in {timeout}s, seen {seen}")
+            intervals = [interval for _, interval in targets.values() if interval is not None]
+            self.stopped.wait(min(min(intervals, default=2) / 2, max(deadline - time.time(), 0)))
+
+    def samples(self, alert_name, labels, start, end):
+        # [(labels, first sample time, last sample time)] of the ALERTS series of alert_name with labels,
+        # from the raw samples in (start, end]
+        selector = ",".join(f"{k}={json.dumps(v)}" for k, v in dict(labels, alertname=alert_name).items())
+        seconds = max(int(end - start) + 1, 1)
+        data = self.get("/api/v1/query?" + urllib.parse.urlencode({"query": f"ALERTS{{{selector}}}[{seconds}s]", "time": end}))
+        result = []
+        for series in data["result"]:
+            times = [float(ts) for ts, _ in series["values"] if float(ts) > start]
+            if len(times) > 0:
+                result.append((series["metric"], min(times), max(times)))
+        return result
+
+    def check(self, condition):
+        # One immediate evaluation outside of the polling loop
+        now, alerts = self.fetch(condition.time_range)
+        return condition.evaluate(alerts, now)
+
+    def watch(self, condition):
+        with self.lock:
+            self.conditions.append(condition)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        # a new condition is evaluated with the next request instead of a tick later
+        self.kick.set()
+        return condition
+
+    def unwatch(self, condition):
+        with self.lock:
+            if condition in self.conditions:
+                self.conditions.remove(condition)
+
+    def run(self):
+        last = 0
+        while not self.stopped.is_set():
+            with self.lock:
+                conditions = [c for c in self.conditions if not c.matched.is_set()]
+            if len(conditions) == 0:
+                self.kick.wait(self.interval)
+                self.kick.clear()
+                continue
+            # at most one request per interval however many conditions are added
+            if time.time() < last + self.interval:
+                self.stopped.wait(last + self.interval - time.time())
+                continue
+            last = time.time()
+            longest = max(conditions, key=lambda c: c.range_seconds)
+            try:
+                now, alerts = self.fetch(longest.time_range)
+            except Unavailable as e:
+                print(f"alert poller: {e}")
+                continue
+            for condition in conditions:
+                condition.evaluate(alerts, now)
+                self.count("evaluations")
+
+    def close(self):
+        self.stopped.set()
+        self.kick.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.pool_lock:
+            if self.forward is not None:
+                self.forward.stop()
+            if self._pool is not None:
+                self._pool.close()
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def poller(pod=""):
+    # The Prometheus pod is needed once, before the first request
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = Poller(pod)
+        elif pod != "" and _poller.pod != pod:
+            _poller.pod = pod
+        return _poller
+
+
+def reset():
+    global _poller
+    with _poller_lock:
+        if _poller is not None:
+            _poller.close()
+        _poller = None
+
+
+atexit.register(reset)
@@ -0,0 +1,67 @@
+import shutil
+import time
+
+from testflows.core import TestScenario, Name, When, Then, Given, And, main, run, Module, TE, metric
+
+import fake_kubeapi
+import kubectl
+import settings
+
+
+# python3 tests/bench_kubectl.py
+# Compares the kubectl subprocess transport with the pooled HTTP transport against fake_kubeapi,
+# no Kubernetes cluster is required
+
+
+def measure(iterations):
+    ns = "test"
+    chi = "bench"
+    label = f"-l clickhouse.altinity.com/chi={chi}"
+    calls = {
+        "get_count": lambda: kubectl.get_count("pod", label=label, ns=ns),
+        "count_objects": lambda: kubectl.count_objects(label=label, ns=ns),
+        "get": lambda: kubectl.get("chi", chi, ns=ns),
+        "get_field": lambda: kubectl.get_field("chi", chi, ".status.status", ns=ns),
+        "get_pod_names": lambda: kubectl.get_pod_names(chi, ns=ns),
+    }
+    results = {}
+    for name, call in calls.items():
+        started = time.time()
+        for _ in range(iterations):
+            call()
+        results[name] = (time.time() - started) / iterations
+    return results
+
+
+@TestScenario
+@Name("Compare kubectl and http transports on fake API server")
+def bench_transports(iterations=20, shards=2, replicas=2):
+    server = fake_kubeapi.FakeApiServer().start()
+    try:
+        with Given(f"fake API server at {server.url} with {shards}x{replicas} CHI"):
+            for obj in fake_kubeapi.chi_objects("bench", "test", shards, replicas):
+                server.add(obj)
+
+        transports = ["http"]
+        if shutil.which(settings.kubectl_cmd.split()[0]) is not None:
+            transports.append("kubectl")
+        else:
+            with And(f"{settings.kubectl_cmd} is not installed, measuring http transport only"):
+                pass
+
+        for transport in transports:
+            with When(f"{transport} transport"):
+                kubectl.set_transport(transport, url=server.url)
+                kubectl.kubectl_cmd = f"{settings.kubectl_cmd} --server={server.url}"
+                for name, seconds in measure(iterations).items():
+                    with Then(f"{name}: {seconds * 1000:.2f} ms per call"):
+                        metric(f"{transport}.{name}", seconds * 1000, "ms")
+    finally:
+        kubectl.set_transport(settings.kubectl_transport)
+        kubectl.kubectl_cmd = settings.kubectl_cmd
+        server.stop()
+
+
+if main():
+    with Module("bench_kubectl", flags=TE):
+        run(test=bench_transports)
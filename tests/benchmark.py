@@ -0,0 +1,312 @@
+import concurrent.futures
+import json
+import math
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+
+import yaml
+
+from testflows.core import Then, metric
+from testflows.asserts import error
+
+import clickhouse
+import kubectl
+import manifest
+import settings
+import util
+
+from test_operator import require_zookeeper
+
+
+# Shared pieces of the test_benchmark.py scenarios: layouts, percentiles and the machine-readable results file
+
+layouts = {
+    "1x1": {
+        "config": "configs/test-001.yaml",
+        "check": {
+            "object_counts": {
+                "statefulset": 1,
+                "pod": 1,
+                "service": 2,
+            },
+        },
+    },
+    "2x2-complex": {
+        "config": "configs/test-003-complex-layout.yaml",
+        "check": {
+            "object_counts": {
+                "statefulset": 4,
+                "pod": 4,
+                "service": 5,
+            },
+        },
+    },
+    "1x2-replicated": {
+        "config": "configs/test-014-replication-1.yaml",
+        "check": {
+            "apply_templates": [
+                settings.clickhouse_template,
+                "templates/tpl-persistent-volume-100Mi.yaml",
+            ],
+            "object_counts": {
+                "statefulset": 2,
+                "pod": 2,
+                "service": 3,
+            },
+        },
+        "zookeeper": True,
+    },
+}
+
+
+def percentiles(values, points=(50, 95, 99)):
+    # nearest-rank percentiles, {"p50": ..., "p95": ..., "p99": ..., "max": ...}
+    values = sorted(values)
+    if len(values) == 0:
+        return dict({f"p{p}": 0 for p in points}, max=0)
+    result = {f"p{p}": values[max(math.ceil(p / 100 * len(values)) - 1, 0)] for p in points}
+    result["max"] = values[-1]
+    return result
+
+
+def histogram(values, bounds=(10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)):
+    # cumulative bucket counts like Prometheus histograms, {"le_10": ..., "le_inf": ...}
+    result = {f"le_{b}": sum(1 for v in values if v <= b) for b in bounds}
+    result["le_inf"] = len(values)
+    return result
+
+
+def deploy(layout):
+    # Returns the CHI name of the deployed layout, kept until undeploy()
+    spec = layouts[layout]
+    if spec.get("zookeeper", False):
+        require_zookeeper()
+    kubectl.create_and_check(config=spec["config"], check=dict(spec["check"], do_not_delete=1))
+    return manifest.get_chi_name(util.get_full_path(spec["config"]))
+
+
+def chi_manifest(chi_name, shards, replicas, cluster="default", extra_spec=None):
+    # Writes a generated CHI of shards x replicas hosts, returns the manifest path for kubectl.apply()
+    chi = {
+        "apiVersion": "clickhouse.altinity.com/v1",
+        "kind": "ClickHouseInstallation",
+        "metadata": {"name": chi_name},
+        "spec": {
+            **(extra_spec or {}),
+            "configuration": {
+                "clusters": [
+                    {"name": cluster, "layout": {"shardsCount": shards, "replicasCount": replicas}},
+                ],
+            },
+        },
+    }
+    path = os.path.join(tempfile.gettempdir(), f"{chi_name}.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(chi, f)
+    return path
+
+
+def pods_ready(pods, count):
+    return len(pods) == count and all(
+        any(c["type"] == "Ready" and c["status"] == "True" for c in pod.get("status", {}).get("conditions", []))
+        for pod in pods
+    )
+
+
+def milestone(started, name, sources, predicate, timeout):
+    # Seconds from started until predicate holds, resolution is settings.wait_poll_interval without watches
+    with Then(name):
+        ok, _ = kubectl.wait_until(sources, predicate, timeout)
+        assert ok, error()
+    return round(time.time() - started, 3)
+
+
+class Probe:
+    """Open-loop read/write requests against every host and the CHI service from a background thread"""
+
+    # the write recreates its table, a restarted pod without persistent volumes comes back empty
+    read_sql = "SELECT version()"
+    write_sql = (
+        "CREATE TABLE IF NOT EXISTS default.bench_probe (time DateTime, target String) ENGINE Log;"
+        "INSERT INTO default.bench_probe VALUES (now(), '{target}')"
+    )
+
+    def __init__(self, chi_name, pods, qps=10, writes=0.5, timeout=5, ns=kubectl.namespace):
+        self.chi_name = chi_name
+        self.pods = pods
+        self.targets = pods + ["service"]
+        self.qps = qps
+        self.writes = writes
+        self.timeout = timeout
+        self.ns = ns
+        self.requests = []
+        self.marks = []
+        self.last_ok = {pod: 0 for pod in pods}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(int(qps * timeout), 1))
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self.thread.start()
+
+    def mark(self, name):
+        # a named point of the timeline, e.g. when a manifest was applied
+        self.marks.append({"time": round(time.time() - self.started, 3), "mark": name})
+
+    def run(self):
+        i = 0
+        credit = {}
+        while not self.stopped.is_set():
+            # open loop, requests are issued on schedule however long the previous ones take
+            self.stopped.wait(max(self.started + i / self.qps - time.time(), 0))
+            if self.stopped.is_set():
+                break
+            target = self.targets[i % len(self.targets)]
+            # every target gets the writes share of its requests as writes
+            credit[target] = credit.get(target, 0) + self.writes
+            write = credit[target] >= 1
+            if write:
+                credit[target] -= 1
+            self.pool.submit(self.request, target, "write" if write else "read")
+            i += 1
+
+    def request(self, target, op):
+        sql = self.write_sql.format(target=target) if op == "write" else self.read_sql
+        pod, host = target, "127.0.0.1"
+        if target == "service":
+            # from the pod that answered last, clickhouse-client goes through the service like any client would
+            with self.lock:
+                pod = max(self.pods, key=lambda p: self.last_ok[p])
+            host = f"clickhouse-{self.chi_name}"
+        started = time.time()
+        ok, out = clickhouse.query_pod(pod, sql, ns=self.ns, timeout=self.timeout, host=host, use_session=False)
+        finished = time.time()
+        with self.lock:
+            if ok and target != "service":
+                self.last_ok[pod] = finished
+            self.requests.append({
+                "time": round(started - self.started, 3),
+                "target": target,
+                "op": op,
+                "ok": ok,
+                "ms": round((finished - started) * 1000, 2),
+                "out": out.strip().splitlines()[-1][:200] if out.strip() != "" else "",
+            })
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.pool.shutdown(wait=True)
+        self.requests.sort(key=lambda r: r["time"])
+
+    def windows(self, target):
+        # [start, end) of failing periods, from the first failed request to the next successful one
+        windows = []
+        start = None
+        for r in self.requests:
+            if r["target"] != target:
+                continue
+            if not r["ok"] and start is None:
+                start = r["time"]
+            elif r["ok"] and start is not None:
+                windows.append((start, r["time"]))
+                start = None
+        if start is not None:
+            windows.append((start, self.requests[-1]["time"]))
+        return windows
+
+    def timeline(self, bucket=1.0):
+        # per bucket and target: requests, errors, max latency and the last answer of a read, i.e. the version
+        timeline = {}
+        for r in self.requests:
+            row = timeline.setdefault(int(r["time"] // bucket), {})
+            cell = row.setdefault(r["target"], {"requests": 0, "errors": 0, "max_ms": 0, "version": ""})
+            cell["requests"] += 1
+            cell["errors"] += 0 if r["ok"] else 1
+            cell["max_ms"] = max(cell["max_ms"], r["ms"])
+            if r["ok"] and r["op"] == "read":
+                cell["version"] = r["out"]
+        return [{"time": t * bucket, **timeline[t]} for t in sorted(timeline)]
+
+    def format_timeline(self, bucket=1.0):
+        lines = [f"{'time':>8}  " + "  ".join(f"{t[-24:]:>24}" for t in self.targets)]
+        marks = list(self.marks)
+        for row in self.timeline(bucket):
+            while len(marks) > 0 and marks[0]["time"] < row["time"] + bucket:
+                lines.append(f"{marks[0]['time']:>8.1f}  -- {marks.pop(0)['mark']}")
+            cells = []
+            for target in self.targets:
+                cell = row.get(target)
+                if cell is None:
+                    cells.append(f"{'':>24}")
+                else:
+                    state = "ok" if cell["errors"] == 0 else f"{cell['errors']}/{cell['requests']} failed"
+                    cells.append(f"{state} {cell['version']} {cell['max_ms']:.0f}ms"[-24:].rjust(24))
+            lines.append(f"{row['time']:>8.1f}  " + "  ".join(cells))
+        return "\n".join(lines)
+
+
+def apiserver_requests():
+    # apiserver_request_total by verb, counts every client of the cluster, not only the operator
+    cmd = shlex.split(kubectl.kubectl_cmd) + ["get", "--raw", "/metrics"]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60)
+    requests = {}
+    for line in out.stdout.decode(errors="replace").splitlines():
+        # apiserver_request_count before Kubernetes 1.14
+        match = re.match(r'^apiserver_request_(?:total|count)\{.*\bverb="([^"]+)".*\} (\S+)$', line)
+        if match is not None:
+            requests[match.group(1)] = requests.get(match.group(1), 0) + float(match.group(2))
+    return requests
+
+
+def operator_pod(ns=settings.operator_namespace):
+    return kubectl.get("pod", name="", ns=ns, label="-l app=clickhouse-operator")["items"][0]["metadata"]["name"]
+
+
+def operator_memory(ns=settings.operator_namespace):
+    # {"VmRSS": bytes, "VmHWM": bytes}, VmHWM is the peak resident memory of the operator process since it started
+    out = kubectl.exec_in_pod(
+        operator_pod(ns), "grep -E '^Vm(RSS|HWM):' /proc/1/status", container="clickhouse-operator", ns=ns,
+    )
+    return {name: int(kb) * 1024 for name, kb in re.findall(r"^(Vm\w+):\s+(\d+) kB", out, re.M)}
+
+
+def undeploy(chi_name):
+    kubectl.delete_chi(chi_name)
+
+
+def on_every_host(chi_name, sql, timeout=120):
+    # DDL without ON CLUSTER, layouts without ZooKeeper have no distributed DDL queue
+    results = clickhouse.query_cluster(chi_name, sql, timeout=timeout)
+    failed = [r for r in results if not r["ok"]]
+    if len(failed) > 0:
+        print(clickhouse.format_cluster_results(results))
+    assert len(results) > 0 and len(failed) == 0, error()
+    return results
+
+
+def report(benchmark, values, **labels):
+    # Appends one JSON line to settings.benchmark_results and attaches the numbers as metrics
+    record = {
+        "benchmark": benchmark,
+        "time": time.time(),
+        "operator_version": settings.operator_version.strip(),
+        "clickhouse_version": settings.clickhouse_version,
+        **labels,
+        **values,
+    }
+    with open(settings.benchmark_results, "a") as results:
+        results.write(json.dumps(record) + "\n")
+    name = " ".join(f"{v}" for v in labels.values())
+    with Then(f"{benchmark} {name}: {values}"):
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                metric(f"{benchmark}.{name}.{key}", value, "ms" if key.endswith("_ms") else "")
+    return record
@@ -1,6 +1,228 @@
+import concurrent.futures
+import itertools
+import json
+import re
+import shlex
+import subprocess
+import threading
+import time
+
+import clickhouse_formats
+import clickhouse_http
+import exec_session
+import query_trace
+import kubeapi
 import kubectl
 import settings
 
+from testflows.core import Then, metric
+from testflows.asserts import error
+
+transport = settings.clickhouse_transport
+
+
+class PodCache:
+    # hostname -> pod resolution per CHI, so a query does not list pods first.
+    # Entries are dropped on pod ADDED/DELETED watch events (http kubectl transport) and when exec into a pod fails.
+
+    def __init__(self):
+        self.entries = {}
+        self.watches = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.resolve_seconds = 0.0
+
+    def get(self, chi_name, ns):
+        key = (ns, chi_name)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+        started = time.time()
+        client = kubectl.api()
+        if client is not None:
+            out = client.fetch_list("pod", label=f"-l clickhouse.altinity.com/chi={chi_name}", ns=ns)
+            entry = {"pods": [pod["metadata"]["name"] for pod in out.get("items", [])], "fqdns": {}}
+            self.follow(client, chi_name, ns, out.get("metadata", {}).get("resourceVersion", ""))
+        else:
+            entry = {"pods": kubectl.get_pod_names(chi_name, ns), "fqdns": {}}
+        with self.lock:
+            self.misses += 1
+            self.resolve_seconds += time.time() - started
+            self.entries[key] = entry
+        return entry
+
+    def fresh(self, chi_name, ns):
+        # the pods right now, for callers which need every host after a scale without a watch to tell them
+        self.invalidate(chi_name, ns)
+        return self.get(chi_name, ns)
+
+    def precompute(self, chi_name, ns, chi=None):
+        # one CHI fetch resolves every host: .status.pods and .status.fqdns are listed in the same order
+        started = time.time()
+        if chi is None:
+            chi = kubectl.get("chi", chi_name, ns=ns)
+        pods = chi["status"].get("pods", [])
+        fqdns = chi["status"].get("fqdns", [])
+        with self.lock:
+            self.misses += 1
+            self.resolve_seconds += time.time() - started
+            self.entries[(ns, chi_name)] = {"pods": list(pods), "fqdns": dict(zip(fqdns, pods))}
+
+    def follow(self, client, chi_name, ns, resource_version):
+        key = (ns, chi_name)
+        with self.lock:
+            if key in self.watches and self.watches[key].is_alive():
+                return
+
+            def watch():
+                try:
+                    stream = client.watch(
+                        "pod", label=f"-l clickhouse.altinity.com/chi={chi_name}", ns=ns,
+                        resource_version=resource_version, timeout=300,
+                    )
+                    for event_type, _ in stream:
+                        if event_type in ("ADDED", "DELETED", "ERROR"):
+                            break
+                    stream.close()
+                except (kubeapi.ApiError, OSError):
+                    pass
+                # the watch only lives as long as the entry it guards
+                self.invalidate(chi_name, ns)
+
+            self.watches[key] = threading.Thread(target=watch, daemon=True)
+            self.watches[key].start()
+
+    def invalidate(self, chi_name, ns):
+        with self.lock:
+            if self.entries.pop((ns, chi_name), None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "resolve_ms": round(self.resolve_seconds * 1000, 2),
+            }
+
+
+pod_cache = PodCache()
+
+
+def precompute_pods(chi_name, ns=settings.test_namespace, chi=None):
+    pod_cache.precompute(chi_name, ns, chi)
+
+
+def report_pod_cache_stats():
+    stats = pod_cache.stats()
+    with Then(f"ClickHouse pod resolution cache: {stats}"):
+        for name, value in stats.items():
+            metric(f"clickhouse_pod_cache_{name}", value, "ms" if name == "resolve_ms" else "")
+
+
+trace = query_trace.Trace()
+
+
+def server_pod_of(chi_name, host, ns):
+    # pod whose system.query_log has the queries sent to host, None for hosts outside of the CHI
+    # or when the pods can't be listed, tracing never fails the query it traces
+    try:
+        entry = pod_cache.get(chi_name, ns)
+    except Exception:
+        return None
+    if host in entry["fqdns"]:
+        return entry["fqdns"][host]
+    for p in entry["pods"]:
+        if p.startswith(f"{host.split('.')[0]}-"):
+            return p
+    return None
+
+
+def flush_query_trace():
+    # Looks up server side numbers of the recorded queries, one system.query_log query per server pod
+    for (chi_name, ns, server_pod), entries in trace.take().items():
+        rows = {}
+        if server_pod is not None:
+            ids = ", ".join(f"'{e['query_id']}'" for e in entries)
+            ok, out = query_pod(
+                server_pod,
+                "SYSTEM FLUSH LOGS; "
+                "SELECT query_id, sum(query_duration_ms) AS query_duration_ms, sum(read_rows) AS read_rows, "
+                "sum(read_bytes) AS read_bytes, sum(written_rows) AS written_rows, max(memory_usage) AS memory_usage "
+                f"FROM system.query_log WHERE type != 'QueryStart' AND event_date >= yesterday() AND query_id IN ({ids}) "
+                "GROUP BY query_id FORMAT JSONEachRow",
+                ns=ns,
+            )
+            if ok:
+                for line in out.splitlines():
+                    if line.startswith("{"):
+                        row = json.loads(line)
+                        rows[row["query_id"]] = row
+        trace.resolve(entries, rows)
+
+
+def report_query_trace():
+    if settings.query_trace == "":
+        return
+    flush_query_trace()
+    stats = trace.stats()
+    with Then(f"Query timings: {stats}"):
+        for name, value in stats.items():
+            metric(f"query_trace_{name}", value, "ms" if name.endswith("_ms") else "")
+
+
+def select_pod(chi_name, host, pod, ns):
+    # Returns (pod name, fqdn -> pod mapping), pods of the CHI matching host or pod, the first pod otherwise
+    for refresh in (False, True):
+        if refresh:
+            pod_cache.invalidate(chi_name, ns)
+        entry = pod_cache.get(chi_name, ns)
+        for p in entry["pods"]:
+            if host in p or p == pod:
+                return p, entry["fqdns"]
+        if pod == "" and (not host.startswith(f"chi-{chi_name}-") or "." in host):
+            # nothing a fresh pod list could match, e.g. localhost or a service fqdn
+            break
+    return entry["pods"][0], entry["fqdns"]
+
+
+def pod_not_found(out, pod_name):
+    return f'pods "{pod_name}" not found' in out
+
+
+def set_transport(name):
+    global transport
+    transport = name
+    clickhouse_http.reset()
+
+
+def is_local(host, pod_name, fqdns=None):
+    # clickhouse-client connects from inside pod_name, the HTTP transport only serves connections to pod_name itself
+    if fqdns and host in fqdns:
+        return fqdns[host] == pod_name
+    return host in ("127.0.0.1", "localhost", pod_name) or pod_name.startswith(f"{host.split('.')[0]}-")
+
+
+def query_http(chi_name, pod_name, sql, with_error, user, pwd, ns, timeout, params, query_id="", summary=None):
+    try:
+        ok, out = clickhouse_http.client().query(
+            pod_name, ns, sql, user=user, pwd=pwd, params=params, timeout=timeout, query_id=query_id, summary=summary,
+        )
+    except OSError as e:
+        ok, out = False, f"{type(e).__name__}: {e}"
+    except clickhouse_http.Unavailable as e:
+        pod_cache.invalidate(chi_name, ns)
+        ok, out = False, str(e)
+    if not ok and not with_error:
+        print("query failed, output:")
+        print(out)
+    assert ok or with_error, error()
+    return out
+
 
 def query(
         chi_name,
@@ -15,20 +237,65 @@ def query(
         advanced_params="",
         pod="",
 ):
-    pod_names = kubectl.get_pod_names(chi_name, ns)
-    pod_name = pod_names[0]
-    for p in pod_names:
-        if host in p or p == pod:
-            pod_name = p
-            break
+    if settings.query_trace != "" and trace.due():
+        # the batched lookup of the previous queries, before this one starts
+        flush_query_trace()
+    pod_name, fqdns = select_pod(chi_name, host, pod, ns)
+    local = is_local(host, pod_name, fqdns)
+    query_id = trace.query_id() if settings.query_trace != "" else ""
+    summary = {}
+    out = None
+    used = "exec"
+    started = time.time()
+    try:
+        if transport == "http" and port == "9000" and local:
+            params = clickhouse_http.parse_params(advanced_params)
+            if params is not None:
+                used = "http"
+                out = query_http(chi_name, pod_name, sql, with_error, user, pwd, ns, timeout, params, query_id, summary)
+                return out
+        try:
+            out = query_exec(pod_name, sql, with_error, host, port, user, pwd, ns, timeout, advanced_params, query_id)
+            gone = with_error and pod_not_found(out, pod_name)
+        except AssertionError:
+            # SQL errors and timeouts fail right away, only a query that never reached a pod is run again
+            if pod_name in kubectl.get_pod_names(chi_name, ns):
+                raise
+            gone = True
+        if gone:
+            # without watches the cache only learns about a replaced pod from a failed exec, one retry on a fresh pod list
+            pod_cache.invalidate(chi_name, ns)
+            pod_name, _ = select_pod(chi_name, host, pod, ns)
+            out = query_exec(pod_name, sql, with_error, host, port, user, pwd, ns, timeout, advanced_params, query_id)
+        return out
+    finally:
+        if query_id != "":
+            server_pod = pod_name if local else server_pod_of(chi_name, host, ns)
+            trace.record(
+                query_id, chi_name, ns, pod_name, server_pod, used, sql,
+                out is not None and "DB::Exception" not in out, time.time() - started, summary,
+            )
+
 
+def query_exec(pod_name, sql, with_error, host, port, user, pwd, ns, timeout, advanced_params, query_id=""):
     pwd_str = "" if pwd == "" else f"--password={pwd}"
+    query_id_str = "" if query_id == "" else f" --query_id={query_id}"
+
+    if settings.kubectl_exec_sessions:
+        return kubectl.exec_in_pod(
+            pod_name,
+            f"clickhouse-client -mn -h {host} --port={port} -u {user} {pwd_str}{query_id_str} {advanced_params}"
+            f" --query=\"{sql}\"",
+            ns=ns,
+            ok_to_fail=with_error,
+            timeout=timeout,
+        )
 
     if with_error:
         return kubectl.launch(
             f"exec {pod_name}"
             f" --"
-            f" clickhouse-client -mn -h {host} --port={port} -u {user} {pwd_str} {advanced_params}"
+            f" clickhouse-client -mn -h {host} --port={port} -u {user} {pwd_str}{query_id_str} {advanced_params}"
             f" --query=\"{sql}\""
             f" 2>&1",
             timeout=timeout,
@@ -39,13 +306,342 @@ def query(
         return kubectl.launch(
             f"exec {pod_name} -n {ns}"
             f" -- "
-            f"clickhouse-client -mn -h {host} --port={port} -u {user} {pwd_str} {advanced_params}"
+            f"clickhouse-client -mn -h {host} --port={port} -u {user} {pwd_str}{query_id_str} {advanced_params}"
             f"--query=\"{sql}\"",
             timeout=timeout,
             ns=ns,
         )
 
 
+def insert(
+        chi_name,
+        table,
+        rows,
+        columns=None,
+        types=None,
+        fmt="TSV",
+        block_size=65536,
+        chunked=False,
+        host="127.0.0.1",
+        user="default",
+        pwd="",
+        ns=settings.test_namespace,
+        timeout=600,
+        pod="",
+        via="",
+        on_chunk=None,
+        advanced_params="",
+):
+    # Streams rows (an iterable of tuples, or of lists of tuples with chunked=True) into table.
+    # Only one encoded chunk is held in memory. Over "http" every chunk is a separate INSERT acknowledged by the server,
+    # over "stdin" all chunks go to one clickhouse-client INSERT and a chunk is acknowledged once the pipe takes it.
+    # on_chunk(rows, bytes) is called after each acknowledged chunk, advanced_params are "--name=value" settings.
+    # Returns ingest stats.
+    via = via or ("http" if transport == "http" else "stdin")
+    if types is None and fmt != "TSV":
+        described = query(chi_name, f"DESCRIBE TABLE {table} FORMAT TSV", host=host, user=user, pwd=pwd, ns=ns, pod=pod)
+        described = dict(line.split("\t")[:2] for line in described.splitlines())
+        columns = columns or list(described)
+        types = [described[c] for c in columns]
+    encode = clickhouse_formats.encoder(fmt, columns, types)
+    blocks = rows if chunked else clickhouse_formats.chunks(rows, block_size)
+    columns_str = "" if columns is None else f" ({', '.join(columns)})"
+    sql = f"INSERT INTO {table}{columns_str} FORMAT {fmt}"
+    pod_name, _ = select_pod(chi_name, host, pod, ns)
+
+    stats = {"rows": 0, "bytes": 0, "chunks": 0}
+    started = time.time()
+    if via == "http":
+        for block in blocks:
+            data = encode(block)
+            status, _, out = clickhouse_http.client().execute(
+                pod_name, ns, sql, user, pwd, params=clickhouse_http.parse_params(advanced_params), timeout=timeout, data=data,
+            )
+            if status != 200:
+                print(f"insert of chunk {stats['chunks']} failed, output:")
+                print(out)
+            assert status == 200, error()
+            stats["rows"] += len(block)
+            stats["bytes"] += len(data)
+            stats["chunks"] += 1
+            if on_chunk is not None:
+                on_chunk(len(block), len(data))
+    else:
+        pwd_str = "" if pwd == "" else f"--password={pwd}"
+        cmd = shlex.split(kubectl.kubectl_cmd) + [f"--namespace={ns}", "exec", "-i", pod_name, "--"]
+        cmd += shlex.split(f"clickhouse-client -h {host} -u {user} {pwd_str} --max_insert_block_size={block_size} {advanced_params}")
+        cmd += [f"--query={sql}"]
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            for block in blocks:
+                data = encode(block)
+                process.stdin.write(data)
+                stats["rows"] += len(block)
+                stats["bytes"] += len(data)
+                stats["chunks"] += 1
+                if on_chunk is not None:
+                    on_chunk(len(block), len(data))
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        out = process.stdout.read().decode(errors="replace")
+        code = process.wait(timeout=timeout)
+        if code != 0:
+            print("insert failed, output:")
+            print(out)
+        assert code == 0, error()
+    stats["seconds"] = time.time() - started
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] > 0 else 0
+    stats["bytes_per_second"] = stats["bytes"] / stats["seconds"] if stats["seconds"] > 0 else 0
+    return stats
+
+
+def query_pod_transport(pod_name, host, advanced_params):
+    # "http" when query_pod() can use the HTTP interface, clickhouse-client options it does not know need exec
+    if transport == "http" and clickhouse_http.parse_params(advanced_params) is not None and is_local(host, pod_name):
+        return "http"
+    return "exec"
+
+
+def query_pod(
+        pod_name,
+        sql,
+        user="default",
+        pwd="",
+        ns=settings.test_namespace,
+        timeout=60,
+        host="127.0.0.1",
+        query_id="",
+        advanced_params="",
+        use_session=True,
+):
+    # Thread-safe query from pod_name without testflows steps, returns (ok, output)
+    if query_pod_transport(pod_name, host, advanced_params) == "http":
+        params = clickhouse_http.parse_params(advanced_params)
+        try:
+            return clickhouse_http.client().query(
+                pod_name, ns, sql, user=user, pwd=pwd, params=params, timeout=timeout, query_id=query_id,
+            )
+        except (OSError, clickhouse_http.Unavailable) as e:
+            return False, f"{type(e).__name__}: {e}"
+    pwd_str = "" if pwd == "" else f"--password={pwd}"
+    query_id_str = "" if query_id == "" else f" --query_id={query_id}"
+    client = f"clickhouse-client -mn -h {host} -u {user} {pwd_str}{query_id_str} {advanced_params}"
+    if settings.kubectl_exec_sessions and use_session:
+        code, out = exec_session.sessions().run(pod_name, f"{client} --query=\"{sql}\"", ns=ns, timeout=timeout)
+        return code == 0, out
+    cmd = shlex.split(kubectl.kubectl_cmd) + [f"--namespace={ns}", "exec", pod_name, "--"]
+    cmd += shlex.split(client) + [f"--query={clickhouse_http.unquote(sql)}"]
+    try:
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return False, f"timed out after {timeout} seconds"
+    except OSError as e:
+        return False, f"{type(e).__name__}: {e}"
+    return out.returncode == 0, out.stdout.decode(errors="replace").rstrip("\n")
+
+
+class QueryHandle:
+    """Query running in the background, see query_async()"""
+
+    def __init__(self, chi_name, sql, pod, server_pod, host, user, pwd, ns, timeout, advanced_params):
+        self.chi_name = chi_name
+        self.sql = sql
+        self.pod = pod
+        self.server_pod = server_pod
+        self.host = host
+        self.user = user
+        self.pwd = pwd
+        self.ns = ns
+        self.query_id = trace.query_id()
+        self.started = time.time()
+        self.ok = None
+        self.out = None
+        self.thread = threading.Thread(target=self.run, args=(timeout, advanced_params), daemon=True)
+        self.thread.start()
+
+    def run(self, timeout, advanced_params):
+        # a long query must not hold the shared exec session of the pod
+        self.ok, self.out = query_pod(
+            self.pod, self.sql, self.user, self.pwd, self.ns, timeout,
+            host=self.host, query_id=self.query_id, advanced_params=advanced_params, use_session=False,
+        )
+        if settings.query_trace != "":
+            trace.record(
+                self.query_id, self.chi_name, self.ns, self.pod, self.server_pod,
+                query_pod_transport(self.pod, self.host, advanced_params), self.sql, self.ok,
+                time.time() - self.started,
+            )
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def progress(self):
+        # Returns the system.processes row of the query, None once it is not running
+        if self.done() or self.server_pod is None:
+            return None
+        ok, out = query_pod(
+            self.server_pod,
+            "SELECT elapsed, read_rows, read_bytes, total_rows_approx, written_rows, memory_usage "
+            f"FROM system.processes WHERE query_id = '{self.query_id}' FORMAT JSONEachRow",
+            ns=self.ns,
+        )
+        if not ok or not out.startswith("{"):
+            return None
+        return {name: float(value) for name, value in json.loads(out.splitlines()[0]).items()}
+
+    def wait(self, timeout=None):
+        # Returns the output like query(with_error=True)
+        self.thread.join(timeout)
+        assert self.done(), error(f"query {self.query_id} is still running after {timeout} seconds")
+        return self.out
+
+    def cancel(self, timeout=60):
+        # KILL QUERY on the server, then waits for the client to return
+        if not self.done() and self.server_pod is not None:
+            query_pod(self.server_pod, f"KILL QUERY WHERE query_id = '{self.query_id}' SYNC", ns=self.ns)
+        self.thread.join(timeout)
+        return self.done()
+
+
+def query_async(
+        chi_name,
+        sql,
+        host="127.0.0.1",
+        user="default",
+        pwd="",
+        ns=settings.test_namespace,
+        timeout=600,
+        advanced_params="",
+        pod="",
+):
+    # Starts sql in the background and returns a QueryHandle with query_id, pod and start time right away
+    pod_name, fqdns = select_pod(chi_name, host, pod, ns)
+    server_pod = pod_name if is_local(host, pod_name, fqdns) else server_pod_of(chi_name, host, ns)
+    return QueryHandle(chi_name, sql, pod_name, server_pod, host, user, pwd, ns, timeout, advanced_params)
+
+
+def query_cluster(
+        chi_name,
+        sql,
+        cluster="",
+        user="default",
+        pwd="",
+        ns=settings.test_namespace,
+        timeout=60,
+        max_workers=settings.cluster_query_workers,
+):
+    # Runs sql on every host of the CHI, or of one of its clusters, concurrently.
+    # Returns one row per host ordered by shard and replica:
+    # {"host", "pod", "shard", "replica", "ok", "out", "error", "seconds"}
+    hosts = []
+    for pod_name in pod_cache.fresh(chi_name, ns)["pods"]:
+        match = re.match(rf"^chi-{re.escape(chi_name)}-(.+)-(\d+)-(\d+)-0$", pod_name)
+        if match is None or (cluster != "" and match.group(1) != cluster):
+            continue
+        hosts.append({
+            "host": pod_name[:-len("-0")],
+            "pod": pod_name,
+            "shard": int(match.group(2)),
+            "replica": int(match.group(3)),
+        })
+    hosts.sort(key=lambda h: (h["shard"], h["replica"]))
+
+    def run_on(host):
+        started = time.time()
+        ok, out = query_pod(host["pod"], sql, user, pwd, ns, timeout)
+        return dict(host, ok=ok, out=out if ok else "", error="" if ok else out, seconds=time.time() - started)
+
+    if len(hosts) == 0:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(hosts))) as pool:
+        results = list(pool.map(run_on, hosts))
+    for result in results:
+        if not result["ok"]:
+            pod_cache.invalidate(chi_name, ns)
+    return results
+
+
+def format_cluster_results(results):
+    lines = [f"{'host':<48} {'ms':>8}  result"]
+    for r in results:
+        lines.append(f"{r['host']:<48} {r['seconds'] * 1000:>8.1f}  {r['out'] if r['ok'] else 'ERROR ' + r['error']}")
+    return "\n".join(lines)
+
+
+def query_rows(
+        chi_name,
+        sql,
+        fmt="RowBinaryWithNamesAndTypes",
+        host="127.0.0.1",
+        user="default",
+        pwd="",
+        ns=settings.test_namespace,
+        timeout=600,
+        pod="",
+        header=None,
+):
+    # Streams the typed rows of a SELECT, the result is decoded while it is read and never held as a whole.
+    # header(names, types) is called before the first row.
+    pod_name, _ = select_pod(chi_name, host, pod, ns)
+    sql = f"{clickhouse_http.unquote(sql)} FORMAT {fmt}"
+    if transport == "http":
+        conn, response = clickhouse_http.client().stream(pod_name, ns, sql, user, pwd, timeout=timeout)
+        stream = response
+    else:
+        pwd_str = "" if pwd == "" else f"--password={pwd}"
+        cmd = shlex.split(kubectl.kubectl_cmd) + [f"--namespace={ns}", "exec", pod_name, "--"]
+        cmd += shlex.split(f"clickhouse-client -h {host} -u {user} {pwd_str}") + [f"--query={sql}"]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stream = process.stdout
+    try:
+        if transport == "http" and response.status != 200:
+            out = response.read().decode(errors="replace")
+            print("query failed, output:")
+            print(out)
+            assert response.status == 200, error()
+        names, types, rows = clickhouse_formats.decode_stream(fmt, stream)
+        if header is not None:
+            header(names, types)
+        yield from rows
+        if transport != "http":
+            code = process.wait(timeout=timeout)
+            if code != 0:
+                print("query failed, output:")
+                print(process.stderr.read().decode(errors="replace"))
+            assert code == 0, error()
+    finally:
+        if transport == "http":
+            conn.close()
+        elif process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def query_typed(
+        chi_name,
+        sql,
+        fmt="RowBinaryWithNamesAndTypes",
+        as_numpy=False,
+        host="127.0.0.1",
+        user="default",
+        pwd="",
+        ns=settings.test_namespace,
+        timeout=600,
+        pod="",
+):
+    # Returns a clickhouse_formats.Result with the typed columns of a SELECT
+    described = {}
+    rows = query_rows(
+        chi_name, sql, fmt, host=host, user=user, pwd=pwd, ns=ns, timeout=timeout, pod=pod,
+        header=lambda names, types: described.update(names=names, types=types),
+    )
+    # the header is known once the first row is read, the remaining rows go straight into the columns
+    first = next(rows, None)
+    rows = [] if first is None else itertools.chain([first], rows)
+    return clickhouse_formats.Result(described.get("names", []), described.get("types", []), rows, as_numpy)
+
+
 def query_with_error(
         chi_name,
         sql,
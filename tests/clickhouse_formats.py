@@ -0,0 +1,393 @@
+import datetime
+import decimal
+import json
+import re
+import struct
+import uuid
+
+
+# Row encoders for the ClickHouse input formats used by clickhouse.insert()
+
+epoch = datetime.date(1970, 1, 1)
+
+fixed = {
+    "Int8": "<b",
+    "Int16": "<h",
+    "Int32": "<i",
+    "Int64": "<q",
+    "UInt8": "<B",
+    "UInt16": "<H",
+    "UInt32": "<I",
+    "UInt64": "<Q",
+    "Float32": "<f",
+    "Float64": "<d",
+}
+
+tsv_escapes = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0", "\b": "\\b", "\f": "\\f"})
+
+
+def varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def binary_string(value):
+    if isinstance(value, str):
+        value = value.encode()
+    return varint(len(value)) + value
+
+
+def days(value):
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return (value - epoch).days
+    return int(value)
+
+
+def seconds(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return int(value.timestamp())
+    return int(value)
+
+
+def unwrap(type_name, wrapper):
+    match = re.match(rf"^{wrapper}\((.*)\)$", type_name)
+    return match.group(1) if match else None
+
+
+def value_encoder(type_name):
+    # Returns a function encoding one non-NULL value of type_name
+    if type_name in fixed:
+        packer = struct.Struct(fixed[type_name])
+        return lambda v: packer.pack(v)
+    if type_name == "String":
+        return binary_string
+    size = unwrap(type_name, "FixedString")
+    if size is not None:
+        size = int(size)
+        return lambda v: (v.encode() if isinstance(v, str) else v).ljust(size, b"\0")[:size]
+    if type_name == "Date":
+        return lambda v: struct.pack("<H", days(v))
+    if type_name == "DateTime" or type_name.startswith("DateTime("):
+        return lambda v: struct.pack("<I", seconds(v))
+    raise ValueError(f"{type_name} is not supported by the binary encoders")
+
+
+def row_binary_encoder(type_name):
+    inner = unwrap(type_name, "LowCardinality")
+    if inner is not None:
+        # RowBinary carries LowCardinality values as plain values of the wrapped type
+        return row_binary_encoder(inner)
+    inner = unwrap(type_name, "Nullable")
+    if inner is None:
+        return value_encoder(type_name)
+    encode = value_encoder(inner)
+    return lambda v: b"\1" if v is None else b"\0" + encode(v)
+
+
+def native_column_encoder(type_name):
+    # Returns a function encoding the values of one column of a Native block
+    inner = unwrap(type_name, "Nullable")
+    if inner is None:
+        if unwrap(type_name, "LowCardinality") is not None:
+            raise ValueError(f"{type_name} is not supported by the Native encoder, use RowBinary")
+        encode = value_encoder(type_name)
+        return lambda values: b"".join(encode(v) for v in values)
+    encode = value_encoder(inner)
+    default = encode(default_value(inner))
+    return lambda values: (
+        bytes(1 if v is None else 0 for v in values) +
+        b"".join(default if v is None else encode(v) for v in values)
+    )
+
+
+def default_value(type_name):
+    if type_name in fixed or type_name in ("Date", "DateTime") or type_name.startswith("DateTime("):
+        return 0
+    return ""
+
+
+def tsv_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        value = value.decode(errors="replace")
+    return str(value).translate(tsv_escapes)
+
+
+def encoder(fmt, columns=None, types=None):
+    # Returns a function encoding a list of rows into one chunk of fmt
+    if fmt in ("TSV", "TabSeparated"):
+        return lambda rows: "".join("\t".join(tsv_value(v) for v in row) + "\n" for row in rows).encode()
+    if types is None:
+        raise ValueError(f"{fmt} needs column types")
+    if fmt == "RowBinary":
+        encoders = [row_binary_encoder(t) for t in types]
+        return lambda rows: b"".join(b"".join(e(v) for e, v in zip(encoders, row)) for row in rows)
+    if fmt == "Native":
+        encoders = [native_column_encoder(t) for t in types]
+        header = [binary_string(c) + binary_string(t) for c, t in zip(columns, types)]
+
+        def native(rows):
+            block = [varint(len(columns)), varint(len(rows))]
+            for i, encode in enumerate(encoders):
+                block.append(header[i])
+                block.append(encode([row[i] for row in rows]))
+            return b"".join(block)
+        return native
+    raise ValueError(f"{fmt} is not supported, use TSV, RowBinary or Native")
+
+
+def chunks(rows, block_size):
+    # Groups an iterable of rows into lists of at most block_size rows, only one list is held at a time
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= block_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+# Result decoders for clickhouse.query_typed() and clickhouse.query_rows()
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+numpy_types = {
+    "Int8": "int8",
+    "Int16": "int16",
+    "Int32": "int32",
+    "Int64": "int64",
+    "UInt8": "uint8",
+    "UInt16": "uint16",
+    "UInt32": "uint32",
+    "UInt64": "uint64",
+    "Float32": "float32",
+    "Float64": "float64",
+}
+
+tsv_unescapes = {"t": "\t", "n": "\n", "r": "\r", "0": "\0", "b": "\b", "f": "\f", "\\": "\\", "'": "'", "a": "\a", "v": "\v"}
+
+
+def base_type(type_name):
+    inner = unwrap(type_name, "LowCardinality")
+    return base_type(inner) if inner is not None else type_name
+
+
+def enum_values(type_name):
+    # Enum8('a' = 1, 'b' = 2) -> {1: "a", 2: "b"}
+    return {int(v): n.replace("\\'", "'") for n, v in re.findall(r"'((?:\\'|[^'])*)'\s*=\s*(-?\d+)", type_name)}
+
+
+class Reader:
+    """Exact-size reads over a byte stream, e.g. an HTTP response or a subprocess stdout"""
+
+    def __init__(self, stream, buffer_size=1 << 16):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = b""
+        self.offset = 0
+
+    def fill(self, n):
+        while len(self.buffer) - self.offset < n:
+            data = self.stream.read(max(self.buffer_size, n))
+            if not data:
+                return False
+            self.buffer = self.buffer[self.offset:] + data
+            self.offset = 0
+        return True
+
+    def at_end(self):
+        return not self.fill(1)
+
+    def read(self, n):
+        if not self.fill(n):
+            raise EOFError("result ended in the middle of a value")
+        data = self.buffer[self.offset:self.offset + n]
+        self.offset += n
+        return data
+
+    def varint(self):
+        n = 0
+        shift = 0
+        while True:
+            byte = self.read(1)[0]
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def string(self):
+        return self.read(self.varint())
+
+
+def binary_decoder(type_name):
+    # Returns a function reading one RowBinary value of type_name from a Reader
+    type_name = base_type(type_name)
+    inner = unwrap(type_name, "Nullable")
+    if inner is not None:
+        decode = binary_decoder(inner)
+        return lambda r: None if r.read(1) == b"\1" else decode(r)
+    inner = unwrap(type_name, "Array")
+    if inner is not None:
+        decode = binary_decoder(inner)
+        return lambda r: [decode(r) for _ in range(r.varint())]
+    if type_name in fixed:
+        unpacker = struct.Struct(fixed[type_name])
+        return lambda r: unpacker.unpack(r.read(unpacker.size))[0]
+    if type_name == "String":
+        return lambda r: r.string().decode(errors="replace")
+    size = unwrap(type_name, "FixedString")
+    if size is not None:
+        return lambda r: r.read(int(size))
+    if type_name == "Date":
+        return lambda r: epoch + datetime.timedelta(days=struct.unpack("<H", r.read(2))[0])
+    if type_name == "DateTime" or type_name.startswith("DateTime("):
+        return lambda r: datetime.datetime.fromtimestamp(struct.unpack("<I", r.read(4))[0], datetime.timezone.utc)
+    if type_name.startswith("DateTime64("):
+        precision = int(re.search(r"\((\d+)", type_name).group(1))
+        return lambda r: datetime.datetime.fromtimestamp(
+            struct.unpack("<q", r.read(8))[0] / 10 ** precision, datetime.timezone.utc,
+        )
+    if type_name.startswith("Enum8(") or type_name.startswith("Enum16("):
+        values = enum_values(type_name)
+        unpacker = struct.Struct("<b" if type_name.startswith("Enum8(") else "<h")
+        return lambda r: values[unpacker.unpack(r.read(unpacker.size))[0]]
+    if type_name == "UUID":
+        # two little-endian UInt64 halves
+        return lambda r: uuid_value(r.read(16))
+    if type_name.startswith("Decimal"):
+        return decimal_decoder(type_name)
+    raise ValueError(f"{type_name} is not supported by the RowBinary decoder")
+
+
+def uuid_value(data):
+    return uuid.UUID(bytes=data[7::-1] + data[15:7:-1])
+
+
+def decimal_decoder(type_name):
+    match = re.match(r"^Decimal(\d+)?\((\d+)(?:,\s*(\d+))?\)$", type_name)
+    if match.group(1) is not None:
+        bits, digits = int(match.group(1)), int(match.group(2))
+    else:
+        precision, digits = int(match.group(2)), int(match.group(3) or 0)
+        bits = 32 if precision <= 9 else 64 if precision <= 18 else 128 if precision <= 38 else 256
+    size = bits // 8
+    return lambda r: decimal.Decimal(int.from_bytes(r.read(size), "little", signed=True)).scaleb(-digits)
+
+
+def text_decoder(type_name):
+    # Returns a function converting one unescaped TSV/JSON value of type_name, unknown types stay strings
+    type_name = base_type(type_name)
+    inner = unwrap(type_name, "Nullable")
+    if inner is not None:
+        decode = text_decoder(inner)
+        return lambda v: None if v is None else decode(v)
+    inner = unwrap(type_name, "Array")
+    if inner is not None:
+        decode = text_decoder(inner)
+        return lambda v: [decode(x) for x in (json_array(v) if isinstance(v, str) else v)]
+    if type_name.startswith("Int") or type_name.startswith("UInt"):
+        return int
+    if type_name.startswith("Float"):
+        return float
+    if type_name.startswith("Decimal"):
+        return lambda v: decimal.Decimal(str(v))
+    if type_name == "Date":
+        return lambda v: datetime.date.fromisoformat(v)
+    if type_name.startswith("DateTime"):
+        return lambda v: datetime.datetime.fromisoformat(v)
+    return lambda v: v
+
+
+def json_array(value):
+    return json.loads(value.replace("'", '"'))
+
+
+def tsv_field(value):
+    if value == "\\N":
+        return None
+    if "\\" not in value:
+        return value
+    return re.sub(r"\\(.)", lambda m: tsv_unescapes.get(m.group(1), m.group(1)), value)
+
+
+def decode_stream(fmt, stream):
+    # Returns (names, types, rows), rows is an iterator decoding the stream lazily where the format allows it
+    if fmt == "RowBinaryWithNamesAndTypes":
+        reader = Reader(stream)
+        if reader.at_end():
+            return [], [], iter(())
+        count = reader.varint()
+        names = [reader.string().decode() for _ in range(count)]
+        types = [reader.string().decode() for _ in range(count)]
+        decoders = [binary_decoder(t) for t in types]
+
+        def binary_rows():
+            while not reader.at_end():
+                yield tuple(decode(reader) for decode in decoders)
+        return names, types, binary_rows()
+    if fmt == "TSVWithNamesAndTypes":
+        lines = (line.decode().rstrip("\n") for line in iter(stream.readline, b""))
+        names = [tsv_field(n) for n in next(lines, "").split("\t")]
+        types = [tsv_field(t) for t in next(lines, "").split("\t")]
+        decoders = [text_decoder(t) for t in types]
+
+        def tsv_rows():
+            for line in lines:
+                yield tuple(decode(tsv_field(v)) for decode, v in zip(decoders, line.split("\t")))
+        return names, types, tsv_rows()
+    if fmt == "JSONCompact":
+        result = json.loads(stream.read())
+        names = [c["name"] for c in result["meta"]]
+        types = [c["type"] for c in result["meta"]]
+        decoders = [text_decoder(t) for t in types]
+        return names, types, (tuple(decode(v) for decode, v in zip(decoders, row)) for row in result["data"])
+    raise ValueError(f"{fmt} is not supported, use RowBinaryWithNamesAndTypes, TSVWithNamesAndTypes or JSONCompact")
+
+
+class Result:
+    """Typed query result kept as columns, numeric columns become NumPy arrays with as_numpy=True"""
+
+    def __init__(self, names, types, rows, as_numpy=False):
+        self.names = names
+        self.types = types
+        columns = [[] for _ in names]
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+        if as_numpy:
+            if numpy is None:
+                raise ImportError("numpy is required for as_numpy=True")
+            columns = [
+                numpy.array(c, dtype=numpy_types[base_type(t)]) if base_type(t) in numpy_types else c
+                for c, t in zip(columns, types)
+            ]
+        self.columns = dict(zip(names, columns))
+
+    def __len__(self):
+        return len(self.columns[self.names[0]]) if len(self.names) > 0 else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def rows(self):
+        return zip(*(self.columns[n] for n in self.names))
@@ -0,0 +1,230 @@
+import atexit
+import json
+import re
+import shlex
+import subprocess
+import threading
+import time
+import urllib.parse
+import uuid
+
+import kubeapi
+import settings
+
+
+# ClickHouse HTTP interface client for clickhouse.query().
+# Every pod is reached through one long-lived `kubectl port-forward` (or settings.clickhouse_http_url standing in
+# for all pods) and keep-alive connections are pooled per pod, so a query costs one HTTP round-trip
+# instead of a kubectl exec and a new clickhouse-client process.
+
+
+class Unavailable(Exception):
+    pass
+
+
+def unquote(sql):
+    # clickhouse.query() callers escape SQL for the `--query="..."` shell argument of clickhouse-client
+    return re.sub(r'\\([$`"\\\n])', r"\1", sql)
+
+
+def split_statements(sql):
+    # clickhouse-client -n accepts several statements, the HTTP interface takes one per request
+    statements = []
+    current = ""
+    quote = None
+    escaped = False
+    for c in sql:
+        if escaped:
+            escaped = False
+        elif c == "\\" and quote is not None:
+            escaped = True
+        elif quote is not None:
+            if c == quote:
+                quote = None
+        elif c in "'\"`":
+            quote = c
+        elif c == ";":
+            statements.append(current)
+            current = ""
+            continue
+        current += c
+    statements.append(current)
+    return [s.strip() for s in statements if s.strip() != ""]
+
+
+def parse_params(advanced_params):
+    # "--name=value" clickhouse-client settings become URL parameters, None when anything else is passed
+    params = {}
+    for arg in shlex.split(advanced_params):
+        match = re.match(r"^--(\w+)=(.*)$", arg)
+        if match is None:
+            return None
+        params[match.group(1)] = match.group(2)
+    return params
+
+
+class PortForward:
+    """Long-lived `kubectl port-forward` to the HTTP port of a single pod"""
+
+    def __init__(self, pod, ns, port=8123, kubectl_cmd=settings.kubectl_cmd, timeout=30):
+        self.pod = pod
+        self.ns = ns
+        self.port = port
+        self.kubectl_cmd = kubectl_cmd
+        self.timeout = timeout
+        self.process = None
+        self.url = None
+
+    def start(self):
+        cmd = shlex.split(self.kubectl_cmd) + ["port-forward", f"--namespace={self.ns}", f"pod/{self.pod}", f":{self.port}"]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            line = self.process.stdout.readline()
+            if not line:
+                break
+            match = re.search(rf"Forwarding from 127\.0\.0\.1:(\d+) -> {self.port}", line)
+            if match:
+                self.url = f"http://127.0.0.1:{match.group(1)}"
+                # keep draining, kubectl logs every handled connection
+                threading.Thread(target=self.process.stdout.read, daemon=True).start()
+                return self.url
+        self.stop()
+        raise Unavailable(f"kubectl port-forward to {self.ns}/{self.pod} did not start: {' '.join(cmd)}")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class Client:
+    def __init__(self, url=settings.clickhouse_http_url, kubectl_cmd=settings.kubectl_cmd):
+        self.url = url
+        self.kubectl_cmd = kubectl_cmd
+        self.forwards = {}
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def pool(self, pod, ns):
+        key = (ns, pod)
+        with self.lock:
+            if self.url != "":
+                key = self.url
+            elif key in self.forwards and not self.forwards[key].alive():
+                self.forwards.pop(key)
+                self.pools.pop(key).close()
+            if key not in self.pools:
+                url = self.url
+                if url == "":
+                    forward = PortForward(pod, ns, kubectl_cmd=self.kubectl_cmd)
+                    url = forward.start()
+                    self.forwards[key] = forward
+                self.pools[key] = kubeapi.ConnectionPool(url)
+            return self.pools[key]
+
+    def drop(self, pod, ns):
+        with self.lock:
+            forward = self.forwards.pop((ns, pod), None)
+            if forward is not None:
+                forward.stop()
+            pool = self.pools.pop((ns, pod), None)
+            if pool is not None:
+                pool.close()
+
+    @staticmethod
+    def request(user, pwd, params, session_id="", query_id=""):
+        # Returns (path, headers) of a query request
+        params = dict(params or {})
+        if session_id != "":
+            params["session_id"] = session_id
+        if query_id != "":
+            params["query_id"] = query_id
+        headers = {"X-ClickHouse-User": user}
+        if pwd != "":
+            headers["X-ClickHouse-Key"] = pwd
+        return "/?" + urllib.parse.urlencode(params), headers
+
+    def execute(self, pod, ns, sql, user="default", pwd="", params=None, timeout=60, session_id="", query_id="", data=None):
+        # Returns (status, headers, body), with data the statement goes to the URL and data is the request body
+        params = dict(params or {})
+        body = sql.encode()
+        if data is not None:
+            params["query"] = sql
+            body = data
+        path, headers = self.request(user, pwd, params, session_id, query_id)
+        self.requests += 1
+        try:
+            status, _, response_headers, response = self.pool(pod, ns).request(
+                "POST", path, body=body, headers=headers, timeout=timeout,
+            )
+        except ConnectionRefusedError:
+            # port-forward went away together with the pod, nothing was sent yet
+            self.drop(pod, ns)
+            status, _, response_headers, response = self.pool(pod, ns).request(
+                "POST", path, body=body, headers=headers, timeout=timeout,
+            )
+        return status, response_headers, response.decode(errors="replace")
+
+    def stream(self, pod, ns, sql, user="default", pwd="", params=None, timeout=60):
+        # Returns (connection, response) for a result read incrementally, the caller closes the connection
+        path, headers = self.request(user, pwd, params)
+        self.requests += 1
+        return self.pool(pod, ns).stream("POST", path, headers=headers, timeout=timeout, body=sql.encode())
+
+    def query(self, pod, ns, sql, user="default", pwd="", params=None, timeout=60, query_id="", summary=None):
+        # Returns (ok, output) like `clickhouse-client -mn --query=...`: outputs of the executed statements,
+        # followed by the error of the failed one. X-ClickHouse-Summary counters are added up into summary.
+        statements = split_statements(unquote(sql))
+        session_id = uuid.uuid4().hex if len(statements) > 1 else ""
+        output = []
+        for statement in statements:
+            status, headers, body = self.execute(pod, ns, statement, user, pwd, params, timeout, session_id, query_id)
+            if summary is not None and "X-ClickHouse-Summary" in headers:
+                for name, value in json.loads(headers["X-ClickHouse-Summary"]).items():
+                    summary[name] = summary.get(name, 0) + int(value)
+            if body.strip() != "":
+                output.append(body.rstrip("\n"))
+            if status != 200:
+                return False, "\n".join(output)
+        return True, "\n".join(output)
+
+    def close(self):
+        with self.lock:
+            for forward in self.forwards.values():
+                forward.stop()
+            for pool in self.pools.values():
+                pool.close()
+            self.forwards = {}
+            self.pools = {}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+        return _client
+
+
+def reset():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+
+atexit.register(reset)
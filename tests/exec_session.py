@@ -0,0 +1,170 @@
+import atexit
+import queue
+import shlex
+import subprocess
+import threading
+import time
+import uuid
+
+import settings
+
+
+# Persistent `kubectl exec -i ... -- sh` per pod/container. Commands are written to the shell one at a time and
+# framed by a unique marker line carrying the exit code, so repeated in-pod commands skip the exec setup.
+
+
+class Session:
+    def __init__(self, pod, container="", ns="", kubectl_cmd=settings.kubectl_cmd):
+        self.pod = pod
+        self.container = container
+        self.ns = ns
+        self.kubectl_cmd = kubectl_cmd
+        self.process = None
+        self.lines = None
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self.connects = 0
+        self.commands = 0
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        cmd = shlex.split(self.kubectl_cmd) + ["exec", "-i"]
+        if self.ns != "":
+            cmd.append(f"--namespace={self.ns}")
+        cmd.append(self.pod)
+        if self.container != "":
+            cmd += ["-c", self.container]
+        cmd += ["--", "sh"]
+        self.process = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+        )
+        self.lines = queue.Queue()
+        self.connects += 1
+        threading.Thread(target=self.read, args=(self.process, self.lines), daemon=True).start()
+
+    @staticmethod
+    def read(process, lines):
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def send(self, script):
+        if not self.alive():
+            self.close()
+            self.start()
+        try:
+            self.process.stdin.write(script)
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            # the stream died while idle, nothing reached the pod yet
+            self.close()
+            self.start()
+            self.process.stdin.write(script)
+            self.process.stdin.flush()
+
+    def run(self, command, timeout=60):
+        # Returns (exitcode, output), output is stdout and stderr of the command without trailing newlines
+        with self.lock:
+            self.commands += 1
+            marker = f"__exec_session_{uuid.uuid4().hex}__"
+            self.send(f"{{ {command}\n}} </dev/null 2>&1; printf '\\n{marker} %d\\n' $?\n")
+            output = ""
+            deadline = time.time() + timeout
+            while True:
+                try:
+                    line = self.lines.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    self.close(kill=True)
+                    return 124, (output + f"command timed out after {timeout} seconds").strip("\n")
+                if line is None:
+                    # the stream ended mid-command, e.g. the container was killed, reconnect on next run
+                    code = self.process.wait()
+                    self.close()
+                    return code if code != 0 else 255, output.rstrip("\n")
+                if line.startswith(marker):
+                    self.last_used = time.time()
+                    return int(line[len(marker):].strip()), output.rstrip("\n")
+                output += line
+
+    def close(self, kill=False):
+        if self.process is not None:
+            if kill:
+                self.process.kill()
+                self.process.wait()
+            if self.process.poll() is None:
+                try:
+                    self.process.stdin.close()
+                except (BrokenPipeError, ValueError):
+                    pass
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process.stdout.close()
+        self.process = None
+
+
+class Sessions:
+    def __init__(self, idle_timeout=settings.exec_session_idle_timeout, kubectl_cmd=settings.kubectl_cmd):
+        self.idle_timeout = idle_timeout
+        self.kubectl_cmd = kubectl_cmd
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        threading.Thread(target=self.reap, daemon=True).start()
+
+    def get(self, pod, container="", ns=""):
+        with self.lock:
+            key = (ns, pod, container)
+            if key not in self.sessions:
+                self.sessions[key] = Session(pod, container, ns, self.kubectl_cmd)
+            return self.sessions[key]
+
+    def run(self, pod, command, container="", ns="", timeout=60):
+        return self.get(pod, container, ns).run(command, timeout)
+
+    def reap(self):
+        while not self.stopped.wait(max(self.idle_timeout / 2, 1)):
+            with self.lock:
+                idle = [s for s in self.sessions.values() if time.time() - s.last_used > self.idle_timeout]
+            for session in idle:
+                if session.lock.acquire(blocking=False):
+                    try:
+                        if time.time() - session.last_used > self.idle_timeout:
+                            session.close()
+                    finally:
+                        session.lock.release()
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            for session in self.sessions.values():
+                with session.lock:
+                    session.close()
+            self.sessions = {}
+
+
+_sessions = None
+_sessions_lock = threading.Lock()
+
+
+def sessions():
+    global _sessions
+    with _sessions_lock:
+        if _sessions is None:
+            _sessions = Sessions()
+        return _sessions
+
+
+def reset():
+    global _sessions
+    with _sessions_lock:
+        if _sessions is not None:
+            _sessions.close()
+        _sessions = None
+
+
+atexit.register(reset)
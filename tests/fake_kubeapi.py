@@ -0,0 +1,392 @@
+import copy
+import json
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-memory stand-in for the Kubernetes API server.
+# Serves discovery, get/list/watch/create/apply/delete for the kinds used by the tests
+# so that kubeapi.py and the kubectl binary can be exercised and benchmarked without a cluster.
+
+resources = [
+    # group, version, plural, kind, namespaced, short names
+    ("", "v1", "namespaces", "Namespace", False, ["ns"]),
+    ("", "v1", "pods", "Pod", True, ["po"]),
+    ("", "v1", "services", "Service", True, ["svc"]),
+    ("", "v1", "configmaps", "ConfigMap", True, ["cm"]),
+    ("", "v1", "endpoints", "Endpoints", True, ["ep"]),
+    ("", "v1", "persistentvolumeclaims", "PersistentVolumeClaim", True, ["pvc"]),
+    ("", "v1", "persistentvolumes", "PersistentVolume", False, ["pv"]),
+    ("apps", "v1", "statefulsets", "StatefulSet", True, ["sts"]),
+    ("apps", "v1", "deployments", "Deployment", True, ["deploy"]),
+    ("storage.k8s.io", "v1", "storageclasses", "StorageClass", False, ["sc"]),
+    ("apiextensions.k8s.io", "v1", "customresourcedefinitions", "CustomResourceDefinition", False, ["crd", "crds"]),
+    ("clickhouse.altinity.com", "v1", "clickhouseinstallations", "ClickHouseInstallation", True, ["chi"]),
+    ("clickhouse.altinity.com", "v1", "clickhouseinstallationtemplates", "ClickHouseInstallationTemplate", True,
+     ["chit"]),
+]
+
+
+def api_version(group, version):
+    return f"{group}/{version}" if group else version
+
+
+def match_labels(labels, selector):
+    if not selector:
+        return True
+    labels = labels or {}
+    for requirement in re.split(r",(?![^(]*\))", selector):
+        requirement = requirement.strip()
+        match = re.match(r"^([\w./-]+)\s+(in|notin)\s+\((.*)\)$", requirement)
+        if match:
+            key, op, values = match.group(1), match.group(2), {v.strip() for v in match.group(3).split(",")}
+            if (labels.get(key) in values) != (op == "in"):
+                return False
+        elif "!=" in requirement:
+            key, value = requirement.split("!=", 1)
+            if labels.get(key.strip()) == value.strip():
+                return False
+        elif "=" in requirement:
+            key, value = re.split(r"==?", requirement, 1)
+            if labels.get(key.strip()) != value.strip():
+                return False
+        elif requirement.startswith("!"):
+            if requirement[1:] in labels:
+                return False
+        elif requirement not in labels:
+            return False
+    return True
+
+
+def match_fields(obj, selector):
+    if not selector:
+        return True
+    for requirement in selector.split(","):
+        key, value = requirement.split("=", 1)
+        current = obj
+        for part in key.strip().split("."):
+            current = current.get(part, "") if isinstance(current, dict) else ""
+        if str(current) != value.strip():
+            return False
+    return True
+
+
+class Store:
+    def __init__(self):
+        self.objects = {}
+        self.events = []
+        self.revision = 0
+        self.lock = threading.Condition()
+
+    def next_revision(self):
+        self.revision += 1
+        return str(self.revision)
+
+    def put(self, plural, ns, obj):
+        with self.lock:
+            name = obj["metadata"]["name"]
+            key = (plural, ns or "", name)
+            old = self.objects.get(key)
+            obj = copy.deepcopy(obj)
+            meta = obj.setdefault("metadata", {})
+            if ns:
+                meta["namespace"] = ns
+            if old is not None:
+                meta.setdefault("uid", old["metadata"]["uid"])
+                meta.setdefault("creationTimestamp", old["metadata"]["creationTimestamp"])
+                if "status" not in obj and "status" in old:
+                    obj["status"] = old["status"]
+            meta.setdefault("uid", str(uuid.uuid4()))
+            meta.setdefault("creationTimestamp", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+            meta["resourceVersion"] = self.next_revision()
+            self.objects[key] = obj
+            self.record("ADDED" if old is None else "MODIFIED", plural, ns, obj)
+            return copy.deepcopy(obj), old is None
+
+    def get(self, plural, ns, name):
+        with self.lock:
+            obj = self.objects.get((plural, ns or "", name))
+            return copy.deepcopy(obj) if obj is not None else None
+
+    def list(self, plural, ns=None, label_selector="", field_selector=""):
+        with self.lock:
+            items = [
+                copy.deepcopy(obj) for (p, n, _), obj in sorted(self.objects.items())
+                if p == plural and (ns is None or n == ns)
+                and match_labels(obj["metadata"].get("labels"), label_selector)
+                and match_fields(obj, field_selector)
+            ]
+            return items, str(self.revision)
+
+    def delete(self, plural, ns, name):
+        with self.lock:
+            obj = self.objects.pop((plural, ns or "", name), None)
+            if obj is None:
+                return None
+            obj["metadata"]["resourceVersion"] = self.next_revision()
+            self.record("DELETED", plural, ns, obj)
+            if plural == "namespaces":
+                for key in [k for k in self.objects if k[1] == name]:
+                    child = self.objects.pop(key)
+                    child["metadata"]["resourceVersion"] = self.next_revision()
+                    self.record("DELETED", key[0], key[1], child)
+            return obj
+
+    def record(self, event_type, plural, ns, obj):
+        self.events.append((self.revision, event_type, plural, ns or "", copy.deepcopy(obj)))
+        self.lock.notify_all()
+
+    def wait_events(self, after, timeout):
+        with self.lock:
+            if self.revision <= after:
+                self.lock.wait(timeout)
+            found = []
+            for event in reversed(self.events):
+                if event[0] <= after:
+                    break
+                found.append(event)
+            return list(reversed(found))
+
+
+def merge(target, patch):
+    # RFC 7386 JSON merge patch
+    if not isinstance(patch, dict):
+        return patch
+    target = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = merge(target.get(key), value)
+    return target
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "fake-kube-apiserver"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_status(self, code, reason, message):
+        self.send_json(code, {
+            "kind": "Status", "apiVersion": "v1", "metadata": {},
+            "status": "Failure", "message": message, "reason": reason, "code": code,
+        })
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def route(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(parsed.query).items()}
+        parts = [p for p in parsed.path.split("/") if p]
+        if parts[:1] == ["api"]:
+            group, version, rest = "", parts[1] if len(parts) > 1 else None, parts[2:]
+        elif parts[:1] == ["apis"]:
+            group = parts[1] if len(parts) > 1 else None
+            version = parts[2] if len(parts) > 2 else None
+            rest = parts[3:]
+        else:
+            return None, None, None, None, parts, query
+        ns = None
+        if len(rest) >= 2 and rest[0] == "namespaces" and len(rest) != 2:
+            ns, rest = rest[1], rest[2:]
+        plural = rest[0] if rest else None
+        name = rest[1] if len(rest) > 1 else None
+        resource = next((r for r in resources if (r[0], r[1], r[2]) == (group, version, plural)), None)
+        return group, version, resource, ns, name, query
+
+    def discovery(self, parts):
+        if parts == ["version"]:
+            return {"major": "1", "minor": "19", "gitVersion": "v1.19.0-fake"}
+        if parts == ["api"]:
+            return {"kind": "APIVersions", "versions": ["v1"], "serverAddressByClientCIDRs": []}
+        if parts == ["apis"]:
+            groups = []
+            for group in dict.fromkeys(r[0] for r in resources if r[0]):
+                version = {"groupVersion": f"{group}/v1", "version": "v1"}
+                groups.append({"name": group, "versions": [version], "preferredVersion": version})
+            return {"kind": "APIGroupList", "apiVersion": "v1", "groups": groups}
+        if parts == ["api", "v1"] or (len(parts) == 3 and parts[0] == "apis"):
+            group = "" if parts[0] == "api" else parts[1]
+            return {
+                "kind": "APIResourceList",
+                "groupVersion": api_version(group, parts[-1]),
+                "resources": [
+                    {
+                        "name": r[2], "singularName": r[3].lower(), "namespaced": r[4], "kind": r[3],
+                        "shortNames": r[5],
+                        "verbs": ["create", "delete", "get", "list", "patch", "update", "watch"],
+                    }
+                    for r in resources if r[0] == group
+                ],
+            }
+        return None
+
+    def do_GET(self):
+        group, version, resource, ns, name, query = self.route()
+        if resource is None:
+            body = self.discovery([p for p in urllib.parse.urlsplit(self.path).path.split("/") if p])
+            if body is None:
+                return self.send_status(404, "NotFound", f"{self.path} not found")
+            return self.send_json(200, body)
+        if query.get("watch") in ("1", "true"):
+            return self.watch(resource, ns, query)
+        if name:
+            obj = self.store.get(resource[2], ns, name)
+            if obj is None:
+                return self.send_status(404, "NotFound", f'{resource[2]} "{name}" not found')
+            return self.send_json(200, obj)
+        items, revision = self.store.list(
+            resource[2], ns, query.get("labelSelector", ""), query.get("fieldSelector", ""),
+        )
+        self.send_json(200, {
+            "kind": f"{resource[3]}List", "apiVersion": api_version(resource[0], resource[1]),
+            "metadata": {"resourceVersion": revision}, "items": items,
+        })
+
+    def watch(self, resource, ns, query):
+        after = int(query.get("resourceVersion") or self.store.revision)
+        deadline = time.time() + float(query.get("timeoutSeconds", 60))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            while time.time() < deadline and not self.server.stopped:
+                for revision, event_type, plural, namespace, obj in self.store.wait_events(after, 0.5):
+                    after = revision
+                    if plural != resource[2] or (ns is not None and namespace != ns):
+                        continue
+                    if not match_labels(obj["metadata"].get("labels"), query.get("labelSelector", "")):
+                        continue
+                    if not match_fields(obj, query.get("fieldSelector", "")):
+                        continue
+                    line = json.dumps({"type": event_type, "object": obj}).encode() + b"\n"
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def write(self, create_only):
+        group, version, resource, ns, name, query = self.route()
+        if resource is None:
+            return self.send_status(404, "NotFound", f"{self.path} not found")
+        obj = self.read_body()
+        obj.setdefault("metadata", {})
+        name = name or obj["metadata"].get("name")
+        if self.command == "PATCH" and self.headers.get("Content-Type") == "application/merge-patch+json":
+            old = self.store.get(resource[2], ns, name)
+            if old is None:
+                return self.send_status(404, "NotFound", f'{resource[2]} "{name}" not found')
+            obj = merge(old, obj)
+        obj["metadata"]["name"] = name
+        obj["kind"] = resource[3]
+        obj["apiVersion"] = api_version(resource[0], resource[1])
+        if create_only and self.store.get(resource[2], ns, name) is not None:
+            return self.send_status(409, "AlreadyExists", f'{resource[2]} "{name}" already exists')
+        obj, created = self.store.put(resource[2], ns if resource[4] else None, obj)
+        self.send_json(201 if created else 200, obj)
+
+    def do_POST(self):
+        self.write(create_only=True)
+
+    def do_PUT(self):
+        self.write(create_only=False)
+
+    def do_PATCH(self):
+        self.write(create_only=False)
+
+    def do_DELETE(self):
+        group, version, resource, ns, name, query = self.route()
+        self.read_body()
+        if resource is None or not name:
+            return self.send_status(404, "NotFound", f"{self.path} not found")
+        obj = self.store.delete(resource[2], ns, name)
+        if obj is None:
+            return self.send_status(404, "NotFound", f'{resource[2]} "{name}" not found')
+        self.send_json(200, obj)
+
+
+class FakeApiServer:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.store = Store()
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.store = self.store
+        self.httpd.stopped = False
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.stopped = True
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def add(self, obj):
+        group = obj["apiVersion"].split("/")[0] if "/" in obj["apiVersion"] else ""
+        resource = next(r for r in resources if r[0] == group and r[3] == obj["kind"])
+        ns = obj["metadata"].get("namespace", "default") if resource[4] else None
+        return self.store.put(resource[2], ns, obj)[0]
+
+    def delete(self, plural, name, ns=None):
+        return self.store.delete(plural, ns, name)
+
+
+def chi_objects(chi, ns, shards=1, replicas=1):
+    # Objects which the operator creates for a CHI with a single cluster called "cluster"
+    labels = {"clickhouse.altinity.com/app": "chop", "clickhouse.altinity.com/chi": chi}
+    objects = [
+        {"apiVersion": "clickhouse.altinity.com/v1", "kind": "ClickHouseInstallation",
+         "metadata": {"name": chi, "namespace": ns}, "status": {"status": "Completed", "pods": [], "fqdns": []}},
+        {"apiVersion": "v1", "kind": "Service",
+         "metadata": {"name": f"clickhouse-{chi}", "namespace": ns, "labels": labels},
+         "spec": {"type": "LoadBalancer"}},
+    ]
+    for shard in range(shards):
+        for replica in range(replicas):
+            host = f"chi-{chi}-cluster-{shard}-{replica}"
+            objects[0]["status"]["pods"].append(f"{host}-0")
+            objects[0]["status"]["fqdns"].append(f"{host}.{ns}.svc.cluster.local")
+            objects += [
+                {"apiVersion": "apps/v1", "kind": "StatefulSet",
+                 "metadata": {"name": host, "namespace": ns, "labels": labels}, "spec": {"replicas": 1}},
+                {"apiVersion": "v1", "kind": "Service",
+                 "metadata": {"name": host, "namespace": ns, "labels": labels}, "spec": {"type": "ClusterIP"}},
+                {"apiVersion": "v1", "kind": "Pod",
+                 "metadata": {"name": f"{host}-0", "namespace": ns, "labels": labels},
+                 "spec": {"containers": [{
+                     "name": "clickhouse", "image": "yandex/clickhouse-server:20.7",
+                     "ports": [{"containerPort": 8123}, {"containerPort": 9000}, {"containerPort": 9009}],
+                     "volumeMounts": [{"mountPath": "/var/lib/clickhouse"}],
+                 }]},
+                 "status": {"phase": "Running", "containerStatuses": [{"ready": True}]}},
+            ]
+    return objects
@@ -0,0 +1,640 @@
+import atexit
+import concurrent.futures
+import http.client
+import json
+import socket
+import os
+import queue
+import re
+import shlex
+import subprocess
+import threading
+import time
+import urllib.parse
+
+import yaml
+
+import settings
+
+
+class ApiError(Exception):
+    def __init__(self, status, reason, body=""):
+        super().__init__(f"{status} {reason}: {body}")
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+
+class Unsupported(Exception):
+    # Raised for requests which only kubectl itself can serve, callers fall back to launch()
+    pass
+
+
+class WaitTimeout(Exception):
+    def __init__(self, message, state):
+        super().__init__(message)
+        self.state = state
+
+
+class Resource:
+    def __init__(self, group, version, plural, kind, namespaced, singular="", short_names=()):
+        self.group = group
+        self.version = version
+        self.plural = plural
+        self.kind = kind
+        self.namespaced = namespaced
+        self.singular = singular or kind.lower()
+        self.short_names = tuple(short_names)
+
+    @property
+    def api_version(self):
+        return f"{self.group}/{self.version}" if self.group else self.version
+
+    def names(self):
+        return {self.plural, self.singular, self.kind.lower(), *self.short_names}
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections to a single endpoint, safe to share between threads"""
+
+    def __init__(self, url, maxsize=8, timeout=60):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=maxsize)
+        self.connects = 0
+
+    def _connect(self, timeout):
+        self.connects += 1
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(self.timeout), False
+
+    def _release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        headers = dict(headers or {})
+        conn, reused = self._acquire()
+        try:
+            conn.timeout = timeout or self.timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # Server dropped an idle keep-alive connection, retry once on a fresh one
+                conn.close()
+                if not reused:
+                    raise
+                conn = self._connect(timeout or self.timeout)
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        return response.status, response.reason, dict(response.getheaders()), data
+
+    def stream(self, method, path, headers=None, timeout=None, body=None):
+        # Dedicated connection for long-running responses, caller reads and closes it
+        conn = self._connect(timeout or self.timeout)
+        conn.request(method, self.prefix + path, body=body, headers=dict(headers or {}))
+        return conn, conn.getresponse()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Proxy:
+    """Long-lived `kubectl proxy` which exposes the API server as a plain local HTTP endpoint"""
+
+    def __init__(self, kubectl_cmd=settings.kubectl_cmd, timeout=30):
+        self.kubectl_cmd = kubectl_cmd
+        self.timeout = timeout
+        self.process = None
+        self.url = None
+
+    def start(self):
+        cmd = shlex.split(self.kubectl_cmd) + ["proxy", "--port=0"]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            line = self.process.stdout.readline()
+            if not line:
+                break
+            match = re.search(r"Starting to serve on ([\w.\-]+:\d+)", line)
+            if match:
+                self.url = f"http://{match.group(1)}"
+                return self.url
+        self.stop()
+        raise ApiError(0, "kubectl proxy did not start", " ".join(cmd))
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+last_applied = "kubectl.kubernetes.io/last-applied-configuration"
+
+
+def merge_patch(applied, doc):
+    # JSON merge patch setting everything doc has and removing what only the previously applied configuration had,
+    # fields other managers set, e.g. the operator, are left alone
+    patch = dict(doc)
+    for key, value in applied.items():
+        if key not in doc:
+            patch[key] = None
+        elif isinstance(value, dict) and isinstance(doc[key], dict):
+            patch[key] = merge_patch(value, doc[key])
+    return patch
+
+
+def parse_label(label):
+    label = (label or "").strip()
+    if label.startswith("-l"):
+        label = label[2:].strip()
+    elif label.startswith("--selector="):
+        label = label[len("--selector="):]
+    return label.strip("\"'")
+
+
+_path_token = re.compile(r"((?:\\.|[^.\[\]])+)|\[(\*|-?\d+)\]")
+
+
+def parse_path(path):
+    path = path.strip()
+    if path.startswith("{") and path.endswith("}"):
+        path = path[1:-1]
+    tokens = []
+    for match in _path_token.finditer(path):
+        if match.group(1) is not None:
+            tokens.append(match.group(1).replace("\\", ""))
+        else:
+            index = match.group(2)
+            tokens.append("*" if index == "*" else int(index))
+    return tokens
+
+
+def field_values(obj, path):
+    values = [obj]
+    for token in parse_path(path):
+        found = []
+        for value in values:
+            if token == "*" and isinstance(value, list):
+                found.extend(value)
+            elif isinstance(token, int) and isinstance(value, list):
+                if -len(value) <= token < len(value):
+                    found.append(value[token])
+            elif isinstance(token, str) and isinstance(value, dict) and token in value:
+                found.append(value[token])
+        values = found
+    return values
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"))
+    return str(value)
+
+
+def custom_column(obj, path):
+    # Same rendering as `kubectl get -o=custom-columns=field:<path>` for a single row
+    values = field_values(obj, path)
+    if len(values) == 0:
+        return "<none>"
+    return ",".join(format_value(v) for v in values)
+
+
+def jsonpath(obj, template):
+    # Same rendering as `kubectl get -o jsonpath=<template>` for plain {.field} expressions
+    out = ""
+    for literal, expr in re.findall(r"([^{]*)(\{[^}]*\})?", template):
+        out += literal
+        if expr:
+            out += " ".join(format_value(v) for v in field_values(obj, expr))
+    return out
+
+
+class WatchStream:
+    """Iterator over (type, object) events of one watch request, close() aborts it from any thread"""
+
+    def __init__(self, conn, response):
+        self.conn = conn
+        self.response = response
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            while not self.closed:
+                line = self.response.readline()
+                if not line:
+                    return
+                event = json.loads(line)
+                yield event["type"], event["object"]
+        except (OSError, ValueError, AttributeError, http.client.HTTPException):
+            # close() from another thread shuts the socket down under readline()
+            if not self.closed:
+                raise
+        finally:
+            self.closed = True
+            self.conn.close()
+
+    def close(self):
+        self.closed = True
+        if self.conn.sock is not None:
+            try:
+                self.conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class Source:
+    """Objects of one kind selected by name and/or label, kept in sync from list + watch events"""
+
+    def __init__(self, kind, name="", label="", ns=None):
+        if name.startswith("-l"):
+            name, label = "", name
+        self.kind = kind
+        self.name = name
+        self.label = label
+        self.ns = ns
+        self.objects = {}
+        self.resource_version = ""
+
+    def __str__(self):
+        selector = self.name or parse_label(self.label) or "*"
+        return f"{self.kind} {selector}" + (f" in {self.ns}" if self.ns else "")
+
+    @property
+    def field_selector(self):
+        return f"metadata.name={self.name}" if self.name else None
+
+    def reset(self, items, resource_version):
+        self.objects = {(o["metadata"].get("namespace"), o["metadata"]["name"]): o for o in items}
+        self.resource_version = resource_version
+
+    def apply(self, event_type, obj):
+        meta = obj.get("metadata", {})
+        if meta.get("resourceVersion"):
+            self.resource_version = meta["resourceVersion"]
+        if event_type == "BOOKMARK":
+            return
+        key = (meta.get("namespace"), meta.get("name"))
+        if event_type == "DELETED":
+            self.objects.pop(key, None)
+        else:
+            self.objects[key] = obj
+
+    def items(self):
+        return [self.objects[key] for key in sorted(self.objects, key=lambda k: (k[0] or "", k[1]))]
+
+
+class ApiClient:
+    """Connection-pooled client to the Kubernetes API server, used by kubectl.py in place of subprocesses"""
+
+    def __init__(self, url, timeout=60):
+        self.url = url
+        self.pool = ConnectionPool(url, timeout=timeout)
+        self.requests = 0
+        # kubecache.Cache, when set list and get requests are served from its informers
+        self.cache = None
+        self._resources = None
+        self._lock = threading.Lock()
+
+    def request(self, method, path, params=None, body=None, content_type="application/json", timeout=None):
+        if params:
+            path += "?" + urllib.parse.urlencode(params)
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            if not isinstance(body, (bytes, str)):
+                body = json.dumps(body)
+            headers["Content-Type"] = content_type
+        self.requests += 1
+        status, reason, _, data = self.pool.request(method, path, body=body, headers=headers, timeout=timeout)
+        if status >= 400:
+            raise ApiError(status, reason, data.decode(errors="replace"))
+        return json.loads(data) if data else {}
+
+    def discover(self):
+        with self._lock:
+            if self._resources is not None:
+                return self._resources
+            resources = []
+            groups = [("", "v1", "/api/v1")]
+            for group in self.request("GET", "/apis").get("groups", []):
+                version = group["preferredVersion"]["version"]
+                groups.append((group["name"], version, f"/apis/{group['name']}/{version}"))
+            for group, version, path in groups:
+                try:
+                    found = self.request("GET", path).get("resources", [])
+                except (ApiError, OSError) as e:
+                    if group == "":
+                        raise
+                    # like kubectl, an aggregated API without a working backend, e.g. metrics.k8s.io,
+                    # only makes its own kinds unknown, they go through kubectl
+                    print(f"Kubernetes API discovery skips {group}/{version}: {e}")
+                    continue
+                for r in found:
+                    if "/" in r["name"]:
+                        continue
+                    resources.append(Resource(
+                        group, version, r["name"], r["kind"], r["namespaced"],
+                        r.get("singularName", ""), r.get("shortNames", []),
+                    ))
+            self._resources = resources
+            return resources
+
+    def resource(self, kind, api_version=None):
+        kind = kind.lower()
+        group = None
+        if api_version is not None:
+            group = api_version.rsplit("/", 1)[0] if "/" in api_version else ""
+        elif "." in kind:
+            kind, group = kind.split(".", 1)
+        for r in self.discover():
+            if kind in r.names() and (group is None or r.group == group or r.group.endswith(f".{group}")):
+                return r
+        raise Unsupported(f"unknown resource kind {kind}")
+
+    @staticmethod
+    def path(resource, ns=None, name=None):
+        base = f"/apis/{resource.api_version}" if resource.group else "/api/v1"
+        if resource.namespaced and ns not in (None, "--all-namespaces"):
+            base += f"/namespaces/{ns or 'default'}"
+        base += f"/{resource.plural}"
+        if name:
+            base += f"/{urllib.parse.quote(name)}"
+        return base
+
+    def list(self, kind, label="", ns=None, field_selector=None):
+        if self.cache is not None and not field_selector:
+            return self.cache.list(kind, label=label, ns=ns)
+        return self.fetch_list(kind, label, ns, field_selector)
+
+    def fetch_list(self, kind, label="", ns=None, field_selector=None):
+        resource = self.resource(kind)
+        params = {}
+        if parse_label(label):
+            params["labelSelector"] = parse_label(label)
+        if field_selector:
+            params["fieldSelector"] = field_selector
+        out = self.request("GET", self.path(resource, ns), params=params)
+        for item in out.get("items", []):
+            item.setdefault("kind", resource.kind)
+            item.setdefault("apiVersion", resource.api_version)
+        return out
+
+    def get(self, kind, name="", label="", ns=None):
+        if name.startswith("-l"):
+            name, label = "", name
+        if name and self.cache is not None:
+            for item in self.list(kind, ns=ns)["items"]:
+                if item["metadata"]["name"] == name:
+                    return item
+            raise ApiError(404, "NotFound", f'{kind} "{name}" not found')
+        if name:
+            return self.request("GET", self.path(self.resource(kind), ns, name))
+        out = self.list(kind, label=label, ns=ns)
+        return {
+            "apiVersion": "v1",
+            "kind": "List",
+            "items": out.get("items", []),
+            "metadata": {"resourceVersion": out.get("metadata", {}).get("resourceVersion", "")},
+        }
+
+    def items(self, kind, name="", label="", ns=None):
+        out = self.get(kind, name, label=label, ns=ns)
+        return out["items"] if out.get("kind") == "List" else [out]
+
+    def list_kinds(self, kinds, label="", ns=None):
+        # One list per kind, issued concurrently over the pool, returns {kind: items}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(kinds)) as pool:
+            lists = {kind: pool.submit(self.list, kind, label, ns) for kind in kinds}
+            return {kind: future.result().get("items", []) for kind, future in lists.items()}
+
+    def count(self, kind, name="", label="", ns=None):
+        try:
+            return len(self.items(kind, name, label=label, ns=ns))
+        except ApiError:
+            return 0
+
+    def apply(self, doc, ns=None, timeout=None):
+        # Client-side apply like `kubectl apply`: the manifest is kept in the last-applied-configuration annotation,
+        # an update is a merge patch against it. kubectl uses a strategic merge patch for built-in kinds,
+        # lists are replaced as a whole here, which is what it does for custom resources like the CHI.
+        resource = self.resource(doc["kind"], doc.get("apiVersion"))
+        name = doc["metadata"]["name"]
+        ns = doc["metadata"].get("namespace", ns)
+        body = json.loads(json.dumps(doc))
+        body["metadata"].setdefault("annotations", {})[last_applied] = json.dumps(doc, sort_keys=True)
+        try:
+            live = self.request("GET", self.path(resource, ns, name), timeout=timeout)
+        except ApiError as e:
+            if e.status != 404:
+                raise
+            live = None
+        if live is None:
+            out = self.request("POST", self.path(resource, ns), body=body, timeout=timeout)
+        else:
+            applied = json.loads(live["metadata"].get("annotations", {}).get(last_applied) or "{}")
+            out = self.request(
+                "PATCH", self.path(resource, ns, name),
+                body=merge_patch(applied, body), content_type="application/merge-patch+json", timeout=timeout,
+            )
+        self.written(resource, ns, out)
+        return out
+
+    def written(self, resource, ns, obj):
+        if self.cache is not None:
+            self.cache.written(resource.plural, ns, obj.get("metadata", {}).get("resourceVersion", ""))
+
+    def apply_file(self, config, ns=None, timeout=None):
+        for doc in load_manifest(config):
+            self.apply(doc, ns, timeout)
+
+    def delete(self, kind, name, ns=None, wait=True, timeout=60):
+        resource = self.resource(kind)
+        out = self.request("DELETE", self.path(resource, ns, name), body={"propagationPolicy": "Background"})
+        self.written(resource, ns, out)
+        if wait:
+            self.wait_deleted(kind, name, ns, timeout)
+
+    def delete_file(self, config, ns=None, timeout=60):
+        for doc in reversed(load_manifest(config)):
+            self.delete(doc["kind"], doc["metadata"]["name"], doc["metadata"].get("namespace", ns), timeout=timeout)
+
+    def wait_deleted(self, kind, name, ns, timeout):
+        # `kubectl delete` blocks until finalizers are done and the object is gone
+        try:
+            self.wait_for([Source(kind, name, ns=ns)], lambda state: len(state[0]) == 0, timeout)
+        except WaitTimeout as e:
+            raise ApiError(408, "Timeout", str(e))
+
+    def watch(self, kind, name="", label="", ns=None, resource_version="", timeout=60):
+        resource = self.resource(kind)
+        params = {"watch": "1", "allowWatchBookmarks": "true", "timeoutSeconds": str(max(1, int(timeout)))}
+        if resource_version:
+            params["resourceVersion"] = resource_version
+        if parse_label(label):
+            params["labelSelector"] = parse_label(label)
+        if name:
+            params["fieldSelector"] = f"metadata.name={name}"
+        path = self.path(resource, ns) + "?" + urllib.parse.urlencode(params)
+        self.requests += 1
+        conn, response = self.pool.stream("GET", path, headers={"Accept": "application/json"}, timeout=timeout + 10)
+        if response.status >= 400:
+            body = response.read().decode(errors="replace")
+            conn.close()
+            raise ApiError(response.status, response.reason, body)
+        return WatchStream(conn, response)
+
+    def sync(self, source):
+        out = self.list(source.kind, label=source.label, ns=source.ns, field_selector=source.field_selector)
+        return out.get("items", []), out.get("metadata", {}).get("resourceVersion", "")
+
+    def wait_for(self, sources, predicate, timeout):
+        """
+        Blocks until predicate(state) is true, state is a list with the current objects of every source.
+        Objects are listed once and then kept up to date from watch events, so the predicate is
+        re-evaluated the moment something changes. Raises WaitTimeout with the last seen state.
+        """
+        deadline = time.time() + timeout
+        for source in sources:
+            source.reset(*self.sync(source))
+
+        def state():
+            return [source.items() for source in sources]
+
+        if predicate(state()):
+            return state()
+
+        events = queue.Queue()
+        streams = {}
+        stop = threading.Event()
+
+        def follow(source, resource_version):
+            while not stop.is_set() and time.time() < deadline:
+                try:
+                    streams[source] = self.watch(
+                        source.kind, source.name, source.label, source.ns,
+                        resource_version=resource_version, timeout=deadline - time.time(),
+                    )
+                    if stop.is_set():
+                        streams[source].close()
+                    for event_type, obj in streams[source]:
+                        if event_type == "ERROR":
+                            # 410 Gone, the resourceVersion is too old: list again and resume from there
+                            items, resource_version = self.sync(source)
+                            events.put((source, "SYNC", (items, resource_version)))
+                            break
+                        resource_version = obj.get("metadata", {}).get("resourceVersion", resource_version)
+                        events.put((source, event_type, obj))
+                except (ApiError, OSError, http.client.HTTPException) as e:
+                    if not stop.is_set():
+                        events.put((source, "FAILED", e))
+                    return
+
+        threads = [
+            threading.Thread(target=follow, args=(source, source.resource_version), daemon=True)
+            for source in sources
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise WaitTimeout(
+                        f"condition is not met after {timeout}s, " +
+                        ", ".join(f"{source}: {len(source.objects)} object(s)" for source in sources),
+                        state(),
+                    )
+                try:
+                    source, event_type, obj = events.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                if event_type == "FAILED":
+                    raise obj
+                if event_type == "SYNC":
+                    source.reset(*obj)
+                else:
+                    source.apply(event_type, obj)
+                if predicate(state()):
+                    return state()
+        finally:
+            stop.set()
+            for stream in list(streams.values()):
+                stream.close()
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+        self.pool.close()
+
+
+def load_manifest(config):
+    if not os.path.isfile(config):
+        # process substitution, URLs and directories are left to kubectl
+        raise Unsupported(f"{config} is not a local manifest file")
+    with open(config, "r") as f:
+        return [doc for doc in yaml.safe_load_all(f) if doc]
+
+
+_client = None
+_proxy = None
+_client_lock = threading.Lock()
+
+
+def client():
+    global _client, _proxy
+    with _client_lock:
+        if _client is None:
+            url = settings.kube_api_url
+            if url == "":
+                _proxy = Proxy()
+                url = _proxy.start()
+            _client = ApiClient(url)
+        return _client
+
+
+def reset(url=None):
+    global _client, _proxy
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        if _proxy is not None:
+            _proxy.stop()
+        _client = ApiClient(url) if url else None
+        _proxy = None
+
+
+atexit.register(reset)
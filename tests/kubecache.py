@@ -0,0 +1,144 @@
+import copy
+import http.client
+import threading
+
+import kubeapi
+
+
+# Process-wide list+watch cache for the http transport.
+# Every (kind, namespace, label selector) that is read gets an informer: one list, then a background
+# watch keeps it current, so repeated reads of the same objects within a scenario cost no API requests.
+
+
+def newer(resource_version, required):
+    # resourceVersions are opaque, but the API server hands out increasing etcd revisions
+    if not required:
+        return True
+    if not resource_version:
+        return False
+    if resource_version.isdigit() and required.isdigit():
+        return int(resource_version) >= int(required)
+    return resource_version == required
+
+
+class Informer:
+    def __init__(self, client, kind, ns=None, label=""):
+        self.client = client
+        self.source = kubeapi.Source(kind, label=label, ns=ns)
+        self.required = ""
+        self.synced = False
+        self.stream = None
+        self.stopped = False
+        self.changed = threading.Condition()
+        self.thread = None
+
+    def sync(self):
+        out = self.client.fetch_list(self.source.kind, self.source.label, self.source.ns)
+        with self.changed:
+            self.source.reset(out.get("items", []), out.get("metadata", {}).get("resourceVersion", ""))
+            self.synced = True
+            self.changed.notify_all()
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.follow, daemon=True)
+            self.thread.start()
+
+    def follow(self):
+        while not self.stopped:
+            try:
+                self.stream = self.client.watch(
+                    self.source.kind, label=self.source.label, ns=self.source.ns,
+                    resource_version=self.source.resource_version, timeout=300,
+                )
+                gone = False
+                for event_type, obj in self.stream:
+                    if event_type == "ERROR":
+                        # 410 Gone, the next read lists again
+                        gone = True
+                        break
+                    with self.changed:
+                        if newer(obj["metadata"].get("resourceVersion", ""), self.source.resource_version):
+                            self.source.apply(event_type, obj)
+                            self.changed.notify_all()
+                if not gone:
+                    continue
+            except (kubeapi.ApiError, OSError, http.client.HTTPException):
+                pass
+            break
+        with self.changed:
+            self.synced = False
+
+    def require(self, resource_version):
+        with self.changed:
+            if newer(resource_version, self.required):
+                self.required = resource_version
+
+    def read(self, wait=2):
+        # Returns (items, resourceVersion, hit), hit is False when the informer had to list again
+        with self.changed:
+            if self.synced and not newer(self.source.resource_version, self.required):
+                # a write through this process is not observed yet, give the watch a moment to deliver it
+                self.changed.wait_for(lambda: newer(self.source.resource_version, self.required), timeout=wait)
+            hit = self.synced and newer(self.source.resource_version, self.required)
+        if not hit:
+            self.sync()
+        with self.changed:
+            return copy.deepcopy(self.source.items()), self.source.resource_version, hit
+
+    def stop(self):
+        self.stopped = True
+        if self.stream is not None:
+            self.stream.close()
+
+
+class Cache:
+    def __init__(self, client):
+        self.client = client
+        self.informers = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def key(self, kind, ns, label):
+        return self.client.resource(kind).plural, ns, kubeapi.parse_label(label)
+
+    def list(self, kind, label="", ns=None):
+        key = self.key(kind, ns, label)
+        with self.lock:
+            informer = self.informers.get(key)
+            if informer is None:
+                informer = self.informers[key] = Informer(self.client, kind, ns, label)
+        items, resource_version, hit = informer.read()
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return {"items": items, "metadata": {"resourceVersion": resource_version}}
+
+    def written(self, plural, ns, resource_version):
+        # read-your-writes: informers which may contain the written object wait for its resourceVersion
+        with self.lock:
+            for (informer_plural, informer_ns, _), informer in self.informers.items():
+                if informer_plural == plural and informer_ns in (ns, None, "--all-namespaces"):
+                    informer.require(resource_version)
+
+    def invalidate(self, ns=None):
+        # for writes which went around the API client, e.g. kubectl apply with process substitution
+        with self.lock:
+            for key in [k for k in self.informers if ns is None or k[1] in (ns, None, "--all-namespaces")]:
+                self.informers.pop(key).stop()
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "informers": len(self.informers),
+                "api_requests": self.client.requests,
+            }
+
+    def close(self):
+        self.invalidate()
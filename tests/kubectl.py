@@ -1,10 +1,17 @@
+import concurrent.futures
+import http.client
 import json
 import os
+import re
+import shlex
 import time
+import exec_session
+import kubeapi
+import kubecache
 import manifest
 import util
 
-from testflows.core import TestScenario, Name, When, Then, Given, And, main, run, Module
+from testflows.core import TestScenario, Name, When, Then, Given, And, main, run, Module, metric
 from testflows.asserts import error
 from testflows.connect import Shell
 
@@ -16,6 +23,68 @@ max_retries = 15
 shell = Shell()
 namespace = settings.test_namespace
 kubectl_cmd = settings.kubectl_cmd
+transport = settings.kubectl_transport
+
+# returned by api_call() when the request has to go through the kubectl subprocess instead
+kubectl_fallback = object()
+
+
+def set_transport(name, url=None):
+    global transport
+    transport = name
+    kubeapi.reset(url)
+
+
+def api():
+    global transport
+    if transport != "http":
+        return None
+    try:
+        client = kubeapi.client()
+    except (kubeapi.ApiError, OSError) as e:
+        print(f"Kubernetes API transport is not available, fall back to kubectl: {e}")
+        transport = "kubectl"
+        return None
+    if client.cache is None and settings.kube_cache:
+        client.cache = kubecache.Cache(client)
+    return client
+
+
+def invalidate_cache(ns=namespace):
+    # Writes made by the kubectl binary are not tracked by resourceVersion, drop cached objects instead
+    client = api()
+    if client is not None and client.cache is not None:
+        client.cache.invalidate(ns)
+
+
+def report_cache_stats():
+    client = api()
+    if client is None or client.cache is None:
+        return
+    stats = client.cache.stats()
+    with Then(f"Kubernetes object cache: {stats}"):
+        for name, value in stats.items():
+            metric(f"kube_cache_{name}", value, "")
+
+
+def api_call(fn, ok_to_fail=False, default=""):
+    client = api()
+    if client is None:
+        return kubectl_fallback
+    try:
+        return fn(client)
+    except (kubeapi.Unsupported, OSError, http.client.HTTPException):
+        # the API connection or `kubectl proxy` is gone, kubectl itself may still work
+        return kubectl_fallback
+    except kubeapi.ApiError as e:
+        if not ok_to_fail:
+            print("API request failed:")
+            print(e)
+        assert ok_to_fail, error()
+        return default
+
+
+mutating_verbs = re.compile(r"^\s*(delete|patch|label|annotate|scale|rollout|create|replace|apply|edit|set)\b")
 
 
 def launch(command, ok_to_fail=False, ns=namespace, timeout=60):
@@ -28,6 +97,10 @@ def launch(command, ok_to_fail=False, ns=namespace, timeout=60):
     cmd += f" {command}"
     # Run command
     cmd = shell(cmd, timeout=timeout)
+    if mutating_verbs.match(command):
+        # the write went around the API client, cached reads of the namespace must not return the old objects.
+        # Restarts by exec, e.g. `kill 1`, reach the cache through its watches like any change of the operator.
+        invalidate_cache(None if ns in (None, "", "--all-namespaces") else ns)
     # Check command failure
     code = cmd.exitcode
     if not ok_to_fail:
@@ -39,9 +112,29 @@ def launch(command, ok_to_fail=False, ns=namespace, timeout=60):
     return cmd.output if (code == 0) or ok_to_fail else ""
 
 
+def exec_in_pod(pod, command, container="", ns=namespace, ok_to_fail=False, timeout=60):
+    # Runs a shell command in the pod, over a persistent exec session when settings.kubectl_exec_sessions is set
+    if not settings.kubectl_exec_sessions:
+        container_str = "" if container == "" else f" -c {container}"
+        return launch(
+            f"exec {pod}{container_str} -- sh -c {shlex.quote(command)}",
+            ok_to_fail=ok_to_fail,
+            ns=ns,
+            timeout=timeout,
+        )
+    code, output = exec_session.sessions().run(pod, command, container=container, ns=ns, timeout=timeout)
+    if not ok_to_fail:
+        if code != 0:
+            print("command failed, output:")
+            print(output)
+        assert code == 0, error()
+    return output if (code == 0) or ok_to_fail else ""
+
+
 def delete_chi(chi, ns=namespace):
     with When(f"Delete chi {chi}"):
-        launch(f"delete chi {chi}", ns=ns, timeout=900)
+        if api_call(lambda c: c.delete("chi", chi, ns=ns, timeout=900)) is kubectl_fallback:
+            launch(f"delete chi {chi}", ns=ns, timeout=900)
         wait_objects(
             chi,
             {
@@ -75,78 +168,258 @@ def create_and_check(config, check, ns=namespace, timeout=30):
 
     apply(config, ns=ns, timeout=timeout)
 
-    if "object_counts" in check:
-        wait_objects(chi_name, check["object_counts"], ns)
-
-    if "pod_count" in check:
-        wait_object("pod", "", label=f"-l clickhouse.altinity.com/chi={chi_name}", count=check["pod_count"], ns=ns)
-
-    if "chi_status" in check:
-        wait_chi_status(chi_name, check["chi_status"], ns)
-    else:
-        wait_chi_status(chi_name, "Completed", ns)
-
-    if "pod_image" in check:
-        check_pod_image(chi_name, check["pod_image"], ns)
-
-    if "pod_volumes" in check:
-        check_pod_volumes(chi_name, check["pod_volumes"], ns)
-
-    if "pod_podAntiAffinity" in check:
-        check_pod_antiaffinity(chi_name, ns)
-
-    if "pod_ports" in check:
-        check_pod_ports(chi_name, check["pod_ports"], ns)
-
-    if "service" in check:
-        check_service(check["service"][0], check["service"][1], ns)
-
-    if "configmaps" in check:
-        check_configmaps(chi_name, ns)
+    plan = CheckPlan(chi_name, check, ns)
+    plan.wait()
+    plan.verify(plan.fetch())
 
     if "do_not_delete" not in check:
         delete_chi(chi_name, ns)
 
 
+class CheckPlan:
+    # create_and_check checks compiled into one readiness wait, one concurrent fetch of the objects
+    # the remaining checks need, and assertions evaluated against that fetch
+    pod_checks = ("pod_image", "pod_volumes", "pod_podAntiAffinity", "pod_ports")
+
+    def __init__(self, chi_name, check, ns=namespace):
+        self.chi_name = chi_name
+        self.check = check
+        self.ns = ns
+        self.status = check.get("chi_status", "Completed")
+        self.kinds = []
+        if "object_counts" in check:
+            self.kinds = list(check["object_counts"])
+        if "pod_count" in check and "pod" not in self.kinds:
+            self.kinds.append("pod")
+
+        self.fetches = {}
+        if any(c in check for c in self.pod_checks):
+            self.fetches[("snapshot", chi_name)] = lambda: get_snapshot(chi_name, ns)
+        if "service" in check:
+            service_name = check["service"][0]
+            self.fetches[("service", service_name)] = lambda: get("service", service_name, ns=ns)
+        if "configmaps" in check:
+            for cfg_name in expected_configmaps(chi_name):
+                self.fetches[("configmap", cfg_name)] = lambda name=cfg_name: get("configmap", name, ns=ns)
+
+    def current(self, state):
+        objects = dict(zip(self.kinds, state))
+        chis = state[-1]
+        return {
+            "object_counts": {kind: len(objects[kind]) for kind in self.check.get("object_counts", {})},
+            "pod_count": len(objects.get("pod", [])),
+            "chi_status": kubeapi.custom_column(chis[0], ".status.status") if len(chis) > 0 else "<none>",
+        }
+
+    def ready(self, state):
+        current = self.current(state)
+        if "object_counts" in self.check and current["object_counts"] != self.check["object_counts"]:
+            return False
+        if "pod_count" in self.check and current["pod_count"] < self.check["pod_count"]:
+            return False
+        return current["chi_status"] == self.status
+
+    def describe(self):
+        expected = []
+        if "object_counts" in self.check:
+            expected.append(", ".join(f"{count} {kind}(s)" for kind, count in self.check["object_counts"].items()))
+        if "pod_count" in self.check:
+            expected.append(f"at least {self.check['pod_count']} pod(s)")
+        expected.append(f"chi {self.chi_name} .status.status {self.status}")
+        return " and ".join(expected)
+
+    def wait(self):
+        # object counts, pod count and CHI status share one deadline instead of three sequential waits
+        with Then(f"Waiting for: {self.describe()}"):
+            label = f"-l clickhouse.altinity.com/chi={self.chi_name}"
+
+            def fetch():
+                snapshot = get_snapshot(self.chi_name, self.ns) if self.kinds else None
+                return [snapshot.objects[kind] for kind in self.kinds] + [list_objects("chi", self.chi_name, ns=self.ns)]
+
+            _, state = wait_until(
+                [(kind, "", label, self.ns) for kind in self.kinds] + [("chi", self.chi_name, "", self.ns)],
+                self.ready,
+                wait_timeout(max_retries),
+                fetch=fetch,
+            )
+            current = self.current(state)
+            if "object_counts" in self.check:
+                assert current["object_counts"] == self.check["object_counts"], error()
+            if "pod_count" in self.check:
+                assert current["pod_count"] >= self.check["pod_count"], error()
+            assert current["chi_status"] == self.status, error()
+
+    def fetch(self):
+        if len(self.fetches) == 0:
+            return {}
+        if api() is None:
+            # the kubectl transport shares one shell, fetch one object at a time
+            return {key: fetch() for key, fetch in self.fetches.items()}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.fetches)) as pool:
+            futures = {key: pool.submit(fetch) for key, fetch in self.fetches.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+    def verify(self, fetched):
+        chi_name, check, ns = self.chi_name, self.check, self.ns
+        snapshot = fetched.get(("snapshot", chi_name))
+
+        if "pod_image" in check:
+            check_pod_image(chi_name, check["pod_image"], ns, snapshot)
+
+        if "pod_volumes" in check:
+            check_pod_volumes(chi_name, check["pod_volumes"], ns, snapshot)
+
+        if "pod_podAntiAffinity" in check:
+            check_pod_antiaffinity(chi_name, ns, snapshot)
+
+        if "pod_ports" in check:
+            check_pod_ports(chi_name, check["pod_ports"], ns, snapshot)
+
+        if "service" in check:
+            service_name = check["service"][0]
+            check_service(service_name, check["service"][1], ns, fetched[("service", service_name)])
+
+        if "configmaps" in check:
+            configmaps = {name: obj for (kind, name), obj in fetched.items() if kind == "configmap"}
+            check_configmaps(chi_name, ns, configmaps)
+
+
 def get(kind, name, label="", ns=namespace):
+    out = api_call(lambda c: c.get(kind, name, label=label, ns=ns))
+    if out is not kubectl_fallback:
+        return out
     out = launch(f"get {kind} {name} {label} -o json", ns=ns)
     return json.loads(out.strip())
 
 
 def create_ns(ns):
-    launch(f"create ns {ns}", ns=None)
-    launch(f"get ns {ns}", ns=None)
+    created = api_call(lambda c: c.request("POST", "/api/v1/namespaces", body={
+        "apiVersion": "v1", "kind": "Namespace", "metadata": {"name": ns},
+    }))
+    if created is kubectl_fallback:
+        launch(f"create ns {ns}", ns=None)
+        launch(f"get ns {ns}", ns=None)
 
 
 def delete_ns(ns, ok_to_fail=False):
-    launch(f"delete ns {ns}", ns=None, ok_to_fail=ok_to_fail)
+    if api_call(lambda c: c.delete("ns", ns, timeout=600), ok_to_fail=ok_to_fail) is kubectl_fallback:
+        launch(f"delete ns {ns}", ns=None, ok_to_fail=ok_to_fail)
 
 
 def get_count(kind, name="", label="", ns=namespace):
+    count = api_call(lambda c: c.count(kind, name, label=label, ns=ns), ok_to_fail=True, default=0)
+    if count is not kubectl_fallback:
+        return count
     out = launch(f"get {kind} {name} -o=custom-columns=kind:kind,name:.metadata.name {label}", ns=ns, ok_to_fail=True)
     if (out is None) or (len(out) == 0):
         return 0
     return len(out.splitlines()) - 1
 
 
+class Snapshot:
+    # Statefulsets, pods and services of a CHI fetched at one point in time
+    kinds = ("statefulset", "pod", "service")
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    @property
+    def counts(self):
+        return {kind: len(self.objects[kind]) for kind in self.kinds}
+
+    @property
+    def pods(self):
+        return self.objects["pod"]
+
+    def pod_names(self):
+        return [pod["metadata"]["name"] for pod in self.pods]
+
+    def pod_spec(self):
+        return self.pods[0]["spec"]
+
+
+def get_snapshot(chi_name="", ns=namespace, label=""):
+    # neither a label nor a CHI: every object of the namespace, like count_objects() always counted
+    if label == "" and chi_name != "":
+        label = f"-l clickhouse.altinity.com/chi={chi_name}"
+    objects = api_call(lambda c: c.list_kinds(Snapshot.kinds, label=label, ns=ns))
+    if objects is kubectl_fallback:
+        # kubectl lists several kinds in a single call
+        objects = {kind: [] for kind in Snapshot.kinds}
+        for obj in list_objects(",".join(Snapshot.kinds), label=label, ns=ns):
+            objects[obj["kind"].lower()].append(obj)
+    return Snapshot(objects)
+
+
 def count_objects(label="", ns=namespace):
-    return {
-        "statefulset": get_count("sts", ns=ns, label=label),
-        "pod": get_count("pod", ns=ns, label=label),
-        "service": get_count("service", ns=ns, label=label),
-    }
+    return get_snapshot(ns=ns, label=label).counts
 
 
 def apply(config, ns=namespace, validate=True, timeout=30):
     with When(f"{config} is applied"):
+        # --validate=false is a kubectl client option, such manifests keep going through kubectl
+        if validate and api_call(lambda c: c.apply_file(config, ns=ns, timeout=timeout)) is not kubectl_fallback:
+            return
         launch(f"apply --validate={validate} -f {config}", ns=ns, timeout=timeout)
 
 
 def delete(config, ns=namespace, timeout=30):
     with When(f"{config} is deleted"):
+        if api_call(lambda c: c.delete_file(config, ns=ns, timeout=timeout)) is not kubectl_fallback:
+            return
         launch(f"delete -f {config}", ns=ns, timeout=timeout)
 
 
+def wait_timeout(retries):
+    # Same overall budget as the former polling with `i * 5` seconds sleep between retries
+    return sum(i * 5 for i in range(1, retries))
+
+
+def list_objects(kind, name="", label="", ns=namespace):
+    out = launch(f"get {kind} {name} {label} -o json", ns=ns, ok_to_fail=True)
+    try:
+        out = json.loads(out.strip())
+    except ValueError:
+        return []
+    return out.get("items", []) if out.get("kind") == "List" else [out]
+
+
+def wait_until(sources, predicate, timeout, fetch=None):
+    # sources are (kind, name, label, ns) tuples, predicate gets a list with the current objects of every source.
+    # The http transport returns as soon as a watch event satisfies the predicate, kubectl polls the sources
+    # or calls fetch() to get the whole state at once.
+    sources = [kubeapi.Source(*source) for source in sources]
+    client = api()
+    ok = None
+    if client is not None:
+        try:
+            ok, state = True, client.wait_for(sources, predicate, timeout)
+        except kubeapi.WaitTimeout as e:
+            ok, state = False, e.state
+        except kubeapi.Unsupported:
+            pass
+    if ok is None:
+        deadline = time.time() + timeout
+        while True:
+            if fetch is not None:
+                state = fetch()
+            else:
+                state = [list_objects(s.kind, s.name, s.label, s.ns) for s in sources]
+            ok = predicate(state)
+            if ok or time.time() >= deadline:
+                break
+            time.sleep(min(settings.wait_poll_interval, deadline - time.time()))
+    if not ok:
+        with Then(
+                f"Not ready after {timeout} seconds. [ " +
+                ", ".join(f"{source}: {len(objects)} object(s)" for source, objects in zip(sources, state)) +
+                " ]"
+        ):
+            pass
+    return ok, state
+
+
 def wait_objects(chi, object_counts, ns=namespace):
     with Then(
             f"Waiting for: "
@@ -155,29 +428,34 @@ def wait_objects(chi, object_counts, ns=namespace):
             f"{object_counts['service']} services "
             f"to be available"
     ):
-        for i in range(1, max_retries):
-            cur_object_counts = count_objects(label=f"-l clickhouse.altinity.com/chi={chi}", ns=ns)
-            if cur_object_counts == object_counts:
-                break
-            with Then(
-                    f"Not ready yet. [ "
-                    f"statefulset: {cur_object_counts['statefulset']} "
-                    f"pod: {cur_object_counts['pod']} "
-                    f"service: {cur_object_counts['service']} ]. "
-                    f"Wait for {i * 5} seconds"
-            ):
-                time.sleep(i * 5)
+        kinds = list(object_counts)
+        label = f"-l clickhouse.altinity.com/chi={chi}"
+
+        def counts(state):
+            return {kind: len(objects) for kind, objects in zip(kinds, state)}
+
+        def fetch():
+            snapshot = get_snapshot(chi, ns)
+            return [snapshot.objects[kind] for kind in kinds]
+
+        _, state = wait_until(
+            [(kind, "", label, ns) for kind in kinds],
+            lambda state: counts(state) == object_counts,
+            wait_timeout(max_retries),
+            fetch=fetch,
+        )
+        cur_object_counts = counts(state)
         assert cur_object_counts == object_counts, error()
 
 
 def wait_object(kind, name, label="", count=1, ns=namespace, retries=max_retries):
     with Then(f"{count} {kind}(s) {name} should be created"):
-        for i in range(1, retries):
-            cur_count = get_count(kind, ns=ns, name=name, label=label)
-            if cur_count >= count:
-                break
-            with Then("Not ready. Wait for " + str(i * 5) + " seconds"):
-                time.sleep(i * 5)
+        _, state = wait_until(
+            [(kind, name, label, ns)],
+            lambda state: len(state[0]) >= count,
+            wait_timeout(retries),
+        )
+        cur_count = len(state[0])
         assert cur_count >= count, error()
 
 
@@ -195,32 +473,38 @@ def wait_pod_status(pod, status, ns=namespace):
 
 def wait_field(kind, name, field, value, ns=namespace, retries=max_retries):
     with Then(f"{kind} {name} {field} should be {value}"):
-        for i in range(1, retries):
-            cur_value = get_field(kind, name, field, ns)
-            if cur_value == value:
-                break
-            with Then("Not ready. Wait for " + str(i * 5) + " seconds"):
-                time.sleep(i * 5)
+        def current(state):
+            return kubeapi.custom_column(state[0][0], field) if len(state[0]) > 0 else "<none>"
+
+        _, state = wait_until([(kind, name, "", ns)], lambda state: current(state) == value, wait_timeout(retries))
+        cur_value = current(state)
         assert cur_value == value, error()
 
 
 def wait_jsonpath(kind, name, field, value, ns=namespace, retries=max_retries):
     with Then(f"{kind} {name} -o jsonpath={field} should be {value}"):
-        for i in range(1, retries):
-            cur_value = get_jsonpath(kind, name, field, ns)
-            if cur_value == value:
-                break
-            with Then("Not ready. Wait for " + str(i * 5) + " seconds"):
-                time.sleep(i * 5)
+        def current(state):
+            if len(state[0]) == 0:
+                return ""
+            return (kubeapi.jsonpath(state[0][0], field).splitlines() or [""])[0]
+
+        _, state = wait_until([(kind, name, "", ns)], lambda state: current(state) == value, wait_timeout(retries))
+        cur_value = current(state)
         assert cur_value == value, error()
 
 
 def get_field(kind, name, field, ns=namespace):
+    value = api_call(lambda c: kubeapi.custom_column(c.items(kind, name, ns=ns)[0], field))
+    if value is not kubectl_fallback:
+        return value
     out = launch(f"get {kind} {name} -o=custom-columns=field:{field}", ns=ns).splitlines()
     return out[1]
 
 
 def get_jsonpath(kind, name, field, ns=namespace):
+    value = api_call(lambda c: kubeapi.jsonpath(c.get(kind, name, ns=ns), field))
+    if value is not kubectl_fallback:
+        return (value.splitlines() or [""])[0]
     out = launch(f"get {kind} {name} -o jsonpath=\"{field}\"", ns=ns).splitlines()
     return out[0]
 
@@ -248,17 +532,24 @@ def get_default_storage_class(ns=namespace):
             return parts[1].strip()
 
 
-def get_pod_spec(chi_name, ns=namespace):
+def get_pod_spec(chi_name, ns=namespace, snapshot=None):
+    if snapshot is not None:
+        return snapshot.pod_spec()
     pod = get("pod", "", ns=ns, label=f"-l clickhouse.altinity.com/chi={chi_name}")["items"][0]
     return pod["spec"]
 
 
-def get_pod_image(chi_name, ns=namespace):
-    pod_image = get_pod_spec(chi_name, ns)["containers"][0]["image"]
+def get_pod_image(chi_name, ns=namespace, snapshot=None):
+    pod_image = get_pod_spec(chi_name, ns, snapshot)["containers"][0]["image"]
     return pod_image
 
 
-def get_pod_names(chi_name, ns=namespace):
+def get_pod_names(chi_name, ns=namespace, snapshot=None):
+    if snapshot is not None:
+        return snapshot.pod_names()
+    pods = api_call(lambda c: c.items("pod", label=f"-l clickhouse.altinity.com/chi={chi_name}", ns=ns))
+    if pods is not kubectl_fallback:
+        return [pod["metadata"]["name"] for pod in pods]
     pod_names = launch(
         f"get pods -o=custom-columns=name:.metadata.name -l clickhouse.altinity.com/chi={chi_name}",
         ns=ns,
@@ -266,33 +557,33 @@ def get_pod_names(chi_name, ns=namespace):
     return pod_names[1:]
 
 
-def get_pod_volumes(chi_name, ns=namespace):
-    volume_mounts = get_pod_spec(chi_name, ns)["containers"][0]["volumeMounts"]
+def get_pod_volumes(chi_name, ns=namespace, snapshot=None):
+    volume_mounts = get_pod_spec(chi_name, ns, snapshot)["containers"][0]["volumeMounts"]
     return volume_mounts
 
 
-def get_pod_ports(chi_name, ns=namespace):
-    port_specs = get_pod_spec(chi_name, ns)["containers"][0]["ports"]
+def get_pod_ports(chi_name, ns=namespace, snapshot=None):
+    port_specs = get_pod_spec(chi_name, ns, snapshot)["containers"][0]["ports"]
     ports = []
     for p in port_specs:
         ports.append(p["containerPort"])
     return ports
 
 
-def check_pod_ports(chi_name, ports, ns=namespace):
-    pod_ports = get_pod_ports(chi_name, ns)
+def check_pod_ports(chi_name, ports, ns=namespace, snapshot=None):
+    pod_ports = get_pod_ports(chi_name, ns, snapshot)
     with Then(f"Expect pod ports {pod_ports} to match {ports}"):
         assert pod_ports.sort() == ports.sort()
 
 
-def check_pod_image(chi_name, image, ns=namespace):
-    pod_image = get_pod_image(chi_name, ns)
+def check_pod_image(chi_name, image, ns=namespace, snapshot=None):
+    pod_image = get_pod_image(chi_name, ns, snapshot)
     with Then(f"Expect pod image {pod_image} to match {image}"):
         assert pod_image == image
 
 
-def check_pod_volumes(chi_name, volumes, ns=namespace):
-    pod_volumes = get_pod_volumes(chi_name, ns)
+def check_pod_volumes(chi_name, volumes, ns=namespace, snapshot=None):
+    pod_volumes = get_pod_volumes(chi_name, ns, snapshot)
     for v in volumes:
         with Then(f"Expect pod has volume mount {v}"):
             found = 0
@@ -307,8 +598,8 @@ def get_pvc_size(pvc_name, ns=namespace):
     return get_field("pvc", pvc_name, ".spec.resources.requests.storage", ns)
 
 
-def check_pod_antiaffinity(chi_name, ns=namespace):
-    pod_spec = get_pod_spec(chi_name, ns)
+def check_pod_antiaffinity(chi_name, ns=namespace, snapshot=None):
+    pod_spec = get_pod_spec(chi_name, ns, snapshot)
     expected = {
         "requiredDuringSchedulingIgnoredDuringExecution": [
             {
@@ -329,36 +620,36 @@ def check_pod_antiaffinity(chi_name, ns=namespace):
         assert pod_spec["affinity"]["podAntiAffinity"] == expected
 
 
-def check_service(service_name, service_type, ns=namespace):
+def check_service(service_name, service_type, ns=namespace, service=None):
     with When(f"{service_name} is available"):
-        service = get("service", service_name, ns=ns)
+        if service is None:
+            service = get("service", service_name, ns=ns)
         with Then(f"Service type is {service_type}"):
             assert service["spec"]["type"] == service_type
 
 
-def check_configmaps(chi_name, ns=namespace):
-    check_configmap(
-        f"chi-{chi_name}-common-configd",
-        [
+def expected_configmaps(chi_name):
+    return {
+        f"chi-{chi_name}-common-configd": [
             "01-clickhouse-listen.xml",
             "02-clickhouse-logger.xml",
             "03-clickhouse-querylog.xml",
         ],
-        ns=ns,
-    )
-
-    check_configmap(
-        f"chi-{chi_name}-common-usersd",
-        [
+        f"chi-{chi_name}-common-usersd": [
             "01-clickhouse-user.xml",
             "02-clickhouse-default-profile.xml",
         ],
-        ns=ns,
-    )
+    }
+
+
+def check_configmaps(chi_name, ns=namespace, configmaps=None):
+    for cfg_name, values in expected_configmaps(chi_name).items():
+        check_configmap(cfg_name, values, ns=ns, cfm=None if configmaps is None else configmaps[cfg_name])
 
 
-def check_configmap(cfg_name, values, ns=namespace):
-    cfm = get("configmap", cfg_name, ns=ns)
+def check_configmap(cfg_name, values, ns=namespace, cfm=None):
+    if cfm is None:
+        cfm = get("configmap", cfg_name, ns=ns)
     for v in values:
         with Then(f"{cfg_name} should contain {v}"):
             assert v in cfm["data"]
@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+import uuid
+
+import settings
+
+
+# Timing records of harness queries. Every query gets a query_id, the client side time is recorded right away,
+# server side numbers are filled in from X-ClickHouse-Summary and batched system.query_log lookups.
+# Resolved records are appended to settings.query_trace as JSON lines.
+
+server_fields = ("query_duration_ms", "read_rows", "read_bytes", "written_rows", "memory_usage")
+
+
+class Trace:
+    def __init__(self, path=settings.query_trace, batch=settings.query_trace_batch):
+        self.path = path
+        self.batch = batch
+        self.pending = []
+        self.lock = threading.Lock()
+        self.totals = {"queries": 0, "resolved": 0, "client_ms": 0.0, "resolved_client_ms": 0.0, "server_ms": 0.0}
+
+    @staticmethod
+    def query_id():
+        return f"harness-{uuid.uuid4().hex}"
+
+    def record(self, query_id, chi_name, ns, pod, server_pod, transport, sql, ok, client_seconds, summary=None):
+        # Returns True when enough records are pending for a batched lookup
+        entry = {
+            "query_id": query_id,
+            "time": time.time(),
+            "chi": chi_name,
+            "ns": ns,
+            "pod": pod,
+            "server_pod": server_pod,
+            "transport": transport,
+            "sql": sql[:200],
+            "ok": ok,
+            "client_ms": round(client_seconds * 1000, 3),
+        }
+        for name, value in (summary or {}).items():
+            entry[name] = int(value)
+        with self.lock:
+            self.pending.append(entry)
+            self.totals["queries"] += 1
+            self.totals["client_ms"] += entry["client_ms"]
+            return len(self.pending) >= self.batch
+
+    def due(self):
+        # enough records are pending for a batched lookup
+        with self.lock:
+            return len(self.pending) >= self.batch
+
+    def take(self):
+        # Returns pending records grouped by the pod whose query_log has them
+        with self.lock:
+            pending, self.pending = self.pending, []
+        groups = {}
+        for entry in pending:
+            groups.setdefault((entry["chi"], entry["ns"], entry["server_pod"]), []).append(entry)
+        return groups
+
+    def resolve(self, entries, rows):
+        # rows: query_id -> server side numbers from system.query_log
+        with self.lock:
+            for entry in entries:
+                row = rows.get(entry["query_id"])
+                if row is None:
+                    continue
+                for name in server_fields:
+                    entry[name] = int(row[name])
+                entry["server_ms"] = entry["query_duration_ms"]
+                entry["overhead_ms"] = round(entry["client_ms"] - entry["server_ms"], 3)
+                self.totals["resolved"] += 1
+                self.totals["resolved_client_ms"] += entry["client_ms"]
+                self.totals["server_ms"] += entry["server_ms"]
+            if self.path != "":
+                with open(self.path, "a") as trace:
+                    for entry in entries:
+                        trace.write(json.dumps(entry) + "\n")
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.totals)
+        # client time beyond server time of resolved queries is spent in kubectl exec, client startup and network
+        stats["overhead_ms"] = stats.pop("resolved_client_ms") - stats["server_ms"]
+        return {name: round(value, 3) for name, value in stats.items()}
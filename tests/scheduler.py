@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Runs test scenarios as child processes of the test module, concurrently when their footprints allow it.
+# Every child has its own kubectl shell, ClickHouse connections and alert poller, nothing is shared between threads.
+
+
+class Footprint:
+    """Hosts and named resources of a scenario, an exclusive resource is neither shared nor used by a concurrent one"""
+
+    def __init__(self, hosts=0, shared=(), exclusive=()):
+        self.hosts = hosts
+        self.shared = set(shared)
+        self.exclusive = set(exclusive)
+
+    def __repr__(self):
+        return f"Footprint(hosts={self.hosts}, shared={sorted(self.shared)}, exclusive={sorted(self.exclusive)})"
+
+    def conflicts(self, other):
+        return len(self.exclusive & (other.shared | other.exclusive)) > 0 or len(other.exclusive & self.shared) > 0
+
+
+class Job:
+    def __init__(self, name, footprint):
+        self.name = name
+        self.footprint = footprint
+        self.hosts = []
+        self.process = None
+        self.log = os.path.join(tempfile.gettempdir(), f"{name}.log")
+        self.started = None
+        self.seconds = None
+        self.returncode = None
+
+
+def run(jobs, hosts, command, env=None, workers=4, poll_interval=1):
+    # jobs: [(name, Footprint)] in the order they should start, hosts: number of hosts to hand out.
+    # command(job) returns (argv, extra environment) of the child running one job, its output goes to job.log.
+    # A job waiting for a conflicting resource blocks later jobs conflicting with it, so an exclusive one is not starved.
+    jobs = [Job(name, footprint) for name, footprint in jobs]
+    for job in jobs:
+        assert job.footprint.hosts <= hosts, f"{job.name} needs {job.footprint.hosts} hosts, only {hosts} available"
+    free = list(range(hosts))
+    waiting = list(jobs)
+    running = []
+    while len(waiting) > 0 or len(running) > 0:
+        for job in list(running):
+            if job.process.poll() is None:
+                continue
+            job.returncode = job.process.returncode
+            job.seconds = round(time.time() - job.started, 3)
+            free = sorted(free + job.hosts)
+            running.remove(job)
+            print(f"scheduler: {job.name} finished with {job.returncode} in {job.seconds}s")
+
+        blocked = []
+        for job in list(waiting):
+            if len(running) >= workers:
+                break
+            footprint = job.footprint
+            if any(footprint.conflicts(other.footprint) for other in running + blocked) or footprint.hosts > len(free):
+                blocked.append(job)
+                continue
+            job.hosts, free = free[:footprint.hosts], free[footprint.hosts:]
+            argv, extra = command(job)
+            with open(job.log, "w") as log:
+                job.process = subprocess.Popen(
+                    argv, stdout=log, stderr=subprocess.STDOUT, env=dict(env or os.environ, **extra),
+                )
+            job.started = time.time()
+            waiting.remove(job)
+            running.append(job)
+            print(f"scheduler: {job.name} started on hosts {job.hosts}, {len(running)} running, {len(waiting)} waiting")
+
+        if len(running) > 0:
+            time.sleep(poll_interval)
+    return jobs
+
+
+def python_command(module, **extra):
+    # the same interpreter and working directory, the scenario and its hosts are passed in the environment
+    return [sys.executable, os.path.abspath(module)], {k: str(v) for k, v in extra.items()}
@@ -12,7 +12,31 @@ def get_ch_version(test_file):
 
 # kubectl_cmd="minikube kubectl --"
 kubectl_cmd = "kubectl"
+# "kubectl" spawns one kubectl process per call, "http" talks to the API server over a pooled connection
+kubectl_transport = os.getenv('KUBECTL_TRANSPORT') if 'KUBECTL_TRANSPORT' in os.environ else "kubectl"
+# API server endpoint for the "http" transport, a `kubectl proxy` is started when empty
+kube_api_url = os.getenv('KUBE_API_URL') if 'KUBE_API_URL' in os.environ else ""
+# serve repeated reads of the http transport from watch-backed informers, KUBE_CACHE=0 disables
+kube_cache = os.getenv('KUBE_CACHE') != "0"
+# run repeated in-pod commands over one persistent `kubectl exec -i ... -- sh` per pod/container
+kubectl_exec_sessions = os.getenv('KUBECTL_EXEC_SESSIONS') == "1"
+# seconds after which an unused exec session is closed
+exec_session_idle_timeout = 300
+# seconds between polls while waiting for objects with the kubectl transport, the http transport uses watches
+wait_poll_interval = 2
 test_namespace = "test"
+# "exec" runs clickhouse-client in the pod per query, "http" uses pooled connections to the HTTP interface
+clickhouse_transport = os.getenv('CLICKHOUSE_TRANSPORT') if 'CLICKHOUSE_TRANSPORT' in os.environ else "exec"
+# ClickHouse HTTP endpoint standing in for every pod, `kubectl port-forward` per pod is used when empty
+clickhouse_http_url = os.getenv('CLICKHOUSE_HTTP_URL') if 'CLICKHOUSE_HTTP_URL' in os.environ else ""
+# JSON lines file receiving client and server timings of every clickhouse.query(), none when empty
+query_trace = os.getenv('QUERY_TRACE') if 'QUERY_TRACE' in os.environ else ""
+# queries recorded before their server side timings are looked up in system.query_log
+query_trace_batch = 200
+# concurrent queries of clickhouse.query_cluster()
+cluster_query_workers = 16
+# JSON lines file test_benchmark.py appends its results to
+benchmark_results = os.getenv('BENCHMARK_RESULTS') if 'BENCHMARK_RESULTS' in os.environ else "benchmark-results.jsonl"
 
 # Default value
 operator_version = os.getenv('OPERATOR_VERSION') if 'OPERATOR_VERSION' in os.environ else \
@@ -33,4 +57,17 @@ clickhouse_template = "templates/tpl-clickhouse-stable.yaml"
 clickhouse_version = get_ch_version(clickhouse_template)
 
 prometheus_namespace = "prometheus"
+# Prometheus HTTP API for the alert poller, `kubectl port-forward` to the Prometheus pod is used when empty
+prometheus_url = os.getenv('PROMETHEUS_URL') if 'PROMETHEUS_URL' in os.environ else ""
+# seconds between ALERTS requests of the alert poller, shared by every pending wait
+alert_poll_interval = 5
+# Prometheus job of the metrics-exporter, the ServiceMonitor names it after the clickhouse-operator-metrics service
+prometheus_scrape_job = "clickhouse-operator-metrics"
+# JSON lines file receiving fault, pending, firing and resolution times of every alert wait, none when empty
+alert_timings = os.getenv('ALERT_TIMINGS') if 'ALERT_TIMINGS' in os.environ else ""
+# alert scenarios running at once on configs/test-cluster-for-alerts-parallel.yaml, 1 runs them in sequence on 2 hosts
+alert_workers = int(os.getenv('ALERT_WORKERS')) if 'ALERT_WORKERS' in os.environ else 1
+# set by the scheduler for its child processes: the one scenario to run and the indexes of the hosts it may use
+alert_scenario = os.getenv('ALERT_SCENARIO') if 'ALERT_SCENARIO' in os.environ else ""
+alert_scenario_hosts = os.getenv('ALERT_SCENARIO_HOSTS') if 'ALERT_SCENARIO_HOSTS' in os.environ else ""
 prometheus_operator_version = "0.42"
@@ -1,3 +1,4 @@
+import clickhouse
 import kubectl
 import settings
 import test_operator
@@ -73,6 +74,10 @@ if main():
                 else:
                     run(test=t[0], args=t[1])
 
+            kubectl.report_cache_stats()
+            clickhouse.report_pod_cache_stats()
+            clickhouse.report_query_trace()
+
         # python3 tests/test.py --only clickhouse*
         with Module("clickhouse"):
             all_tests = [
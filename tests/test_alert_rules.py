@@ -0,0 +1,159 @@
+from testflows.core import TestScenario, Name, When, Then, And, main, run, Module
+from testflows.asserts import error
+
+import alert_rules
+
+# python3 tests/test_alert_rules.py
+# deploy/prometheus/prometheus-alert-rules.yaml evaluated offline, no cluster needed
+
+# healthy until fault_start, faulty until fault_end, healthy again until end
+fault_start = 300
+fault_end = 600
+end = 1500
+
+clickhouse_labels = {"chi": "test-cluster-for-alerts", "hostname": "chi-test-cluster-for-alerts-default-0-0"}
+zookeeper_labels = {"app": "zookeeper", "pod": "zookeeper-0"}
+
+
+def gauge(healthy, faulty):
+    def values(t):
+        return faulty if fault_start <= t < fault_end else healthy
+    return values
+
+
+def counter(healthy_step=0, faulty_step=1):
+    # increments every scrape, by faulty_step during the fault
+    def values(t):
+        steps = t // alert_rules.scrape_interval
+        faulty = max(min(t, fault_end) - fault_start, 0) // alert_rules.scrape_interval
+        return steps * healthy_step + faulty * (faulty_step - healthy_step)
+    return values
+
+
+# (alert, {metric: values}, labels), every rule of the file has at least one case
+cases = [
+    ("ClickHouseMetricsExporterDown", {"up": gauge(1, 0)}, {"job": "clickhouse-operator-metrics"}),
+    ("ClickHouseServerDown", {"chi_clickhouse_metric_fetch_errors": gauge(0, 1)}, clickhouse_labels),
+    ("ClickHouseServerRestartRecently", {"chi_clickhouse_metric_Uptime": gauge(100000, 60)}, clickhouse_labels),
+    ("ClickHouseDNSErrors", {"chi_clickhouse_event_DNSError": counter()}, clickhouse_labels),
+    ("ClickHouseDNSErrors", {"chi_clickhouse_event_NetworkErrors": counter()}, clickhouse_labels),
+    ("ClickHouseDistributedFilesToInsertHigh", {"chi_clickhouse_metric_DistributedFilesToInsert": gauge(0, 100)}, clickhouse_labels),
+    ("ClickHouseDistributedConnectionExceptions", {"chi_clickhouse_event_DistributedConnectionFailTry": counter()}, clickhouse_labels),
+    ("ClickHouseDistributedConnectionExceptions", {"chi_clickhouse_event_DistributedConnectionFailAtAll": counter()}, clickhouse_labels),
+    ("ClickHouseRejectedInsert", {"chi_clickhouse_event_RejectedInserts": counter()}, clickhouse_labels),
+    ("ClickHouseDelayedInsertThrottling", {"chi_clickhouse_event_DelayedInserts": counter()}, clickhouse_labels),
+    ("ClickHouseMaxPartCountForPartition", {"chi_clickhouse_metric_MaxPartCountForPartition": gauge(10, 200)}, clickhouse_labels),
+    ("ClickHouseLowInsertedRowsPerQuery", {
+        "chi_clickhouse_event_InsertQuery": counter(0, 10),
+        "chi_clickhouse_event_InsertedRows": counter(0, 10),
+    }, clickhouse_labels),
+    ("ClickHouseLongestRunningQuery", {"chi_clickhouse_metric_LongestRunningQuery": gauge(1, 700)}, clickhouse_labels),
+    ("ClickHouseQueryPreempted", {"chi_clickhouse_metric_QueryPreempted": gauge(0, 1)}, clickhouse_labels),
+    ("ClickHouseReadonlyReplica", {"chi_clickhouse_metric_ReadonlyReplica": gauge(0, 1)}, clickhouse_labels),
+    ("ClickHouseReplicasMaxAbsoluteDelay", {"chi_clickhouse_metric_ReplicasMaxAbsoluteDelay": gauge(0, 400)}, clickhouse_labels),
+    ("ClickHouseTooManyConnections", {
+        "chi_clickhouse_metric_HTTPConnection": gauge(1, 50),
+        "chi_clickhouse_metric_TCPConnection": gauge(1, 50),
+        "chi_clickhouse_metric_MySQLConnection": gauge(1, 50),
+    }, clickhouse_labels),
+    ("ClickHouseTooMuchRunningQueries", {"chi_clickhouse_metric_Query": gauge(1, 100)}, clickhouse_labels),
+    ("ClickHouseSystemSettingsChanged", {"chi_clickhouse_metric_ChangedSettingsHash": gauge(100, 200)}, clickhouse_labels),
+    ("ClickHouseVersionChanged", {"chi_clickhouse_metric_VersionInteger": gauge(20003000, 20004000)}, clickhouse_labels),
+    ("ClickHouseZooKeeperHardwareExceptions", {"chi_clickhouse_event_ZooKeeperHardwareExceptions": counter()}, clickhouse_labels),
+    ("ClickHouseZooKeeperSession", {"chi_clickhouse_metric_ZooKeeperSession": gauge(1, 2)}, clickhouse_labels),
+    ("ClickHouseDiskUsage", {
+        "chi_clickhouse_metric_DiskDataBytes": gauge(10, 90),
+        "chi_clickhouse_metric_DiskFreeBytes": gauge(90, 10),
+    }, clickhouse_labels),
+    ("ClickHouseReplicatedPartChecksFailed", {"chi_clickhouse_event_ReplicatedPartChecksFailed": counter()}, clickhouse_labels),
+    ("ClickHouseReplicatedPartFailedFetches", {"chi_clickhouse_event_ReplicatedPartFailedFetches": counter()}, clickhouse_labels),
+    ("ClickHouseReplicatedDataLoss", {"chi_clickhouse_event_ReplicatedDataLoss": counter()}, clickhouse_labels),
+    ("ClickHouseStorageBufferErrorOnFlush", {"chi_clickhouse_event_StorageBufferErrorOnFlush": counter()}, clickhouse_labels),
+    ("ClickHouseDataAfterMergeDiffersFromReplica", {"chi_clickhouse_event_DataAfterMergeDiffersFromReplica": counter()}, clickhouse_labels),
+    ("ClickHouseDistributedSyncInsertionTimeoutExceeded", {
+        "chi_clickhouse_event_DistributedSyncInsertionTimeoutExceeded": counter(),
+    }, clickhouse_labels),
+    ("ClickHouseFileDescriptorBufferReadOrWriteFailed", {
+        "chi_clickhouse_event_ReadBufferFromFileDescriptorReadFailed": counter(),
+    }, clickhouse_labels),
+    ("ClickHouseFileDescriptorBufferReadOrWriteFailed", {
+        "chi_clickhouse_event_WriteBufferFromFileDescriptorWriteFailed": counter(),
+    }, clickhouse_labels),
+    ("ClickHouseSlowRead", {"chi_clickhouse_event_SlowRead": counter()}, clickhouse_labels),
+    ("ZookeeperDown", {"up": gauge(1, 0)}, zookeeper_labels),
+    ("ZookeeperRestartRecently", {"uptime": gauge(10 ** 9, 60000)}, zookeeper_labels),
+    ("ZookeeperHighLatency", {"max_latency": gauge(1, 1000)}, zookeeper_labels),
+    ("ZookeeperOutstandingRequests", {"outstanding_requests": gauge(0, 20)}, zookeeper_labels),
+    ("ZookeeperHighFileDescriptors", {
+        "open_file_descriptor_count": gauge(10, 900),
+        "max_file_descriptor_count": gauge(1000, 1000),
+    }, zookeeper_labels),
+    ("ZookeeperPendingSyncs", {"pending_syncs": gauge(0, 20)}, zookeeper_labels),
+    ("ZookeeperPendingSessions", {"pending_session_queue_size": gauge(0, 20)}, zookeeper_labels),
+    ("ZookeeperThrottleRequests", {"request_throttle_wait_count": counter()}, zookeeper_labels),
+    ("ZookeeperOutstandingTLSHandshakes", {"outstanding_tls_handshake": gauge(0, 1)}, zookeeper_labels),
+    ("ZookeeperConnectionRejected", {"connection_rejected": counter()}, zookeeper_labels),
+    ("ZookeeperHighEphemeralNodes", {"ephemerals_count": gauge(10, 200)}, zookeeper_labels),
+    ("ZookeeperUnrecoverableErrors", {"unrecoverable_error_count": counter()}, zookeeper_labels),
+    ("ZookeeperLowGetChildrenCacheHitRate", {
+        "response_packet_cache_hits": counter(10, 1),
+        "response_packet_cache_misses": counter(1, 10),
+    }, zookeeper_labels),
+    ("ZookeeperEnsembleAuthFailures", {"ensemble_auth_fail": counter()}, zookeeper_labels),
+    ("ZookeeperHighFsyncTime", {"fsynctime": gauge(1, 1000)}, dict(zookeeper_labels, quantile="0.5")),
+    ("ZookeeperLargeRequestsRejected", {"large_requests_rejected": counter()}, zookeeper_labels),
+    ("ZookeeperStaleRequestsDropped", {"stale_requests_dropped": counter()}, zookeeper_labels),
+    ("ZookeeperDigestMismatch", {"digest_mismatches_count": counter()}, zookeeper_labels),
+    ("ZookeeperDigestMismatch", {"sessionless_connections_expired": counter()}, zookeeper_labels),
+    ("ZookeeperThreadsDeadlocked", {"jvm_threads_deadlocked": gauge(0, 1)}, zookeeper_labels),
+    ("ZookeeperUnsuccessfulHandshakes", {"unsuccessful_handshake": counter()}, zookeeper_labels),
+]
+
+
+def synthetic_series(metrics, labels):
+    times = range(0, end + 1, alert_rules.scrape_interval)
+    return [alert_rules.Series(name, [values(t) for t in times], labels) for name, values in metrics.items()]
+
+
+@TestScenario
+@Name("Every alert rule parses")
+def test_rules_parse():
+    with When(f"{alert_rules.rules_file} is loaded"):
+        rules = alert_rules.load_rules()
+    with Then(f"{len(rules)} rules are parsed"):
+        assert len(rules) > 0, error()
+    with And("every rule has a synthetic case"):
+        missing = {r.name for r in rules} - {alert for alert, _, _ in cases}
+        assert len(missing) == 0, error(f"no case for {sorted(missing)}")
+    with And("nothing fires without data"):
+        timeline = alert_rules.Engine(rules).run([], end)
+        assert timeline.fired() == [], error()
+
+
+@TestScenario
+@Name("Alert rule fires during the fault and resolves after it")
+def test_rule_case(alert, metrics, labels, rules=None):
+    rules = rules or alert_rules.load_rules()
+    duration = max(r.duration for r in rules if r.name == alert)
+    with When(f"{alert}: {', '.join(metrics)} faulty from {fault_start}s to {fault_end}s"):
+        timeline = alert_rules.Engine(rules).run(synthetic_series(metrics, labels), end)
+    with Then(f"{alert} should not be active before the fault"):
+        assert timeline.state(alert, fault_start - 1) == "inactive", error()
+    with And(f"{alert} should fire after its for: {duration}s"):
+        pending = timeline.first(alert, "pending", after=fault_start)
+        firing = timeline.first(alert, "firing", after=fault_start)
+        assert pending is not None and firing is not None, error()
+        assert firing - pending >= duration, error()
+        assert firing - fault_start <= duration + 2 * alert_rules.evaluation_interval + 60, error()
+    with And(f"{alert} should be the only firing alert"):
+        assert timeline.fired() == [alert], error()
+    with And(f"{alert} should be resolved at the end"):
+        assert timeline.state(alert, end) == "inactive", error()
+
+
+if main():
+    with Module("alert_rules"):
+        run(test=test_rules_parse)
+        rules = alert_rules.load_rules()
+        for alert, metrics, labels in cases:
+            run(test=test_rule_case, args={"alert": alert, "metrics": metrics, "labels": labels, "rules": rules})
@@ -0,0 +1,613 @@
+import concurrent.futures
+import os
+import random
+import string
+import threading
+import time
+
+from testflows.core import TestScenario, Name, When, Then, Given, And, main, run, Module, TE
+from testflows.asserts import error
+
+import benchmark
+import clickhouse
+import kubectl
+import manifest
+import settings
+import util
+
+from test_operator import set_operator_version, restart_operator
+
+# python3 tests/test_benchmark.py
+# Every scenario appends its numbers to settings.benchmark_results, one JSON object per line
+
+
+bench_columns = ["event_time", "id", "value", "payload"]
+bench_types = ["DateTime", "UInt64", "Float64", "String"]
+
+
+def create_bench_tables(chi_name, local_engine="ENGINE MergeTree() PARTITION BY toYYYYMM(event_time) ORDER BY id"):
+    fields = "(event_time DateTime, id UInt64, value Float64, payload String)"
+    benchmark.on_every_host(chi_name, "DROP TABLE IF EXISTS default.bench_distr")
+    benchmark.on_every_host(chi_name, "DROP TABLE IF EXISTS default.bench_local")
+    benchmark.on_every_host(chi_name, f"CREATE TABLE default.bench_local {fields} {local_engine}")
+    benchmark.on_every_host(
+        chi_name,
+        f"CREATE TABLE default.bench_distr {fields} ENGINE Distributed('all-sharded', default, bench_local, rand())",
+    )
+
+
+def bench_rows(first_id, count, payload_size=32):
+    now = int(time.time())
+    payload = "".join(random.choice(string.ascii_letters) for _ in range(payload_size))
+    for i in range(first_id, first_id + count):
+        yield now, i, random.random(), payload
+
+
+def parts_stats(chi_name, table="bench_local"):
+    results = benchmark.on_every_host(
+        chi_name,
+        "SELECT count(), sum(parts), max(parts), "
+        f"(SELECT count() FROM system.merges WHERE database = 'default' AND table = '{table}') "
+        "FROM (SELECT partition, count() AS parts FROM system.parts "
+        f"WHERE database = 'default' AND table = '{table}' AND active GROUP BY partition)",
+    )
+    stats = {"partitions": 0, "parts": 0, "max_parts_per_partition": 0, "merges_in_progress": 0}
+    for r in results:
+        partitions, parts, max_parts, merges = (int(v) for v in r["out"].split("\t"))
+        stats["partitions"] += partitions
+        stats["parts"] += parts
+        stats["max_parts_per_partition"] = max(stats["max_parts_per_partition"], max_parts)
+        stats["merges_in_progress"] += merges
+    return stats
+
+
+@TestScenario
+@Name("Insert throughput through a Distributed table")
+def bench_insert(layout="1x1", inserts=100, rows_per_insert=10000, concurrency=1, fmt="RowBinary", sync=True):
+    chi_name = benchmark.deploy(layout)
+    create_bench_tables(chi_name)
+    # resolve the pod before workers start, pod resolution may run kubectl through the shared shell
+    clickhouse.select_pod(chi_name, "127.0.0.1", "", kubectl.namespace)
+
+    def insert_one(i):
+        started = time.time()
+        stats = clickhouse.insert(
+            chi_name, "default.bench_distr", bench_rows(i * rows_per_insert, rows_per_insert),
+            columns=bench_columns, types=bench_types, fmt=fmt, block_size=rows_per_insert,
+            # one INSERT per call, with sync it returns once the rows are written on every shard
+            via="http" if clickhouse.transport == "http" else "stdin",
+            advanced_params="--insert_distributed_sync=1" if sync else "",
+        )
+        return time.time() - started, stats["bytes"]
+
+    with When(f"{inserts} INSERTs of {rows_per_insert} rows with concurrency {concurrency}"):
+        started = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(insert_one, range(inserts)))
+        if not sync:
+            benchmark.on_every_host(chi_name, "SYSTEM FLUSH DISTRIBUTED default.bench_distr", timeout=600)
+        elapsed = time.time() - started
+
+    with Then("All rows should be in the local tables"):
+        rows = sum(int(r["out"]) for r in benchmark.on_every_host(chi_name, "SELECT count() FROM default.bench_local"))
+        assert rows == inserts * rows_per_insert, error()
+
+    latencies = [seconds * 1000 for seconds, _ in results]
+    total_bytes = sum(size for _, size in results)
+    values = {
+        "inserts": inserts,
+        "rows_per_insert": rows_per_insert,
+        "concurrency": concurrency,
+        "format": fmt,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1),
+        "bytes_per_second": round(total_bytes / elapsed, 1),
+        **{f"latency_{k}_ms": round(v, 2) for k, v in benchmark.percentiles(latencies).items()},
+        **parts_stats(chi_name),
+    }
+    benchmark.report("insert", values, layout=layout, transport=clickhouse.transport)
+    benchmark.undeploy(chi_name)
+
+
+# {id} is replaced by a random id of the dataset on every run
+bench_queries = {
+    "point_lookup": "SELECT * FROM default.bench_distr WHERE id = {id}",
+    "count": "SELECT count() FROM default.bench_distr",
+    "aggregation": "SELECT toStartOfDay(event_time) AS day, count(), avg(value), max(value) "
+                   "FROM default.bench_distr GROUP BY day ORDER BY day",
+    "group_by_high_cardinality": "SELECT payload, count(), sum(value) FROM default.bench_distr "
+                                 "GROUP BY payload ORDER BY count() DESC LIMIT 10",
+}
+
+
+def load_bench_dataset(chi_name, rows, keys=100000):
+    # generated server side, payload has `keys` distinct values for the high cardinality GROUP BY
+    clickhouse.query(
+        chi_name,
+        "INSERT INTO default.bench_distr "
+        "SELECT toDateTime('2021-01-01 00:00:00') + number % (86400 * 30), number, rand() / 4294967295, "
+        f"concat('key-', toString(number % {keys})) FROM numbers({rows})",
+        advanced_params="--insert_distributed_sync=1",
+        timeout=1800,
+    )
+
+
+@TestScenario
+@Name("Query latency through a Distributed table")
+def bench_query(layout="1x1", rows=10000000, iterations=100, concurrency=4, queries=None):
+    queries = queries or list(bench_queries)
+    chi_name = benchmark.deploy(layout)
+    create_bench_tables(chi_name)
+
+    with Given(f"{rows} rows in default.bench_distr"):
+        load_bench_dataset(chi_name, rows)
+        loaded = sum(int(r["out"]) for r in benchmark.on_every_host(chi_name, "SELECT count() FROM default.bench_local"))
+        assert loaded == rows, error()
+        benchmark.on_every_host(chi_name, "OPTIMIZE TABLE default.bench_local FINAL", timeout=1800)
+
+    # queries are spread over every host as the initiator, workers must not resolve pods themselves
+    pods = clickhouse.pod_cache.fresh(chi_name, kubectl.namespace)["pods"]
+
+    def run_one(sql, i):
+        started = time.time()
+        ok, out = clickhouse.query_pod(
+            pods[i % len(pods)], sql.format(id=random.randrange(rows)), ns=kubectl.namespace, timeout=600,
+        )
+        return ok, time.time() - started, out
+
+    for name in queries:
+        sql = bench_queries[name]
+        with When(f"{name} {iterations} times with concurrency {concurrency}"):
+            # the first run of every host warms up the caches
+            warmup = [run_one(sql, i) for i in range(len(pods))]
+            started = time.time()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(lambda i: run_one(sql, i), range(iterations)))
+            elapsed = time.time() - started
+
+        with Then("Every query should succeed"):
+            failed = [out for ok, _, out in warmup + results if not ok]
+            assert len(failed) == 0, error(failed[0] if len(failed) > 0 else "")
+
+        values = {
+            "rows": rows,
+            "iterations": iterations,
+            "concurrency": concurrency,
+            "queries_per_second": round(iterations / elapsed, 1),
+            **{
+                f"latency_{k}_ms": round(v, 2)
+                for k, v in benchmark.percentiles([seconds * 1000 for _, seconds, _ in results]).items()
+            },
+        }
+        benchmark.report("query", values, layout=layout, query=name, transport=clickhouse.transport)
+    benchmark.undeploy(chi_name)
+
+
+def zookeeper_events(chi_name):
+    # ZooKeeper* counters of system.events summed over the hosts
+    events = {}
+    for r in benchmark.on_every_host(chi_name, "SELECT event, value FROM system.events WHERE event LIKE 'ZooKeeper%'"):
+        for line in r["out"].splitlines():
+            event, value = line.split("\t")
+            events[event] = events.get(event, 0) + int(value)
+    return events
+
+
+class VisibilityPoller:
+    """Polls a replica from a background thread and records how long after its insert every batch shows up there"""
+
+    def __init__(self, pod, table, interval, first_batch):
+        self.pod = pod
+        self.table = table
+        self.interval = interval
+        self.first_batch = first_batch
+        # batch -> lag in ms, by the clocks of the two servers
+        self.seen = {}
+        self.polls = []
+        self.errors = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            # the reader's now64() when the poll ran against the writer's now64() of the insert,
+            # already seen batches are skipped by the primary key
+            seen = ", ".join(str(b) for b in self.seen) or "0"
+            started = time.time()
+            ok, out = clickhouse.query_pod(
+                self.pod,
+                "SELECT batch, toUnixTimestamp64Micro(now64(6)) - toUnixTimestamp64Micro(max(ts)) "
+                f"FROM {self.table} WHERE batch >= {self.first_batch} AND batch NOT IN ({seen}) GROUP BY batch",
+                ns=kubectl.namespace, timeout=30,
+            )
+            self.polls.append(time.time() - started)
+            if not ok:
+                self.errors += 1
+            else:
+                for line in out.splitlines():
+                    batch, lag = line.split("\t")
+                    self.seen.setdefault(int(batch), int(lag) / 1000)
+            self.stopped.wait(self.interval)
+
+    def wait(self, batches, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline and not all(b in self.seen for b in batches):
+            time.sleep(self.interval)
+        return [b for b in batches if b not in self.seen]
+
+
+@TestScenario
+@Name("Replication lag of ReplicatedMergeTree inserts")
+def bench_replication_lag(batches=50, batch_sizes=(1, 1000, 100000), rates=(1, 10), poll_interval=0.01):
+    # rates are batches per second, every batch size is measured at every rate against one deployment
+    layout = "1x2-replicated"
+    chi_name = benchmark.deploy(layout)
+    table = "default.bench_replicated"
+    # unique ZooKeeper path, replica metadata of a dropped table may still be there
+    zk_path = f"/clickhouse/{{installation}}/{{cluster}}/tables/{{shard}}/default/bench_replicated_{int(time.time())}"
+
+    with Given(f"{table} on both replicas"):
+        benchmark.on_every_host(chi_name, f"DROP TABLE IF EXISTS {table}")
+        benchmark.on_every_host(
+            chi_name,
+            f"CREATE TABLE {table} (batch UInt32, id UInt64, ts DateTime64(6)) "
+            f"ENGINE ReplicatedMergeTree('{zk_path}', '{{replica}}') ORDER BY (batch, id)",
+        )
+    writer, reader = sorted(clickhouse.pod_cache.fresh(chi_name, kubectl.namespace)["pods"])
+
+    batch = 0
+    for batch_size in batch_sizes:
+        for rate in rates:
+            poller = VisibilityPoller(reader, table, poll_interval, batch + 1)
+            inserted = []
+            with When(f"{batches} batches of {batch_size} rows at {rate} batches per second are inserted on {writer}"):
+                events = zookeeper_events(chi_name)
+                poller.thread.start()
+                started = time.time()
+                for i in range(batches):
+                    batch += 1
+                    # open loop, a slow insert does not shift the schedule of the next ones
+                    time.sleep(max(started + i / rate - time.time(), 0))
+                    ok, out = clickhouse.query_pod(
+                        writer, f"INSERT INTO {table} SELECT {batch}, number, now64(6) FROM numbers({batch_size})",
+                        ns=kubectl.namespace, timeout=600,
+                    )
+                    assert ok, error(out)
+                    inserted.append(batch)
+                elapsed = time.time() - started
+
+            with Then(f"Every batch should become visible on {reader}"):
+                missing = poller.wait(inserted, timeout=300)
+                poller.stopped.set()
+                poller.thread.join()
+                assert len(missing) == 0, error(f"not replicated: {missing}")
+                zookeeper = zookeeper_events(chi_name)
+
+            # from the start of the insert on the writer, negative lags are clock skew between the servers
+            lags = [poller.seen[b] for b in inserted]
+            values = {
+                "batches": batches,
+                "batch_size": batch_size,
+                "rate": rate,
+                "achieved_rate": round(batches / elapsed, 2),
+                # lag resolution is bounded by the time between two polls on the reader
+                "poll_ms": round(sum(poller.polls) / len(poller.polls) * 1000, 2),
+                "lag_min_ms": round(min(lags), 2),
+                "poll_errors": poller.errors,
+                **{f"lag_{k}_ms": round(v, 2) for k, v in benchmark.percentiles(lags).items()},
+                **{f"lag_{k}_ms": v for k, v in benchmark.histogram(lags).items()},
+                **{
+                    f"zookeeper_{event}_per_batch": round((value - events.get(event, 0)) / batches, 2)
+                    for event, value in zookeeper.items()
+                },
+            }
+            benchmark.report("replication_lag", values, layout=layout, transport=clickhouse.transport)
+    benchmark.undeploy(chi_name)
+
+
+@TestScenario
+@Name("Reconcile latency by CHI size")
+def bench_reconcile(sizes=((1, 1), (2, 1), (2, 2), (4, 2), (4, 4), (8, 2), (8, 4), (16, 2))):
+    # sizes are (shards, replicas), the scaling curve gets one point per size
+    ns = kubectl.namespace
+    for shards, replicas in sizes:
+        hosts = shards * replicas
+        chi_name = f"bench-reconcile-{shards}x{replicas}"
+        label = f"-l clickhouse.altinity.com/chi={chi_name}"
+        # the default budget is meant for a handful of hosts
+        timeout = kubectl.wait_timeout(kubectl.max_retries + hosts)
+        config = benchmark.chi_manifest(chi_name, shards, replicas)
+
+        started = time.time()
+        kubectl.apply(config, ns=ns)
+        first_statefulset = benchmark.milestone(
+            started, "First StatefulSet should be created",
+            [("statefulset", "", label, ns)], lambda state: len(state[0]) > 0, timeout,
+        )
+        all_pods_ready = benchmark.milestone(
+            started, f"{hosts} pods should be Ready",
+            [("pod", "", label, ns)], lambda state: benchmark.pods_ready(state[0], hosts), timeout,
+        )
+        kubectl.wait_chi_status(chi_name, "Completed", ns=ns, retries=kubectl.max_retries + hosts)
+        completed = round(time.time() - started, 3)
+        kubectl.wait_objects(chi_name, {"statefulset": hosts, "pod": hosts, "service": hosts + 1}, ns=ns)
+
+        started = time.time()
+        kubectl.delete_chi(chi_name, ns=ns)
+        deleted = round(time.time() - started, 3)
+        os.remove(config)
+
+        values = {
+            "shards": shards,
+            "replicas": replicas,
+            "hosts": hosts,
+            "first_statefulset_seconds": first_statefulset,
+            "all_pods_ready_seconds": all_pods_ready,
+            "completed_seconds": completed,
+            "delete_seconds": deleted,
+        }
+        benchmark.report("reconcile", values, layout=f"{shards}x{replicas}", transport=kubectl.transport)
+
+
+def create_schema_objects(chi_name, tables, statements_per_query=200):
+    # a Log table and a Distributed table over it per i, the objects Schemer.HostCreateTables copies to new shards.
+    # Several statements per clickhouse-client call, the whole batch would not fit into one exec argument.
+    statements = []
+    for i in range(tables):
+        statements.append(f"CREATE TABLE default.bench_schema_local_{i} (id UInt64) ENGINE Log")
+        statements.append(
+            f"CREATE TABLE default.bench_schema_distr_{i} AS default.bench_schema_local_{i} "
+            f"ENGINE Distributed('all-sharded', default, bench_schema_local_{i})"
+        )
+    for i in range(0, len(statements), statements_per_query):
+        benchmark.on_every_host(chi_name, ";".join(statements[i:i + statements_per_query]), timeout=600)
+    return len(statements)
+
+
+def wait_schema(pod, expected, deadline, interval=0.5):
+    # Thread-safe, returns the time pod first has every bench_schema_ table, None on timeout
+    while time.time() < deadline:
+        ok, out = clickhouse.query_pod(
+            pod, "SELECT count() FROM system.tables WHERE database = 'default' AND startsWith(name, 'bench_schema_')",
+            ns=kubectl.namespace, timeout=60,
+        )
+        if ok and out.strip() == str(expected):
+            return time.time()
+        time.sleep(interval)
+    return None
+
+
+@TestScenario
+@Name("Scale-out and scale-in timing with schema propagation")
+def bench_scale(tables=(10, 100, 1000, 5000), shards=1, add_shards=2):
+    ns = kubectl.namespace
+    chi_name = "bench-scale"
+    cluster = "default"
+    label = f"-l clickhouse.altinity.com/chi={chi_name}"
+    spec = {"useTemplates": [{"name": "clickhouse-version"}]}
+    for count in tables:
+        kubectl.create_and_check(
+            config=benchmark.chi_manifest(chi_name, shards, 1, cluster, spec),
+            check={
+                "apply_templates": [settings.clickhouse_template],
+                "object_counts": {"statefulset": shards, "pod": shards, "service": shards + 1},
+                "do_not_delete": 1,
+            },
+        )
+        start_time = kubectl.get_field("pod", f"chi-{chi_name}-{cluster}-0-0-0", ".status.startTime")
+        with Given(f"{count} local and {count} Distributed tables"):
+            expected = create_schema_objects(chi_name, count)
+
+        new_pods = [f"chi-{chi_name}-{cluster}-{shard}-0-0" for shard in range(shards, shards + add_shards)]
+        hosts = shards + add_shards
+        timeout = kubectl.wait_timeout(kubectl.max_retries + hosts)
+        ready = {}
+
+        def record_ready(state):
+            # evaluated on every watch event or poll, notes when each new pod turns Ready
+            for pod in state[0]:
+                name = pod["metadata"]["name"]
+                if name in new_pods and name not in ready and benchmark.pods_ready([pod], 1):
+                    ready[name] = time.time()
+            return len(ready) == len(new_pods)
+
+        with When(f"Scale out from {shards} to {hosts} shards"):
+            scale_out = time.time()
+            kubectl.apply(benchmark.chi_manifest(chi_name, hosts, 1, cluster, spec), ns=ns)
+            # schema objects are polled from the start, the operator creates them before the CHI is Completed
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(new_pods)) as pool:
+                schema = pool.map(lambda pod: wait_schema(pod, expected, scale_out + timeout), new_pods)
+                benchmark.milestone(scale_out, "New pods should be Ready", [("pod", "", label, ns)], record_ready, timeout)
+                kubectl.wait_chi_status(chi_name, "Completed", ns=ns, retries=kubectl.max_retries + hosts)
+                completed = round(time.time() - scale_out, 3)
+                schema = dict(zip(new_pods, schema))
+
+        with Then("Unaffected pod should not be restarted"):
+            new_start_time = kubectl.get_field("pod", f"chi-{chi_name}-{cluster}-0-0-0", ".status.startTime")
+            assert start_time == new_start_time, error()
+
+        with And("Schema objects should be created on new shards"):
+            missing = [pod for pod, seen in schema.items() if seen is None]
+            assert len(missing) == 0, error(f"incomplete schema on {missing}")
+
+        with When(f"Scale in from {hosts} to {shards} shards"):
+            started = time.time()
+            kubectl.apply(benchmark.chi_manifest(chi_name, shards, 1, cluster, spec), ns=ns)
+            kubectl.wait_objects(chi_name, {"statefulset": shards, "pod": shards, "service": shards + 1}, ns=ns)
+            kubectl.wait_chi_status(chi_name, "Completed", ns=ns, retries=kubectl.max_retries + hosts)
+            scale_in = round(time.time() - started, 3)
+
+        host_ready = [ready[pod] - scale_out for pod in new_pods]
+        host_schema = [schema[pod] - scale_out for pod in new_pods]
+        values = {
+            "tables": expected,
+            "shards": shards,
+            "add_shards": add_shards,
+            "scale_out_completed_seconds": completed,
+            **{f"host_ready_{k}_seconds": round(v, 3) for k, v in benchmark.percentiles(host_ready).items()},
+            **{f"host_schema_{k}_seconds": round(v, 3) for k, v in benchmark.percentiles(host_schema).items()},
+            "schema_after_ready_max_seconds": round(max(schema[pod] - ready[pod] for pod in new_pods), 3),
+            "scale_in_seconds": scale_in,
+            "hosts": {
+                pod: {"ready": round(ready[pod] - scale_out, 3), "schema": round(schema[pod] - scale_out, 3)}
+                for pod in new_pods
+            },
+        }
+        benchmark.report("scale", values, tables=count, transport=kubectl.transport)
+        kubectl.delete_chi(chi_name, ns=ns)
+
+
+@TestScenario
+@Name("Availability and latency during a rolling ClickHouse upgrade")
+def bench_upgrade(qps=10, writes=0.5, settle=10):
+    # test_006 manifests, podTemplate switch to 19.16 and image change back to 19.11, probed the whole time
+    steps = [
+        ("configs/test-006-ch-upgrade-1.yaml", "yandex/clickhouse-server:19.11"),
+        ("configs/test-006-ch-upgrade-2.yaml", "yandex/clickhouse-server:19.16"),
+        ("configs/test-006-ch-upgrade-3.yaml", "yandex/clickhouse-server:19.11"),
+    ]
+    config, image = steps[0]
+    kubectl.create_and_check(config=config, check={"pod_count": 2, "pod_image": image, "do_not_delete": 1})
+    chi_name = manifest.get_chi_name(util.get_full_path(config))
+    pods = sorted(clickhouse.pod_cache.fresh(chi_name, kubectl.namespace)["pods"])
+
+    probe = benchmark.Probe(chi_name, pods, qps=qps, writes=writes)
+    with When(f"Probe at {qps} requests per second, {writes:.0%} writes"):
+        probe.start()
+        time.sleep(settle)
+        for config, image in steps[1:]:
+            probe.mark(f"{config} applied")
+            kubectl.create_and_check(config=config, check={"pod_count": 2, "pod_image": image, "do_not_delete": 1})
+            probe.mark(f"{image} rolled out")
+            time.sleep(settle)
+        probe.stop()
+
+    with Then("Timeline"):
+        print(probe.format_timeline())
+
+    requests = probe.requests
+    values = {
+        "qps": qps,
+        "writes": writes,
+        "requests": len(requests),
+        "error_rate": round(sum(1 for r in requests if not r["ok"]) / max(len(requests), 1), 4),
+    }
+    for op in ("read", "write"):
+        latencies = [r["ms"] for r in requests if r["op"] == op and r["ok"]]
+        values.update({f"{op}_latency_{k}_ms": round(v, 2) for k, v in benchmark.percentiles(latencies).items()})
+    for target in probe.targets:
+        windows = probe.windows(target)
+        name = "service" if target == "service" else f"host_{pods.index(target)}"
+        values[f"{name}_unavailable_seconds"] = round(sum(end - start for start, end in windows), 3)
+        values[f"{name}_windows"] = windows
+    values["marks"] = probe.marks
+    values["timeline"] = probe.timeline()
+    benchmark.report("upgrade", values, transport=clickhouse.transport)
+    kubectl.delete_chi(chi_name)
+
+
+@TestScenario
+@Name("Operator restart recovery with many CHIs")
+def bench_operator_restart(chis=50, namespaces=5):
+    # one host CHIs spread over namespaces, timed from the operator pod deletion until every CHI is reconciled again
+    chi_names = {f"{settings.test_namespace}-bench-{i}": [] for i in range(namespaces)}
+    for i in range(chis):
+        chi_names[f"{settings.test_namespace}-bench-{i % namespaces}"].append(f"bench-restart-{i}")
+    sources = [("chi", "", "", ns) for ns in chi_names]
+    timeout = kubectl.wait_timeout(kubectl.max_retries + chis)
+
+    with Given(f"{chis} CHIs in {namespaces} namespaces"):
+        for ns, names in chi_names.items():
+            kubectl.delete_ns(ns, ok_to_fail=True)
+            kubectl.create_ns(ns)
+            for name in names:
+                config = benchmark.chi_manifest(name, 1, 1)
+                kubectl.apply(config, ns=ns)
+                os.remove(config)
+
+        def all_completed(state):
+            chi_list = [chi for objects in state for chi in objects]
+            return len(chi_list) == chis and all(chi.get("status", {}).get("status") == "Completed" for chi in chi_list)
+
+        ok, state = kubectl.wait_until(sources, all_completed, timeout)
+        assert ok, error()
+        versions = {
+            (chi["metadata"]["namespace"], chi["metadata"]["name"]): chi["metadata"]["resourceVersion"]
+            for objects in state for chi in objects
+        }
+        pods = {
+            ns: {p["metadata"]["name"]: p["status"]["startTime"] for p in kubectl.get("pod", "", ns=ns)["items"]}
+            for ns in chi_names
+        }
+
+    reconciled = {}
+
+    def record_reconciled(state):
+        # an object written by the new operator and Completed again, evaluated on every watch event or poll
+        for objects in state:
+            for chi in objects:
+                key = (chi["metadata"]["namespace"], chi["metadata"]["name"])
+                if key not in reconciled and chi["metadata"]["resourceVersion"] != versions[key] and \
+                        chi.get("status", {}).get("status") == "Completed":
+                    reconciled[key] = time.time()
+        return len(reconciled) == chis
+
+    with When("Restart operator"):
+        requests = benchmark.apiserver_requests()
+        started = time.time()
+        restart_operator()
+        running = round(time.time() - started, 3)
+        all_reconciled = benchmark.milestone(
+            started, "Every CHI should be reconciled back to Completed", sources, record_reconciled, timeout,
+        )
+        requests = {
+            verb: round(count - requests.get(verb, 0)) for verb, count in benchmark.apiserver_requests().items()
+        }
+        memory = benchmark.operator_memory()
+
+    with Then("ClickHouse pods should not be restarted"):
+        for ns in chi_names:
+            new_pods = {p["metadata"]["name"]: p["status"]["startTime"] for p in kubectl.get("pod", "", ns=ns)["items"]}
+            assert new_pods == pods[ns], error()
+
+    values = {
+        "chis": chis,
+        "namespaces": namespaces,
+        "operator_running_seconds": running,
+        "all_reconciled_seconds": all_reconciled,
+        **{
+            f"reconciled_{k}_seconds": round(v, 3)
+            for k, v in benchmark.percentiles([t - started for t in reconciled.values()]).items()
+        },
+        "apiserver_requests": sum(requests.values()),
+        **{f"apiserver_{verb.lower()}_requests": count for verb, count in requests.items()},
+        "operator_peak_memory_bytes": memory.get("VmHWM", 0),
+        "operator_memory_bytes": memory.get("VmRSS", 0),
+    }
+    benchmark.report("operator_restart", values, chis=chis, transport=kubectl.transport)
+
+    with When("Delete CHIs and namespaces"):
+        for ns in chi_names:
+            kubectl.delete_all_chi(ns)
+            kubectl.delete_ns(ns, ok_to_fail=True)
+
+
+if main():
+    with Module("benchmark", flags=TE):
+        with Given(f"Clean namespace {settings.test_namespace}"):
+            kubectl.delete_all_chi(settings.test_namespace)
+            kubectl.delete_ns(settings.test_namespace, ok_to_fail=True)
+            kubectl.create_ns(settings.test_namespace)
+
+        with Given(f"clickhouse-operator {settings.operator_version}"):
+            set_operator_version(settings.operator_version)
+
+        for layout in benchmark.layouts:
+            run(test=bench_insert, args={"layout": layout})
+        for layout in benchmark.layouts:
+            run(test=bench_query, args={"layout": layout})
+        run(test=bench_replication_lag)
+        run(test=bench_reconcile)
+        run(test=bench_scale)
+        run(test=bench_upgrade)
+        run(test=bench_operator_restart)
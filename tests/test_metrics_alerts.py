@@ -3,12 +3,15 @@ import time
 import json
 import random
 
-from testflows.core import TestScenario, Name, When, Then, Given, And, main, run, Module
+from testflows.core import TestScenario, Name, When, Then, Given, And, main, run, Module, metric
 from testflows.asserts import error
 
 import settings
 import kubectl
 import clickhouse
+import alerts
+import alert_rules
+import scheduler
 
 from test_operator import set_operator_version, require_zookeeper
 from test_metrics_exporter import set_metrics_exporter_version
@@ -19,54 +22,126 @@ prometheus_spec = None
 
 clickhouse_operator_spec = None
 chi = None
+# manifests of the installed alert cluster, the 6 hosts ones with ALERT_WORKERS > 1
+chi_configs = {
+    2: ("configs/test-cluster-for-alerts.yaml", "configs/test-cluster-for-alerts-changed-settings.yaml"),
+    6: ("configs/test-cluster-for-alerts-parallel.yaml", "configs/test-cluster-for-alerts-parallel-changed-settings.yaml"),
+}
+chi_hosts = 2
 
 
 def check_alert_state(alert_name, alert_state="firing", labels=None, time_range="10s"):
     with Then(f"check {alert_name} for state {alert_state} and {labels} labels in {time_range}"):
-        prometheus_pod = prometheus_spec["items"][0]["metadata"]["name"]
-        cmd = f"exec -n {settings.prometheus_namespace} {prometheus_pod} -c prometheus -- "
-        cmd += "wget -qO- 'http://127.0.0.1:9090/api/v1/query?query=ALERTS{"
         if labels is None:
             labels = {}
         assert isinstance(labels, dict), error()
-
-        labels.update({"alertname": alert_name, "alertstate": alert_state})
-        cmd += ",".join([f"{name}=\"{value}\"" for name, value in labels.items()])
-        cmd += f"}}[{time_range}]' 2>/dev/null"
-        out = kubectl.launch(cmd)
-        out = json.loads(out)
-        assert "status" in out and out["status"] == "success", error("wrong response from prometheus query API")
-        if len(out["data"]["result"]) == 0:
-            with And("not present, empty result"):
-                return False
-        result_labels = out["data"]["result"][0]["metric"].items()
-        exists = all(item in result_labels for item in labels.items())
-        with And("got result and contains labels" if exists else "got result, but doesn't contain labels"):
-            return exists
+        try:
+            present = alerts.poller().check(alerts.Condition(alert_name, alert_state, labels, time_range))
+        except alerts.Unavailable as e:
+            assert False, error(str(e))
+        with And("got result and contains labels" if present else "not present, empty result"):
+            return present
+
+
+def wait_scrapes(scrapes=2, after=None):
+    # metrics-exporter data newer than after, now by default, is in Prometheus, whatever its scrape interval.
+    # The exporter collects from ClickHouse on its own, the default of 2 scrapes covers a collection in between.
+    with And(f"wait {scrapes} scrapes of {settings.prometheus_scrape_job}"):
+        try:
+            alerts.poller().wait_scrapes(scrapes, after)
+        except alerts.Unavailable as e:
+            assert False, error(str(e))
+
+
+def wait_alert_states(conditions, callback=None, max_try=20, sleep_time=10, scrapes=0):
+    # Waits for every alerts.Condition at once, the shared poller makes one ALERTS request per interval for all of them.
+    # callback is called every sleep_time until every condition is met, returns {condition: met}.
+    # With scrapes, every sleep_time starts after that many scrapes following the callback.
+    poller = alerts.poller()
+    for condition in conditions:
+        if condition.timing is None and condition.labels["alertstate"] == "firing":
+            labels = {k: v for k, v in condition.labels.items() if k not in ("alertname", "alertstate")}
+            if condition.expected_state:
+                condition.timing = alerts.timings.firing(condition.alert_name, labels)
+            else:
+                condition.timing = alerts.timings.resolving(condition.alert_name, labels)
+        poller.watch(condition)
+    try:
+        for i in range(max_try):
+            if callback is not None:
+                callback()
+            if scrapes > 0:
+                wait_scrapes(scrapes)
+            deadline = time.time() + sleep_time
+            for condition in conditions:
+                condition.wait(max(deadline - time.time(), 0))
+            pending = [c for c in conditions if not c.matched.is_set()]
+            if len(pending) == 0:
+                break
+            with And(f"not ready after {(i + 1) * sleep_time}s: {', '.join(str(c) for c in pending)}"):
+                pass
+    finally:
+        for condition in conditions:
+            poller.unwatch(condition)
+    for condition in conditions:
+        if condition.timing is not None and condition.matched.is_set():
+            try:
+                condition.timing.fetch(poller)
+            except alerts.Unavailable as e:
+                print(f"alert timing of {condition.alert_name} stays the polled estimate: {e}")
+    return {condition: condition.matched.is_set() for condition in conditions}
 
 
 def wait_alert_state(alert_name, alert_state, expected_state, labels=None, callback=None, max_try=20, sleep_time=10,
-                     time_range="10s"):
-    catched = False
-    for i in range(max_try):
-        if not callback is None:
-            callback()
-        if expected_state == check_alert_state(alert_name, alert_state, labels, time_range):
-            catched = True
-            break
-        with And(f"not ready, wait {sleep_time}s"):
-            time.sleep(sleep_time)
-    return catched
+                     time_range="10s", scrapes=0):
+    condition = alerts.Condition(alert_name, alert_state, labels, time_range, expected_state)
+    with Then(f"wait {condition}"):
+        return wait_alert_states([condition], callback, max_try, sleep_time, scrapes)[condition]
+
+
+def report_alert_timings():
+    # measured detection latency of every alert occurrence next to the for: of its rule
+    durations = {}
+    for rule in alert_rules.load_rules():
+        durations[rule.name] = max(durations.get(rule.name, 0), rule.duration)
+    occurrences = alerts.timings.report()
+    for occurrence in occurrences:
+        occurrence["for"] = durations.get(occurrence["alert"])
+        if occurrence["fault_to_firing"] is not None and occurrence["for"] is not None:
+            occurrence["detection_overhead"] = round(occurrence["fault_to_firing"] - occurrence["for"], 3)
+    if settings.alert_timings != "":
+        with open(settings.alert_timings, "a") as f:
+            for occurrence in occurrences:
+                f.write(json.dumps(occurrence) + "\n")
+    columns = ("for", "fault_to_pending", "fault_to_firing", "pending_to_firing", "recovered_to_resolved")
+    lines = [f"{'alert':<52}" + "".join(f"{c:>22}" for c in columns)]
+    for occurrence in occurrences:
+        lines.append(
+            f"{occurrence['alert']:<52}" +
+            "".join(f"{'-' if occurrence[c] is None else occurrence[c]:>22}" for c in columns)
+        )
+    with Then("Alert timings, seconds\n" + "\n".join(lines)):
+        for occurrence in occurrences:
+            for name in ("fault_to_firing", "recovered_to_resolved", "detection_overhead"):
+                if occurrence.get(name) is not None:
+                    metric(f"alert_{occurrence['alert']}_{name}", occurrence[name], "s")
+
+
+def scenario_hosts():
+    # [(pod, fqdn)] the scenario may use, the ones given by the scheduler or every host of the CHI
+    indexes = range(len(chi["status"]["pods"]))
+    if settings.alert_scenario_hosts != "":
+        indexes = [int(i) for i in settings.alert_scenario_hosts.split(",")]
+    return [(chi["status"]["pods"][i], chi["status"]["fqdns"][i]) for i in indexes]
+
+
+def random_host():
+    return random.choice(scenario_hosts())
 
 
 def random_pod_choice_for_callbacks():
-    first_idx = random.randint(0, 1)
-    first_pod = chi["status"]["pods"][first_idx]
-    first_svc = chi["status"]["fqdns"][first_idx]
-    second_idx = 0 if first_idx == 1 else 1
-    second_pod = chi["status"]["pods"][second_idx]
-    second_svc = chi["status"]["fqdns"][second_idx]
-    return second_pod, second_svc, first_pod, first_svc
+    (first_pod, first_svc), (second_pod, second_svc) = random.sample(scenario_hosts(), 2)
+    return first_pod, first_svc, second_pod, second_svc
 
 
 def drop_table_on_cluster(cluster_name='all-sharded', table='default.test'):
@@ -142,9 +217,7 @@ def test_metrics_exporter_down():
 @TestScenario
 @Name("Check ClickHouseServerDown, ClickHouseServerRestartRecently")
 def test_clickhouse_server_reboot():
-    random_idx = random.randint(0, 1)
-    clickhouse_pod = chi["status"]["pods"][random_idx]
-    clickhouse_svc = chi["status"]["fqdns"][random_idx]
+    clickhouse_pod, clickhouse_svc = random_host()
 
     def reboot_clickhouse_server():
         kubectl.launch(
@@ -178,9 +251,7 @@ def test_clickhouse_server_reboot():
 @TestScenario
 @Name("Check ClickHouseDNSErrors")
 def test_clickhouse_dns_errors():
-    random_idx = random.randint(0, 1)
-    clickhouse_pod = chi["status"]["pods"][random_idx]
-    clickhouse_svc = chi["status"]["fqdns"][random_idx]
+    clickhouse_pod, clickhouse_svc = random_host()
 
     old_dns = kubectl.launch(
         f"exec -n {kubectl.namespace} {clickhouse_pod} -c clickhouse -- cat /etc/resolv.conf",
@@ -227,10 +298,7 @@ def test_distributed_files_to_insert():
     tries = 0
     # we need more than 50 delayed files for catch
     while files_to_insert_from_disk <= 55 and files_to_insert_from_metrics <= 55 and tries < 500:
-        kubectl.launch(
-            f"exec -n {kubectl.namespace} {restarted_pod} -c clickhouse -- kill 1",
-            ok_to_fail=True,
-        )
+        kubectl.exec_in_pod(restarted_pod, "kill 1", container="clickhouse", ns=kubectl.namespace, ok_to_fail=True)
         clickhouse.query(chi["metadata"]["name"], insert_sql, pod=delayed_pod, host=delayed_pod, ns=kubectl.namespace)
         files_to_insert_from_metrics = clickhouse.query(
             chi["metadata"]["name"], "SELECT value FROM system.metrics WHERE metric='DistributedFilesToInsert'",
@@ -238,9 +306,9 @@ def test_distributed_files_to_insert():
         )
         files_to_insert_from_metrics = int(files_to_insert_from_metrics)
 
-        files_to_insert_from_disk = int(kubectl.launch(
-            f"exec -n {kubectl.namespace} {delayed_pod} -c clickhouse -- bash -c 'ls -la /var/lib/clickhouse/data/default/test_distr/*/*.bin 2>/dev/null | wc -l'",
-            ok_to_fail=False,
+        files_to_insert_from_disk = int(kubectl.exec_in_pod(
+            delayed_pod, "ls -la /var/lib/clickhouse/data/default/test_distr/*/*.bin 2>/dev/null | wc -l",
+            container="clickhouse", ns=kubectl.namespace,
         ))
 
     with When("reboot clickhouse-server pod"):
@@ -306,7 +374,6 @@ def test_delayed_and_rejected_insert_and_max_part_count_for_partition_and_low_in
     create_table_on_cluster()
     delayed_pod, delayed_svc, rejected_pod, rejected_svc = random_pod_choice_for_callbacks()
 
-    prometheus_scrape_interval = 15
     # default values in system.merge_tree_settings
     parts_to_throw_insert = 300
     parts_to_delay_insert = 150
@@ -327,40 +394,40 @@ def test_delayed_and_rejected_insert_and_max_part_count_for_partition_and_low_in
             # @TODO we need only one query after resolve https://github.com/ClickHouse/ClickHouse/issues/11384
             sql = min_block + "INSERT INTO default.test(event_time, test) SELECT now(), number FROM system.numbers LIMIT 1;"
             clickhouse.query_with_error(chi_name, sql, host=selected_svc, ns=kubectl.namespace)
-            with And(f"wait prometheus_scrape_interval={prometheus_scrape_interval}*2 sec"):
-                time.sleep(prometheus_scrape_interval * 2)
+            wait_scrapes()
 
             sql = min_block + "INSERT INTO default.test(event_time, test) SELECT now(), number FROM system.numbers LIMIT 1;"
             clickhouse.query_with_error(chi_name, sql, host=selected_svc, ns=kubectl.namespace)
 
+    delayed_alerts = {
+        "ClickHouseDelayedInsertThrottling": "30s",
+        "ClickHouseMaxPartCountForPartition": "45s",
+        "ClickHouseLowInsertedRowsPerQuery": "60s",
+    }
+    for name in delayed_alerts:
+        alerts.timings.fault(name, {"hostname": delayed_svc})
     insert_many_parts_to_clickhouse()
-    with Then("check ClickHouseDelayedInsertThrottling firing"):
-        fired = wait_alert_state("ClickHouseDelayedInsertThrottling", "firing", True, labels={"hostname": delayed_svc}, time_range="30s",
-                                 sleep_time=5)
-        assert fired, error("can't get ClickHouseDelayedInsertThrottling alert in firing state")
-    with Then("check ClickHouseMaxPartCountForPartition firing"):
-        fired = wait_alert_state("ClickHouseMaxPartCountForPartition", "firing", True, labels={"hostname": delayed_svc}, time_range="45s",
-                                 sleep_time=5)
-        assert fired, error("can't get ClickHouseMaxPartCountForPartition alert in firing state")
-    with Then("check ClickHouseLowInsertedRowsPerQuery firing"):
-        fired = wait_alert_state("ClickHouseLowInsertedRowsPerQuery", "firing", True, labels={"hostname": delayed_svc}, time_range="60s",
-                                 sleep_time=5)
-        assert fired, error("can't get ClickHouseLowInsertedRowsPerQuery alert in firing state")
+    with Then(f"check {', '.join(delayed_alerts)} firing"):
+        fired = wait_alert_states(
+            [alerts.Condition(name, "firing", {"hostname": delayed_svc}, time_range) for name, time_range in delayed_alerts.items()],
+            sleep_time=5,
+        )
+        for condition, ok in fired.items():
+            assert ok, error(f"can't get {condition.alert_name} alert in firing state")
 
     clickhouse.query(chi_name, "SYSTEM START MERGES default.test", host=selected_svc, ns=kubectl.namespace)
 
-    with Then("check ClickHouseDelayedInsertThrottling gone away"):
-        resolved = wait_alert_state("ClickHouseDelayedInsertThrottling", "firing", False, labels={"hostname": delayed_svc}, sleep_time=5)
-        assert resolved, error("can't check ClickHouseDelayedInsertThrottling alert is gone away")
-    with Then("check ClickHouseMaxPartCountForPartition gone away"):
-        resolved = wait_alert_state("ClickHouseMaxPartCountForPartition", "firing", False, labels={"hostname": delayed_svc}, sleep_time=5)
-        assert resolved, error("can't check ClickHouseMaxPartCountForPartition alert is gone away")
-    with Then("check ClickHouseLowInsertedRowsPerQuery gone away"):
-        resolved = wait_alert_state("ClickHouseLowInsertedRowsPerQuery", "firing", False, labels={"hostname": delayed_svc}, sleep_time=5)
-        assert resolved, error("can't check ClickHouseLowInsertedRowsPerQuery alert is gone away")
+    with Then(f"check {', '.join(delayed_alerts)} gone away"):
+        resolved = wait_alert_states(
+            [alerts.Condition(name, "firing", {"hostname": delayed_svc}, expected_state=False) for name in delayed_alerts],
+            sleep_time=5,
+        )
+        for condition, ok in resolved.items():
+            assert ok, error(f"can't check {condition.alert_name} alert is gone away")
 
     parts_limits = parts_to_throw_insert
     selected_svc = rejected_svc
+    alerts.timings.fault("ClickHouseRejectedInsert", {"hostname": rejected_svc})
     insert_many_parts_to_clickhouse()
     with Then("check ClickHouseRejectedInsert firing"):
         fired = wait_alert_state("ClickHouseRejectedInsert", "firing", True, labels={"hostname": rejected_svc}, time_range="30s",
@@ -378,14 +445,19 @@ def test_delayed_and_rejected_insert_and_max_part_count_for_partition_and_low_in
 @TestScenario
 @Name("Check ClickHouseLongestRunningQuery")
 def test_longest_running_query():
-    long_running_pod, long_running_svc, _, _ = random_pod_choice_for_callbacks()
+    long_running_pod, long_running_svc = random_host()
     # 600s trigger + 2*30s - double prometheus scraping interval
-    clickhouse.query(chi["metadata"]["name"], "SELECT now(),sleepEachRow(1),number FROM system.numbers LIMIT 660",
-                     host=long_running_svc, timeout=670)
+    long_query = clickhouse.query_async(
+        chi["metadata"]["name"], "SELECT now(),sleepEachRow(1),number FROM system.numbers LIMIT 660",
+        host=long_running_svc, timeout=670,
+    )
     with Then("check ClickHouseLongestRunningQuery firing"):
+        # the alert is awaited while the query runs, max_try covers the whole 660s of it
         fired = wait_alert_state("ClickHouseLongestRunningQuery", "firing", True, labels={"hostname": long_running_svc},
-                                 time_range='30s', sleep_time=5)
+                                 time_range='30s', sleep_time=5, max_try=140)
         assert fired, error("can't get ClickHouseLongestRunningQuery alert in firing state")
+    with Then(f"cancel query {long_query.query_id}, progress {long_query.progress()}"):
+        assert long_query.cancel(), error()
     with Then("check ClickHouseLongestRunningQuery gone away"):
         resolved = wait_alert_state("ClickHouseLongestRunningQuery", "firing", False, labels={"hostname": long_running_svc})
         assert resolved, error("can't check ClickHouseLongestRunningQuery alert is gone away")
@@ -394,7 +466,7 @@ def test_longest_running_query():
 @TestScenario
 @Name("Check ClickHouseQueryPreempted")
 def test_query_preempted():
-    priority_pod, priority_svc, _, _ = random_pod_choice_for_callbacks()
+    priority_pod, priority_svc = random_host()
 
     def run_queries_with_priority():
         sql = ""
@@ -462,7 +534,6 @@ def test_replicas_max_abosulute_delay():
     stop_replica_pod, stop_replica_svc, insert_pod, insert_svc = random_pod_choice_for_callbacks()
     create_table_on_cluster('all-replicated', 'default.test_repl',
                             '(event_time DateTime, test UInt64) ENGINE ReplicatedMergeTree(\'/clickhouse/tables/{installation}-{shard}/test_repl\', \'{replica}\') ORDER BY tuple()')
-    prometheus_scrape_interval = 15
 
     def restart_clickhouse_and_insert_to_replicated_table():
         with When(f"stop replica fetches on {stop_replica_svc}"):
@@ -478,7 +549,7 @@ def test_replicas_max_abosulute_delay():
 
     with Then("check ClickHouseReplicasMaxAbsoluteDelay firing"):
         fired = wait_alert_state("ClickHouseReplicasMaxAbsoluteDelay", "firing", True, labels={"hostname": stop_replica_svc},
-                                 time_range='60s', sleep_time=prometheus_scrape_interval * 2,
+                                 time_range='60s', sleep_time=15, max_try=40, scrapes=2,
                                  callback=restart_clickhouse_and_insert_to_replicated_table)
         assert fired, error("can't get ClickHouseReadonlyReplica alert in firing state")
 
@@ -497,7 +568,7 @@ def test_replicas_max_abosulute_delay():
 @TestScenario
 @Name("Check ClickHouseTooManyConnections")
 def test_too_many_connections():
-    too_many_connection_pod, too_many_connection_svc, _, _ = random_pod_choice_for_callbacks()
+    too_many_connection_pod, too_many_connection_svc = random_host()
     cmd = "export DEBIAN_FRONTEND=noninteractive; apt-get update; apt-get install -y netcat mysql-client"
     kubectl.launch(
         f"exec -n {kubectl.namespace} {too_many_connection_pod} -c clickhouse -- bash -c  \"{cmd}\"",
@@ -544,7 +615,7 @@ def test_too_many_connections():
 @TestScenario
 @Name("Check ClickHouseTooMuchRunningQueries")
 def test_too_much_running_queries():
-    _, _, too_many_queries_pod, too_many_queries_svc = random_pod_choice_for_callbacks()
+    too_many_queries_pod, too_many_queries_svc = random_host()
     cmd = "export DEBIAN_FRONTEND=noninteractive; apt-get update; apt-get install -y mysql-client"
     kubectl.launch(
         f"exec -n {kubectl.namespace} {too_many_queries_pod} -c clickhouse -- bash -c  \"{cmd}\"",
@@ -588,20 +659,20 @@ def test_too_much_running_queries():
 @TestScenario
 @Name("Check ClickHouseSystemSettingsChanged")
 def test_system_settings_changed():
-    changed_pod, changed_svc, _, _ = random_pod_choice_for_callbacks()
+    changed_pod, changed_svc = random_host()
 
     with When("apply changed settings"):
         kubectl.create_and_check(
-            config="configs/test-cluster-for-alerts-changed-settings.yaml",
+            config=chi_configs[chi_hosts][1],
             check={
                 "apply_templates": [
                     "templates/tpl-clickhouse-latest.yaml",
                     "templates/tpl-persistent-volume-100Mi.yaml"
                 ],
                 "object_counts": {
-                    "statefulset": 2,
-                    "pod": 2,
-                    "service": 3,
+                    "statefulset": chi_hosts,
+                    "pod": chi_hosts,
+                    "service": chi_hosts + 1,
                 },
                 "do_not_delete": 1
             }
@@ -614,16 +685,16 @@ def test_system_settings_changed():
 
     with When("rollback changed settings"):
         kubectl.create_and_check(
-            config="configs/test-cluster-for-alerts.yaml",
+            config=chi_configs[chi_hosts][0],
             check={
                 "apply_templates": [
                     "templates/tpl-clickhouse-latest.yaml",
                     "templates/tpl-persistent-volume-100Mi.yaml"
                 ],
                 "object_counts": {
-                    "statefulset": 2,
-                    "pod": 2,
-                    "service": 3,
+                    "statefulset": chi_hosts,
+                    "pod": chi_hosts,
+                    "service": chi_hosts + 1,
                 },
                 "do_not_delete": 1
             }
@@ -637,27 +708,25 @@ def test_system_settings_changed():
 @TestScenario
 @Name("Check ClickHouseVersionChanged")
 def test_version_changed():
-    changed_pod, changed_svc, _, _ = random_pod_choice_for_callbacks()
+    changed_pod, changed_svc = random_host()
 
     with When("apply changed settings"):
         kubectl.create_and_check(
-            config="configs/test-cluster-for-alerts-changed-settings.yaml",
+            config=chi_configs[chi_hosts][1],
             check={
                 "apply_templates": [
                     "templates/tpl-clickhouse-20.7.yaml",
                     "templates/tpl-persistent-volume-100Mi.yaml"
                 ],
                 "object_counts": {
-                    "statefulset": 2,
-                    "pod": 2,
-                    "service": 3,
+                    "statefulset": chi_hosts,
+                    "pod": chi_hosts,
+                    "service": chi_hosts + 1,
                 },
                 "do_not_delete": 1
             }
         )
-        prometheus_scrape_interval = 15
-        with And(f"wait prometheus_scrape_interval={prometheus_scrape_interval}*2 sec"):
-            time.sleep(prometheus_scrape_interval * 2)
+        wait_scrapes()
 
     with Then("check ClickHouseVersionChanged firing"):
         fired = wait_alert_state("ClickHouseVersionChanged", "firing", True, labels={"hostname": changed_svc},
@@ -666,16 +735,16 @@ def test_version_changed():
 
     with When("rollback changed settings"):
         kubectl.create_and_check(
-            config="configs/test-cluster-for-alerts.yaml",
+            config=chi_configs[chi_hosts][0],
             check={
                 "apply_templates": [
                     "templates/tpl-clickhouse-latest.yaml",
                     "templates/tpl-persistent-volume-100Mi.yaml"
                 ],
                 "object_counts": {
-                    "statefulset": 2,
-                    "pod": 2,
-                    "service": 3,
+                    "statefulset": chi_hosts,
+                    "pod": chi_hosts,
+                    "service": chi_hosts + 1,
                 },
                 "do_not_delete": 1
             }
@@ -719,7 +788,7 @@ def test_zookeeper_hardware_exceptions():
 @TestScenario
 @Name("Check ClickHouseDistributedSyncInsertionTimeoutExceeded")
 def test_distributed_sync_insertion_timeout():
-    sync_pod, sync_svc, restarted_pod, restarted_svc = random_pod_choice_for_callbacks()
+    sync_pod, sync_svc = random_host()
     create_distributed_table_on_cluster(local_engine='ENGINE Null()')
 
     def insert_distributed_sync():
@@ -791,6 +860,56 @@ def test_zookeeper_alerts():
         assert resolved, error("can't check ZookeeperRestartRecently alert is gone away")
 
 
+# What every scenario needs to run next to others on configs/test-cluster-for-alerts-parallel.yaml.
+# Alerts are scoped by the hostname label of the hosts a scenario gets, resources are not bound to a host:
+# "zookeeper" ON CLUSTER DDL, "hosts" every host up for ON CLUSTER DDL and Distributed, tables by name.
+# Every scenario shares "exporter" and "chi", its metrics and the CHI manifest.
+footprints = {
+    "test_prometheus_setup": scheduler.Footprint(),
+    "test_read_only_replica": scheduler.Footprint(2, shared={"hosts"}, exclusive={"zookeeper", "default.test_repl"}),
+    "test_metrics_exporter_down": scheduler.Footprint(0, exclusive={"exporter"}),
+    "test_clickhouse_dns_errors": scheduler.Footprint(1),
+    "test_replicas_max_abosulute_delay": scheduler.Footprint(2, shared={"zookeeper", "hosts"}, exclusive={"default.test_repl"}),
+    "test_distributed_connection_exceptions": scheduler.Footprint(2, shared={"zookeeper"},
+                                                                  exclusive={"hosts", "default.test", "default.test_distr"}),
+    "test_delayed_and_rejected_insert_and_max_part_count_for_partition_and_low_inserted_rows_per_query": scheduler.Footprint(
+        2, shared={"zookeeper", "hosts"}, exclusive={"default.test"}),
+    "test_too_many_connections": scheduler.Footprint(1),
+    "test_too_much_running_queries": scheduler.Footprint(1),
+    "test_longest_running_query": scheduler.Footprint(1),
+    # both reconfigure and restart every host of the CHI
+    "test_system_settings_changed": scheduler.Footprint(1, exclusive={"chi"}),
+    "test_version_changed": scheduler.Footprint(1, exclusive={"chi"}),
+    "test_zookeeper_hardware_exceptions": scheduler.Footprint(2, exclusive={"zookeeper"}),
+    "test_distributed_sync_insertion_timeout": scheduler.Footprint(1, shared={"zookeeper", "hosts"},
+                                                                   exclusive={"default.test", "default.test_distr"}),
+    "test_distributed_files_to_insert": scheduler.Footprint(2, shared={"zookeeper"},
+                                                            exclusive={"hosts", "default.test", "default.test_distr"}),
+    "test_clickhouse_server_reboot": scheduler.Footprint(1, exclusive={"hosts"}),
+    "test_zookeeper_alerts": scheduler.Footprint(0, exclusive={"zookeeper"}),
+}
+for footprint in footprints.values():
+    footprint.shared |= {"exporter", "chi"} - footprint.exclusive
+
+
+def run_parallel(test_cases):
+    names = {id(v): k for k, v in globals().items()}
+    jobs = [(names[id(t)], footprints[names[id(t)]]) for t in test_cases]
+    with When(f"run {len(jobs)} scenarios by {settings.alert_workers} on {len(chi['status']['pods'])} hosts"):
+        finished = scheduler.run(
+            jobs, len(chi["status"]["pods"]), workers=settings.alert_workers,
+            command=lambda job: scheduler.python_command(
+                __file__, ALERT_SCENARIO=job.name, ALERT_SCENARIO_HOSTS=",".join(str(i) for i in job.hosts),
+            ),
+        )
+    for job in finished:
+        with Then(f"{job.name} on hosts {job.hosts}: exit code {job.returncode} in {job.seconds}s, log {job.log}"):
+            if job.returncode != 0:
+                with open(job.log) as log:
+                    print(log.read()[-20000:])
+            assert job.returncode == 0, error()
+
+
 if main():
     with Module("main"):
         with Given("get information about prometheus installation"):
@@ -809,30 +928,38 @@ if main():
                 label="-l app=prometheus,prometheus=prometheus"
             )
             assert "items" in prometheus_spec and len(prometheus_spec["items"]) > 0 and "metadata" in prometheus_spec["items"][0], "invalid prometheus_spec"
-
-        with Given("install zookeeper+clickhouse"):
-            kubectl.delete_ns(kubectl.namespace, ok_to_fail=True)
-            kubectl.create_ns(kubectl.namespace)
-            require_zookeeper()
-            kubectl.create_and_check(
-                config="configs/test-cluster-for-alerts.yaml",
-                check={
-                    "apply_templates": [
-                        "templates/tpl-clickhouse-latest.yaml",
-                        "templates/tpl-persistent-volume-100Mi.yaml"
-                    ],
-                    "object_counts": {
-                        "statefulset": 2,
-                        "pod": 2,
-                        "service": 3,
-                    },
-                    "do_not_delete": 1
-                }
-            )
+            alerts.poller(prometheus_spec["items"][0]["metadata"]["name"])
+
+        # a scenario started by the scheduler finds zookeeper and the CHI installed
+        if settings.alert_scenario == "":
+            with Given("install zookeeper+clickhouse"):
+                kubectl.delete_ns(kubectl.namespace, ok_to_fail=True)
+                kubectl.create_ns(kubectl.namespace)
+                require_zookeeper()
+                hosts = 2 if settings.alert_workers <= 1 else 6
+                kubectl.create_and_check(
+                    config=chi_configs[hosts][0],
+                    check={
+                        "apply_templates": [
+                            "templates/tpl-clickhouse-latest.yaml",
+                            "templates/tpl-persistent-volume-100Mi.yaml"
+                        ],
+                        "object_counts": {
+                            "statefulset": hosts,
+                            "pod": hosts,
+                            "service": hosts + 1,
+                        },
+                        "do_not_delete": 1
+                    }
+                )
+
+        with Given("get information about clickhouse-operator and clickhouse"):
             clickhouse_operator_spec = kubectl.get(
                 "pod", name="", ns=settings.operator_namespace, label="-l app=clickhouse-operator"
             )
             chi = kubectl.get("chi", ns=kubectl.namespace, name="test-cluster-for-alerts")
+            chi_hosts = len(chi["status"]["pods"])
+            clickhouse.precompute_pods(chi["metadata"]["name"], ns=kubectl.namespace, chi=chi)
 
         with Module("metrics_alerts"):
             test_cases = [
@@ -854,5 +981,17 @@ if main():
                 test_clickhouse_server_reboot,
                 test_zookeeper_alerts,
             ]
-            for t in test_cases:
-                run(test=t)
+            if settings.alert_scenario != "":
+                run(test=globals()[settings.alert_scenario])
+            elif settings.alert_workers <= 1:
+                for t in test_cases:
+                    run(test=t)
+            else:
+                run(test=test_prometheus_setup)
+                run_parallel([t for t in test_cases if t is not test_prometheus_setup])
+
+            clickhouse.report_pod_cache_stats()
+            clickhouse.report_query_trace()
+            with Then(f"Alert poller: {alerts.poller().stats}"):
+                pass
+            report_alert_timings()
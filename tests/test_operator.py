@@ -545,18 +545,13 @@ def test_013():
 
     with And("Schema objects should be migrated to new shards"):
         for obj in schema_objects:
-            out = clickhouse.query(
-                chi,
-                f"SELECT count() FROM system.tables WHERE name = '{obj}'",
-                host=f"chi-{chi}-{cluster}-1-0"
-            )
-            assert out == "1"
-            out = clickhouse.query(
+            results = clickhouse.query_cluster(
                 chi,
                 f"SELECT count() FROM system.tables WHERE name = '{obj}'",
-                host=f"chi-{chi}-{cluster}-2-0"
+                cluster=cluster,
             )
-            assert out == "1"
+            assert len(results) == 3 and all(r["out"] == "1" for r in results), error(
+                clickhouse.format_cluster_results(results))
 
     with When("Remove shards"):
         kubectl.create_and_check(
@@ -671,11 +666,13 @@ def test_014():
 
         with Then("Schema objects should be migrated to the new replica"):
             for obj in schema_objects:
-                out = clickhouse.query(
+                results = clickhouse.query_cluster(
                     chi,
                     f"SELECT count() FROM system.tables WHERE name = '{obj}'",
-                    host=f"chi-{chi}-{cluster}-0-2")
-                assert out == "1"
+                    cluster=cluster,
+                )
+                assert len(results) == 3 and all(r["out"] == "1" for r in results), error(
+                    clickhouse.format_cluster_results(results))
 
         with And("Replicated table should have the data"):
             out = clickhouse.query(